@@ -1,9 +1,56 @@
+import json
+
 from django.contrib import admin
-from .models import OpenAIRequest
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .archive import iter_request_records
+from .models import OpenAIRequest, PromptBlob, LLMResponseCache
+from .streaming import streaming_response
 
 
 @admin.register(OpenAIRequest)
 class OpenAIRequestAdmin(admin.ModelAdmin):
     list_display = ('id', 'tokens_used', 'created_at')
-    search_fields = ('prompt', 'response')
+    # プロンプトは圧縮して保存しているため、レスポンスのみ検索できる
+    search_fields = ('response',)
+    list_filter = ('created_at',)
+    fields = ('prompt_text', 'response', 'tokens_used', 'created_at')
+    readonly_fields = ('prompt_text', 'created_at')
+    # 大きなテーブルで全件の COUNT(*) を実行しない
+    show_full_result_count = False
+    actions = ['download_jsonl']
+
+    def get_queryset(self, request):
+        # 一覧ではレスポンスの本文を読み込まない
+        return super().get_queryset(request).defer('response')
+
+    @admin.display(description='プロンプト')
+    def prompt_text(self, obj):
+        return obj.prompt
+
+    @admin.action(description='選択したリクエストをJSONLでダウンロード')
+    def download_jsonl(self, request, queryset):
+        # 選択件数が多くても一定件数ずつ読み込みながら送信する（ASGIでも送信前にすべて読み込まない）
+        lines = (json.dumps(record, ensure_ascii=False) + '\n' for record in iter_request_records(queryset))
+        response = streaming_response(request, lines, content_type='application/x-ndjson; charset=utf-8')
+        response['Content-Disposition'] = content_disposition_header(
+            True, f'openai-requests-{timezone.now():%Y%m%d-%H%M%S}.jsonl'
+        )
+        return response
+
+
+@admin.register(PromptBlob)
+class PromptBlobAdmin(admin.ModelAdmin):
+    list_display = ('hash', 'size', 'created_at')
+    search_fields = ('hash',)
+    exclude = ('data',)
+    readonly_fields = ('hash', 'size', 'created_at', 'text')
+    show_full_result_count = False
+
+
+@admin.register(LLMResponseCache)
+class LLMResponseCacheAdmin(admin.ModelAdmin):
+    list_display = ('key', 'tokens_used', 'created_at', 'last_accessed_at')
+    search_fields = ('key',)
     list_filter = ('created_at',)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # リクエスト・Celeryタスクの終了時にLLM呼び出しの記録を保存するシグナルを登録する
+        from . import request_log  # noqa: F401
@@ -0,0 +1,129 @@
+import gzip
+import json
+import tempfile
+import zlib
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import OpenAIRequest, OpenAIRequestSegment, PromptBlob, PROMPT_SEGMENT_SEPARATOR
+
+ARCHIVE_DIRECTORY = 'archives/openai-requests'
+
+
+def iter_request_records(queryset, batch_size=500):
+    """
+    OpenAIRequest を batch_size 件ずつ読み込み、プロンプトを復元した辞書として取得する
+
+    ID順のキーセットで読み込み、セグメントとブロブはバッチごとに1クエリずつ取得する。
+    同じバッチで共有されているブロブは1回だけ展開する。
+
+    Args:
+        queryset (QuerySet): OpenAIRequest のクエリセット
+        batch_size (int): 1回に読み込む件数
+
+    Yields:
+        dict: id, created_at, tokens_used, prompt, response
+    """
+    rows = queryset.order_by('id').values('id', 'created_at', 'tokens_used', 'response')
+    last_id = 0
+    while True:
+        batch = list(rows.filter(id__gt=last_id)[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1]['id']
+
+        segments = {}
+        for request_id, blob_id in OpenAIRequestSegment.objects.filter(
+            request_id__in=[row['id'] for row in batch]
+        ).order_by('request_id', 'position').values_list('request_id', 'blob_id'):
+            segments.setdefault(request_id, []).append(blob_id)
+        texts = {
+            blob_id: zlib.decompress(bytes(data)).decode('utf-8')
+            for blob_id, data in PromptBlob.objects.filter(
+                id__in={blob_id for blob_ids in segments.values() for blob_id in blob_ids}
+            ).values_list('id', 'data')
+        }
+
+        for row in batch:
+            yield {
+                'id': row['id'],
+                'created_at': row['created_at'].isoformat(),
+                'tokens_used': row['tokens_used'],
+                'prompt': PROMPT_SEGMENT_SEPARATOR.join(texts[blob_id] for blob_id in segments.get(row['id'], [])),
+                'response': row['response'],
+            }
+
+
+def delete_orphan_blobs(before, batch_size=1000):
+    """
+    before より前に作成され、どのリクエストからも参照されていないブロブを batch_size 件ずつ削除する
+
+    記録の保存ではブロブを作成してからセグメントを保存するため、最近作成されたブロブは
+    まだ参照されていなくても削除しない。
+
+    Args:
+        before (datetime): この日時より前に作成されたブロブを対象にする
+        batch_size (int): 1回に削除する件数
+
+    Returns:
+        int: 削除したブロブ数
+    """
+    deleted = 0
+    orphans = PromptBlob.objects.filter(created_at__lt=before, segments__isnull=True)
+    while True:
+        ids = list(orphans.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        # 削除までの間に参照されたブロブは残す
+        count, _ = PromptBlob.objects.filter(id__in=ids, segments__isnull=True).delete()
+        deleted += count
+
+
+def archive_openai_requests(before, batch_size=1000, archive=True):
+    """
+    before より前の OpenAIRequest をgzip圧縮したJSONLファイルに書き出してから削除する
+
+    ファイルをストレージに保存してから削除するため、途中で失敗しても記録は失われない。
+    削除は batch_size 件ずつ行い、最後に before より前に作成され参照されなくなったブロブを削除する。
+
+    Args:
+        before (datetime): この日時より前の記録を対象にする
+        batch_size (int): 1回に読み込む・削除する件数
+        archive (bool): Falseの場合はファイルに書き出さずに削除する
+
+    Returns:
+        dict: archived（対象の件数）, path（保存したファイルのパス）, deleted_blobs（削除したブロブ数）
+    """
+    targets = OpenAIRequest.objects.filter(created_at__lt=before)
+    last_id = targets.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        return {'archived': 0, 'path': None, 'deleted_blobs': delete_orphan_blobs(before, batch_size)}
+    # 処理中に追加された記録は対象にしない
+    targets = targets.filter(id__lte=last_id)
+
+    path = None
+    count = 0
+    if archive:
+        with tempfile.TemporaryFile() as temp_file:
+            with gzip.GzipFile(fileobj=temp_file, mode='wb') as output:
+                for record in iter_request_records(targets, batch_size):
+                    output.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+                    count += 1
+            temp_file.seek(0)
+            name = f'{ARCHIVE_DIRECTORY}/{timezone.now():%Y%m%d-%H%M%S}.jsonl.gz'
+            path = default_storage.save(name, File(temp_file))
+
+    deleted = 0
+    while True:
+        ids = list(targets.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        OpenAIRequest.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+
+    return {
+        'archived': count if archive else deleted, 'path': path, 'deleted_blobs': delete_orphan_blobs(before, batch_size),
+    }
@@ -0,0 +1,363 @@
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+import openai
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class LLMOverloadedError(Exception):
+    """
+    バックエンドが過負荷（429・タイムアウトなど）の場合に送出される例外
+    """
+
+
+class BaseLLMBackend:
+    """
+    LLMバックエンドの基底クラス
+
+    サブクラスは complete / stream を実装する。
+    retryable_errors には待機して再試行すべき例外を指定する。
+    バッチAPI（遅延生成）に対応する場合は supports_batch を真にし、
+    submit_batch / get_batch / get_batch_results を実装する。
+    """
+
+    retryable_errors = (LLMOverloadedError,)
+    supports_batch = False
+
+    def complete(self, messages, **params):
+        """
+        メッセージを送信して応答を取得する
+
+        Args:
+            messages (list): APIに送信するメッセージ
+            **params: モデル名、最大トークン数、温度などのパラメータ
+
+        Returns:
+            tuple: (生成された内容, 使用トークン数)
+        """
+        raise NotImplementedError
+
+    def stream(self, messages, on_delta, **params):
+        """
+        ストリーミングモードでメッセージを送信して応答を取得する
+
+        Args:
+            messages (list): APIに送信するメッセージ
+            on_delta (function): 内容を受信するたびに呼ばれるコールバック関数
+                引数: delta (str) 新たに受信した内容
+            **params: モデル名、最大トークン数、温度などのパラメータ
+
+        Returns:
+            tuple: (生成された内容, 使用トークン数)
+        """
+        raise NotImplementedError
+
+    def submit_batch(self, requests):
+        """
+        リクエストをまとめたバッチジョブを送信する
+
+        Args:
+            requests (bytes): 1行に1リクエストのJSONL（core.utils.build_batch_request の形式）
+
+        Returns:
+            str: バッチジョブID
+        """
+        raise NotImplementedError
+
+    def get_batch(self, batch_id):
+        """
+        バッチジョブの状態を取得する
+
+        Returns:
+            dict: 'status'（'in_progress' / 'completed' / 'failed'）と 'error'、
+                  および get_batch_results に渡す情報
+        """
+        raise NotImplementedError
+
+    def get_batch_results(self, batch):
+        """
+        完了したバッチジョブの結果を取得する
+
+        Args:
+            batch (dict): get_batch の戻り値
+
+        Yields:
+            dict: 'custom_id', 'content', 'tokens_used', 'error'（成功時は空文字列）
+        """
+        raise NotImplementedError
+
+
+def parse_batch_result_line(line):
+    """
+    バッチAPIの出力ファイルの1行を get_batch_results の形式に変換する
+    """
+    result = json.loads(line)
+    response = result.get('response') or {}
+    body = response.get('body') or {}
+    error = result.get('error')
+    if error or response.get('status_code') != 200:
+        message = (error or body.get('error') or {}).get('message') or f"status {response.get('status_code')}"
+        return {'custom_id': result['custom_id'], 'content': '', 'tokens_used': 0, 'error': message}
+    return {
+        'custom_id': result['custom_id'],
+        'content': body['choices'][0]['message']['content'],
+        'tokens_used': body.get('usage', {}).get('total_tokens', 0),
+        'error': '',
+    }
+
+
+class OpenAIBackend(BaseLLMBackend):
+    """
+    OpenAI Chat Completions APIを使用するバックエンド
+    """
+
+    retryable_errors = (
+        LLMOverloadedError,
+        openai.error.RateLimitError,
+        openai.error.Timeout,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+    )
+    supports_batch = True
+
+    # バッチジョブの状態のうち、結果を取り込める終了状態（期限切れ・取り消しでも完了分の結果は取得できる）
+    BATCH_FINISHED = ('completed', 'expired', 'cancelled')
+
+    def __init__(self, api_key=None, request_timeout=None):
+        self.api_key = api_key or getattr(settings, 'OPENAI_API_KEY', '') or os.environ.get('OPENAI_API_KEY')
+        self.request_timeout = request_timeout
+
+    def _options(self):
+        options = {}
+        if self.api_key:
+            options['api_key'] = self.api_key
+        if self.request_timeout:
+            options['request_timeout'] = self.request_timeout
+        return options
+
+    def complete(self, messages, **params):
+        response = openai.ChatCompletion.create(messages=messages, **params, **self._options())
+        return response.choices[0].message.content, response.usage.total_tokens
+
+    def stream(self, messages, on_delta, **params):
+        response = openai.ChatCompletion.create(messages=messages, stream=True, **params, **self._options())
+        parts = []
+        chunks = 0
+        for chunk in response:
+            delta = chunk.choices[0].delta.get('content')
+            if not delta:
+                continue
+            parts.append(delta)
+            chunks += 1
+            on_delta(delta)
+        # ストリーミングでは使用量が返されないため、受信したチャンク数を概算値とする
+        return ''.join(parts), chunks
+
+    def _request(self, method, url, params=None):
+        # openai 0.28 にはバッチAPIのクライアントがないため、汎用のリクエストを使用する
+        requestor = openai.api_requestor.APIRequestor(key=self.api_key or None)
+        response, _, _ = requestor.request(method, url, params=params, request_timeout=self.request_timeout)
+        return response.data
+
+    def submit_batch(self, requests):
+        upload = openai.File.create(file=io.BytesIO(requests), purpose='batch',
+                                    user_provided_filename='requests.jsonl', api_key=self.api_key or None)
+        batch = self._request('post', '/batches', {
+            'input_file_id': upload.id,
+            'endpoint': '/v1/chat/completions',
+            'completion_window': '24h',
+        })
+        return batch['id']
+
+    def get_batch(self, batch_id):
+        batch = self._request('get', f'/batches/{batch_id}')
+        if batch['status'] in self.BATCH_FINISHED:
+            status = 'completed'
+        elif batch['status'] == 'failed':
+            status = 'failed'
+        else:
+            status = 'in_progress'
+        errors = (batch.get('errors') or {}).get('data') or []
+        return {
+            'status': status,
+            'error': '; '.join(error.get('message', '') for error in errors),
+            'output_file_id': batch.get('output_file_id'),
+            'error_file_id': batch.get('error_file_id'),
+        }
+
+    def get_batch_results(self, batch):
+        for file_id in (batch.get('output_file_id'), batch.get('error_file_id')):
+            if not file_id:
+                continue
+            content = openai.File.download(file_id, api_key=self.api_key or None)
+            for line in content.decode('utf-8').splitlines():
+                if line.strip():
+                    yield parse_batch_result_line(line)
+
+
+class FakeLLMBackend(BaseLLMBackend):
+    """
+    ネットワークを使用せずに応答を返す負荷試験用のバックエンド
+
+    レイテンシの分布、応答のトークン数、失敗の発生率を設定できる。
+    乱数のシードを固定すると、同じ順序の呼び出しに対して同じ結果を返す。
+
+    Args:
+        latency (float): 平均レイテンシ（秒）
+        distribution (str): レイテンシの分布（'constant' / 'uniform' / 'exponential' / 'lognormal'）
+        jitter (float): 'uniform' では平均からの最大のずれ（秒）、'lognormal' では対数の標準偏差
+        tokens (int): 応答のトークン数（1トークンを1文字として内容を作成する）
+        chunk_tokens (int): ストリーミング時の1チャンクあたりのトークン数
+        failure_rate (float): 失敗する確率（0-1）
+        failure (str): 失敗の種類（'overload' は再試行される LLMOverloadedError、'error' は RuntimeError）
+        seed (int): 乱数のシード
+        batch_delay (float): バッチジョブが送信されてから完了するまでの時間（秒）
+
+    バッチAPIのローカルの代替としても使用できる。送信されたジョブはキャッシュに保存されるため、
+    Webプロセスとワーカーが同じキャッシュ（Redisなど）を使用していれば別のプロセスから結果を取得できる。
+    """
+
+    DISTRIBUTIONS = ('constant', 'uniform', 'exponential', 'lognormal')
+    supports_batch = True
+
+    def __init__(self, latency=0.0, distribution='constant', jitter=0.0, tokens=200, chunk_tokens=20,
+                 failure_rate=0.0, failure='overload', seed=None, batch_delay=0.0):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f'未対応のレイテンシ分布です: {distribution}')
+        self.latency = latency
+        self.distribution = distribution
+        self.jitter = jitter
+        self.tokens = tokens
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.failure_rate = failure_rate
+        self.failure = failure
+        self.batch_delay = batch_delay
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        """
+        1回の呼び出しのレイテンシと失敗の有無を決める
+        """
+        with self._lock:
+            self.calls += 1
+            if self.distribution == 'uniform':
+                latency = self.latency + self._random.uniform(-self.jitter, self.jitter)
+            elif self.distribution == 'exponential':
+                latency = self._random.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+            elif self.distribution == 'lognormal':
+                # 平均が latency になるように調整した対数正規分布
+                mu = -self.jitter ** 2 / 2
+                latency = self.latency * self._random.lognormvariate(mu, self.jitter)
+            else:
+                latency = self.latency
+            failed = self._random.random() < self.failure_rate
+        return max(0.0, latency), failed
+
+    def _fail(self):
+        if self.failure == 'overload':
+            raise LLMOverloadedError('模擬バックエンドが過負荷です')
+        raise RuntimeError('模擬バックエンドでエラーが発生しました')
+
+    def _content(self, messages):
+        # プロンプトごとに決まった内容を返す
+        digest = hashlib.sha256(messages[-1]['content'].encode('utf-8')).hexdigest()[:8]
+        header = f'模擬レスポンス {digest}\n'
+        return header + '模' * max(0, self.tokens - len(header))
+
+    def complete(self, messages, **params):
+        latency, failed = self._sample()
+        time.sleep(latency)
+        if failed:
+            self._fail()
+        return self._content(messages), self.tokens
+
+    def stream(self, messages, on_delta, **params):
+        latency, failed = self._sample()
+        content = self._content(messages)
+        chunks = [content[i:i + self.chunk_tokens] for i in range(0, len(content), self.chunk_tokens)]
+        # 失敗する場合は途中まで送信してから例外を送出する
+        sent = len(chunks) // 2 if failed else len(chunks)
+        for i in range(sent):
+            time.sleep(latency / len(chunks))
+            on_delta(chunks[i])
+        if failed:
+            self._fail()
+        return content, len(chunks)
+
+    @staticmethod
+    def _batch_key(batch_id):
+        return f'fake-llm-batch:{batch_id}'
+
+    def submit_batch(self, requests):
+        batch_id = f'batch_fake_{uuid.uuid4().hex}'
+        cache.set(self._batch_key(batch_id), {'requests': requests, 'submitted_at': time.time()},
+                  timeout=60 * 60 * 24)
+        return batch_id
+
+    def get_batch(self, batch_id):
+        job = cache.get(self._batch_key(batch_id))
+        if job is None:
+            return {'status': 'failed', 'error': f'バッチジョブが見つかりません: {batch_id}'}
+        if time.time() - job['submitted_at'] < self.batch_delay:
+            return {'status': 'in_progress', 'error': ''}
+        return {'status': 'completed', 'error': '', 'id': batch_id}
+
+    def get_batch_results(self, batch):
+        job = cache.get(self._batch_key(batch['id']))
+        for line in job['requests'].decode('utf-8').splitlines():
+            request = json.loads(line)
+            with self._lock:
+                self.calls += 1
+                failed = self._random.random() < self.failure_rate
+            if failed:
+                yield {'custom_id': request['custom_id'], 'content': '', 'tokens_used': 0,
+                       'error': '模擬バックエンドでエラーが発生しました'}
+            else:
+                yield {'custom_id': request['custom_id'], 'content': self._content(request['body']['messages']),
+                       'tokens_used': self.tokens, 'error': ''}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_llm_backend():
+    """
+    settings.LLM_BACKEND で設定されたバックエンドを取得する
+
+    設定例:
+        LLM_BACKEND = {
+            'BACKEND': 'core.llm_backends.FakeLLMBackend',
+            'OPTIONS': {'latency': 0.5, 'distribution': 'lognormal', 'jitter': 0.5, 'seed': 1},
+        }
+
+    Returns:
+        BaseLLMBackend: バックエンド（省略時は OpenAIBackend）
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = getattr(settings, 'LLM_BACKEND', None) or {}
+                backend = import_string(config.get('BACKEND', 'core.llm_backends.OpenAIBackend'))
+                _backend = backend(**config.get('OPTIONS', {}))
+    return _backend
+
+
+@receiver(setting_changed)
+def _reset_llm_backend(setting, **kwargs):
+    global _backend
+    if setting in ('LLM_BACKEND', 'OPENAI_API_KEY'):
+        _backend = None
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+
+def make_cache_key(**params):
+    """
+    プロンプトとパラメータからキャッシュキーを作成する
+
+    Args:
+        **params: モデル名、メッセージ、温度など、APIに送信するパラメータ
+
+    Returns:
+        str: パラメータのSHA-256ハッシュ
+    """
+    payload = json.dumps(params, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class BaseLLMCache:
+    """
+    LLMレスポンスキャッシュの基底クラス
+
+    サブクラスは _get / _set / clear を実装する。値は (content, tokens_used) のタプル。
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._set(key, value)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.hits = 0
+            self.misses = 0
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocMemLLMCache(BaseLLMCache):
+    """
+    プロセス内のLRUキャッシュ
+    """
+
+    def __init__(self, ttl=None, max_entries=1000):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while self.max_entries and len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DjangoLLMCache(BaseLLMCache):
+    """
+    Djangoのキャッシュフレームワークを使用するキャッシュ
+
+    サイズによる削除はキャッシュバックエンドの MAX_ENTRIES などの設定に従う。
+    キャッシュは進捗状況などと共有されるため、clear はキャッシュ全体を削除せず、
+    キーに含める世代番号を進めて既存のエントリを参照されないようにする（古いエントリは ttl で削除される）。
+    """
+
+    def __init__(self, ttl=None, max_entries=None, alias='default', key_prefix='llm'):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+        self.alias = alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def _generation_key(self):
+        return f'{self.key_prefix}:generation'
+
+    def _generation(self):
+        generation = self.cache.get(self._generation_key)
+        if generation is None:
+            self.cache.add(self._generation_key, 1, timeout=None)
+            generation = self.cache.get(self._generation_key, 1)
+        return generation
+
+    def _key(self, key):
+        return f'{self.key_prefix}:{self._generation()}:{key}'
+
+    def _get(self, key):
+        value = self.cache.get(self._key(key))
+        return tuple(value) if value is not None else None
+
+    def _set(self, key, value):
+        self.cache.set(self._key(key), list(value), timeout=self.ttl)
+
+    def clear(self):
+        try:
+            self.cache.incr(self._generation_key)
+        except ValueError:
+            # 世代番号がまだない（または削除された）場合は、以前の世代（1）と異なる番号から始める
+            self.cache.set(self._generation_key, 2, timeout=None)
+
+
+class DatabaseLLMCache(BaseLLMCache):
+    """
+    LLMResponseCacheテーブルを使用するキャッシュ
+    """
+
+    def __init__(self, ttl=None, max_entries=10000):
+        super().__init__(ttl=ttl, max_entries=max_entries)
+
+    @property
+    def model(self):
+        from .models import LLMResponseCache
+        return LLMResponseCache
+
+    def _get(self, key):
+        queryset = self.model.objects.filter(key=key)
+        if self.ttl:
+            queryset = queryset.filter(created_at__gt=timezone.now() - timedelta(seconds=self.ttl))
+        entry = queryset.only('response', 'tokens_used').first()
+        if entry is None:
+            return None
+        # LRUの順序を維持するために最終アクセス日時を更新
+        self.model.objects.filter(pk=entry.pk).update(last_accessed_at=timezone.now())
+        return entry.response, entry.tokens_used
+
+    def _set(self, key, value):
+        content, tokens_used = value
+        now = timezone.now()
+        self.model.objects.update_or_create(
+            key=key,
+            defaults={'response': content, 'tokens_used': tokens_used, 'created_at': now, 'last_accessed_at': now},
+        )
+        self._evict()
+
+    def _evict(self):
+        if self.ttl:
+            self.model.objects.filter(created_at__lte=timezone.now() - timedelta(seconds=self.ttl)).delete()
+        if self.max_entries:
+            stale = self.model.objects.order_by('-last_accessed_at').values_list('pk', flat=True)[self.max_entries:]
+            stale_pks = list(stale)
+            if stale_pks:
+                self.model.objects.filter(pk__in=stale_pks).delete()
+
+    def clear(self):
+        self.model.objects.all().delete()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    settings.LLM_CACHE で設定されたキャッシュを取得する
+
+    設定例:
+        LLM_CACHE = {
+            'BACKEND': 'core.llm_cache.LocMemLLMCache',
+            'OPTIONS': {'ttl': 86400, 'max_entries': 1000},
+        }
+
+    Returns:
+        BaseLLMCache: キャッシュ（無効な場合は None）
+    """
+    global _cache
+    config = getattr(settings, 'LLM_CACHE', None)
+    if not config or not config.get('BACKEND'):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                backend = import_string(config['BACKEND'])
+                _cache = backend(**config.get('OPTIONS', {}))
+    return _cache
+
+
+@receiver(setting_changed)
+def _reset_llm_cache(setting, **kwargs):
+    global _cache
+    if setting == 'LLM_CACHE':
+        _cache = None
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from core.tasks import archive_openai_requests_task
+
+
+class Command(BaseCommand):
+    """
+    保持期間を過ぎた OpenAIRequest をgzip圧縮したJSONLファイルに書き出してから削除するコマンド
+
+    Celery beat を使用しない環境では cron などから定期的に実行する。
+
+    例:
+        python manage.py archive_openai_requests --days 30
+    """
+    help = '保持期間を過ぎたOpenAIリクエストの記録をアーカイブして削除します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help='保持する日数（省略時は settings.OPENAI_REQUEST_RETENTION_DAYS）')
+        parser.add_argument('--batch-size', type=int, default=1000, help='1回に処理する件数')
+
+    def handle(self, *args, **options):
+        result = archive_openai_requests_task(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(f'アーカイブした記録: {result["archived"]}')
+        if result['path']:
+            self.stdout.write(f'アーカイブファイル: {result["path"]}')
+        self.stdout.write(f'削除したプロンプトのブロブ: {result["deleted_blobs"]}')
@@ -0,0 +1,98 @@
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import override_settings
+
+from core.llm_backends import FakeLLMBackend, get_llm_backend
+from core.request_log import get_request_log
+from core.utils import generate_test_document_with_progress
+
+
+class Command(BaseCommand):
+    """
+    模擬バックエンド（FakeLLMBackend）でセクション生成の所要時間を計測するコマンド
+
+    ネットワークを使用しないため、同じ引数であれば同じ条件で再現できる。
+
+    例:
+        python manage.py benchmark_generation --sections 12 --latency 0.5 --concurrency 1 4 8
+        python manage.py benchmark_generation --distribution lognormal --jitter 0.8 --failure-rate 0.1
+    """
+    help = '模擬バックエンドでセクション生成の並列化の効果を計測します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sections', type=int, default=12, help='生成するセクション数')
+        parser.add_argument('--latency', type=float, default=0.5, help='1リクエストあたりの平均レイテンシ（秒）')
+        parser.add_argument('--distribution', choices=FakeLLMBackend.DISTRIBUTIONS, default='constant',
+                            help='レイテンシの分布')
+        parser.add_argument('--jitter', type=float, default=0.0, help='レイテンシのばらつき')
+        parser.add_argument('--tokens', type=int, default=200, help='1レスポンスあたりのトークン数')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='失敗（過負荷）の発生率')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help='計測する同時実行数')
+        parser.add_argument('--rate-limit', action='store_true',
+                            help='settings.LLM_RATE_LIMIT のレート制限を有効にする（省略時は無制限）')
+
+    def handle(self, *args, **options):
+        sections = options['sections']
+        latency = options['latency']
+
+        templates = [
+            SimpleNamespace(
+                id=i + 1,
+                title=f'セクション{i + 1}',
+                description='',
+                content_guidelines='',
+                ai_prompt='',
+                order=i + 1,
+            )
+            for i in range(sections)
+        ]
+
+        overrides = {}
+        if not options['rate_limit']:
+            overrides['LLM_RATE_LIMIT'] = {'REQUESTS_PER_MINUTE': 10 ** 6, 'TOKENS_PER_MINUTE': 10 ** 9}
+
+        self.stdout.write(
+            f"sections={sections} latency={latency:.3f}s distribution={options['distribution']} "
+            f"failure_rate={options['failure_rate']}"
+        )
+        self.stdout.write(f"{'concurrency':>11} {'wall(s)':>9} {'ideal(s)':>9} {'speedup':>8} {'calls':>6}")
+
+        baseline = None
+        for concurrency in options['concurrency']:
+            # 同時実行数ごとに同じシードのバックエンドを作成し、同じ条件で計測する
+            backend_config = {
+                'BACKEND': 'core.llm_backends.FakeLLMBackend',
+                'OPTIONS': {
+                    'latency': latency,
+                    'distribution': options['distribution'],
+                    'jitter': options['jitter'],
+                    'tokens': options['tokens'],
+                    'failure_rate': options['failure_rate'],
+                    'seed': options['seed'],
+                },
+            }
+            with override_settings(LLM_BACKEND=backend_config, LLM_CONCURRENCY={'INITIAL': concurrency},
+                                   **overrides):
+                backend = get_llm_backend()
+
+                # 計測中に記録されたOpenAIRequestはロールバックする
+                with transaction.atomic():
+                    start = time.perf_counter()
+                    # キャッシュを使用すると2回目以降の計測がすべてキャッシュヒットになる
+                    generate_test_document_with_progress('ベンチマーク用の製品説明', templates,
+                                                         max_concurrency=concurrency, use_cache=False)
+                    elapsed = time.perf_counter() - start
+                    # バッファされた記録も保存してからロールバックする
+                    get_request_log().flush()
+                    transaction.set_rollback(True)
+
+            if baseline is None:
+                baseline = elapsed
+            ideal = latency * -(-sections // concurrency)
+            self.stdout.write(
+                f'{concurrency:>11} {elapsed:>9.3f} {ideal:>9.3f} {baseline / elapsed:>7.2f}x {backend.calls:>6}'
+            )
@@ -0,0 +1,116 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:21
+
+import hashlib
+import zlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+BATCH_SIZE = 500
+
+
+def split_prompts(apps, schema_editor):
+    """
+    既存のプロンプトをセグメントに分割し、圧縮した PromptBlob への参照に置き換える
+    """
+    OpenAIRequest = apps.get_model('core', 'OpenAIRequest')
+    PromptBlob = apps.get_model('core', 'PromptBlob')
+    OpenAIRequestSegment = apps.get_model('core', 'OpenAIRequestSegment')
+
+    requests = OpenAIRequest.objects.order_by('id').values_list('id', 'prompt')
+    last_id = 0
+    while True:
+        batch = list(requests.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+        segments = []
+        texts = {}
+        for request_id, prompt in batch:
+            for position, text in enumerate(prompt.split('\n\n')):
+                key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+                texts[key] = text
+                segments.append((request_id, position, key))
+
+        existing = set(PromptBlob.objects.filter(hash__in=list(texts)).values_list('hash', flat=True))
+        PromptBlob.objects.bulk_create([
+            PromptBlob(hash=key, data=zlib.compress(text.encode('utf-8')), size=len(text))
+            for key, text in texts.items() if key not in existing
+        ])
+        ids = dict(PromptBlob.objects.filter(hash__in=list(texts)).values_list('hash', 'id'))
+        OpenAIRequestSegment.objects.bulk_create([
+            OpenAIRequestSegment(request_id=request_id, blob_id=ids[key], position=position)
+            for request_id, position, key in segments
+        ])
+
+
+def join_prompts(apps, schema_editor):
+    """
+    セグメントを連結してプロンプトに戻す
+    """
+    OpenAIRequest = apps.get_model('core', 'OpenAIRequest')
+    OpenAIRequestSegment = apps.get_model('core', 'OpenAIRequestSegment')
+
+    for request in OpenAIRequest.objects.iterator(chunk_size=BATCH_SIZE):
+        data = OpenAIRequestSegment.objects.filter(request=request).order_by('position').values_list(
+            'blob__data', flat=True
+        )
+        request.prompt = '\n\n'.join(zlib.decompress(bytes(blob)).decode('utf-8') for blob in data)
+        request.save(update_fields=['prompt'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_llmresponsecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OpenAIRequestSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PromptBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('data', models.BinaryField()),
+                ('size', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='openairequest',
+            index=models.Index(fields=['created_at', 'id'], name='openai_request_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='openairequestsegment',
+            name='blob',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='segments', to='core.promptblob'),
+        ),
+        migrations.AddField(
+            model_name='openairequestsegment',
+            name='request',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='core.openairequest'),
+        ),
+        migrations.AddConstraint(
+            model_name='openairequestsegment',
+            constraint=models.UniqueConstraint(fields=('request', 'position'), name='openai_request_segment_position'),
+        ),
+        migrations.RunPython(split_prompts, join_prompts),
+        # 逆方向のマイグレーションで列を追加できるように既定値を設定してから削除する
+        migrations.AlterField(
+            model_name='openairequest',
+            name='prompt',
+            field=models.TextField(default=''),
+        ),
+        migrations.RemoveField(
+            model_name='openairequest',
+            name='prompt',
+        ),
+    ]
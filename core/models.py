@@ -1,12 +1,185 @@
-from django.db import models
+import hashlib
+import zlib
+
+from django.db import models, transaction
 
 # Create your models here.
 
+# プロンプトを分割する区切り
+PROMPT_SEGMENT_SEPARATOR = '\n\n'
+# プロンプトの構成要素（製品説明・テンプレート部分・まとめて生成するセクションの一覧・共通の品質の指示）の先頭。
+# 構成要素ごとに重複を除くため、この前の区切りでのみ分割する（core.utils のプロンプトと合わせる）
+PROMPT_COMPONENT_PREFIXES = ('製品説明:', 'セクション: ', '以下の各セクションの内容', '以下の点に注意して')
+
+
+def split_prompt(prompt):
+    """
+    プロンプトを構成要素ごとの保存用のセグメントに分割する（PROMPT_SEGMENT_SEPARATOR で連結すると元に戻る）
+
+    製品説明などの段落数に関わらず、1つのプロンプトのセグメント数は構成要素の数以下になる。
+    """
+    segments = []
+    for part in prompt.split(PROMPT_SEGMENT_SEPARATOR):
+        if segments and not part.startswith(PROMPT_COMPONENT_PREFIXES):
+            segments[-1] += PROMPT_SEGMENT_SEPARATOR + part
+        else:
+            segments.append(part)
+    return segments
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class PromptBlob(models.Model):
+    """
+    プロンプトのセグメントをzlibで圧縮して保存する（内容のハッシュで重複を除く）
+    """
+    hash = models.CharField(max_length=64, unique=True)
+    data = models.BinaryField()
+    # 圧縮前の文字数
+    size = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Prompt Blob {self.hash[:12]}"
+
+    @staticmethod
+    def compress(text):
+        return zlib.compress(text.encode('utf-8'))
+
+    @property
+    def text(self):
+        return zlib.decompress(bytes(self.data)).decode('utf-8')
+
+    @classmethod
+    def store(cls, segments):
+        """
+        セグメントを保存し、ハッシュとIDの対応を取得する
+
+        保存済みのセグメントは1クエリでまとめて確認し、未保存のセグメントのみ圧縮して保存する。
+
+        Args:
+            segments (dict): {ハッシュ: テキスト}
+
+        Returns:
+            dict: {ハッシュ: PromptBlob のID}
+        """
+        if not segments:
+            return {}
+        ids = dict(cls.objects.filter(hash__in=list(segments)).values_list('hash', 'id'))
+        missing = [
+            cls(hash=key, data=cls.compress(text), size=len(text))
+            for key, text in segments.items() if key not in ids
+        ]
+        if missing:
+            # 同時に同じセグメントが保存された場合は既存の行を使用する
+            cls.objects.bulk_create(missing, ignore_conflicts=True)
+            ids.update(cls.objects.filter(hash__in=[blob.hash for blob in missing]).values_list('hash', 'id'))
+        return ids
+
+
+class OpenAIRequestQuerySet(models.QuerySet):
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """
+        プロンプトのセグメントを保存してから、リクエストとセグメントの対応をまとめて保存する
+
+        対応の保存に失敗した場合（参照するブロブが削除された場合など）はリクエストも保存しない。
+        """
+        objs = list(objs)
+        blob_ids = PromptBlob.store({key: text for obj in objs for key, text in obj._pending_segments})
+        with transaction.atomic(using=self.db):
+            created = super().bulk_create(objs, *args, **kwargs)
+            OpenAIRequest.save_segments(objs, blob_ids)
+        return created
+
+
 class OpenAIRequest(models.Model):
-    prompt = models.TextField()
+    """
+    LLMへのリクエストの記録
+
+    プロンプトは段落ごとのセグメントに分割し、重複を除いて圧縮した PromptBlob への参照として保存する。
+    prompt プロパティで従来どおり文字列として読み書きできる。
+    """
     response = models.TextField()
     tokens_used = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = OpenAIRequestQuerySet.as_manager()
+
+    # prompt を設定してから保存するまでの (ハッシュ, テキスト) のリスト
+    _pending_segments = ()
+
+    class Meta:
+        indexes = [
+            # 保持期間を過ぎた記録の削除・アーカイブと、管理画面の日付での絞り込み用
+            models.Index(fields=['created_at', 'id'], name='openai_request_created_idx'),
+        ]
+
     def __str__(self):
         return f"OpenAI Request {self.id} - {self.created_at}"
+
+    @property
+    def prompt(self):
+        if not hasattr(self, '_prompt'):
+            segments = self.segments.order_by('position').values_list('blob__data', flat=True)
+            self._prompt = PROMPT_SEGMENT_SEPARATOR.join(
+                zlib.decompress(bytes(data)).decode('utf-8') for data in segments
+            )
+        return self._prompt
+
+    @prompt.setter
+    def prompt(self, value):
+        self._prompt = value
+        self._pending_segments = [(content_hash(text), text) for text in split_prompt(value)]
+
+    def save(self, *args, **kwargs):
+        blob_ids = PromptBlob.store(dict(self._pending_segments))
+        super().save(*args, **kwargs)
+        if self._pending_segments:
+            self.segments.all().delete()
+            OpenAIRequest.save_segments([self], blob_ids)
+
+    @staticmethod
+    def save_segments(requests, blob_ids):
+        """
+        リクエストとセグメントの対応を保存する
+
+        Args:
+            requests (list): 保存済みの OpenAIRequest のリスト
+            blob_ids (dict): PromptBlob.store() の戻り値
+        """
+        requests = [request for request in requests if request._pending_segments]
+        OpenAIRequestSegment.objects.bulk_create([
+            OpenAIRequestSegment(request_id=request.pk, blob_id=blob_ids[key], position=position)
+            for request in requests
+            for position, (key, _) in enumerate(request._pending_segments)
+        ])
+        for request in requests:
+            request._pending_segments = ()
+
+
+class OpenAIRequestSegment(models.Model):
+    """
+    リクエストのプロンプトを構成するセグメント（position 順に連結するとプロンプトになる）
+    """
+    request = models.ForeignKey(OpenAIRequest, on_delete=models.CASCADE, related_name='segments')
+    blob = models.ForeignKey(PromptBlob, on_delete=models.PROTECT, related_name='segments')
+    position = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['request', 'position'], name='openai_request_segment_position'),
+        ]
+
+
+class LLMResponseCache(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    response = models.TextField()
+    tokens_used = models.IntegerField(default=0)
+    created_at = models.DateTimeField(db_index=True)
+    last_accessed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"LLM Response Cache {self.key[:12]}"
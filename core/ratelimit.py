@@ -0,0 +1,206 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+
+class LocalRateLimiter:
+    """
+    プロセス内のトークンバケットによるレート制限
+
+    1分あたりのリクエスト数とトークン数の2つのバケットを持ち、
+    両方に空きがある場合のみ消費する。
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, clock=time.monotonic):
+        self.capacities = (requests_per_minute, tokens_per_minute)
+        self.rates = (requests_per_minute / 60.0, tokens_per_minute / 60.0)
+        self.clock = clock
+        self._levels = list(self.capacities)
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens):
+        """
+        リクエスト1件と指定したトークン数を消費する
+
+        Returns:
+            float: 消費できた場合は0、できない場合は空きができるまでの待ち時間（秒）
+        """
+        amounts = (1, min(tokens, self.capacities[1]))
+        with self._lock:
+            now = self.clock()
+            elapsed = now - self._updated_at
+            self._updated_at = now
+            self._levels = [
+                min(capacity, level + elapsed * rate)
+                for capacity, level, rate in zip(self.capacities, self._levels, self.rates)
+            ]
+            wait = max(
+                (amount - level) / rate if level < amount else 0
+                for amount, level, rate in zip(amounts, self._levels, self.rates)
+            )
+            if wait == 0:
+                self._levels = [level - amount for level, amount in zip(self._levels, amounts)]
+            return wait
+
+
+# KEYS: リクエスト数のバケット, トークン数のバケット
+# ARGV: リクエスト数の容量, トークン数の容量, 消費するトークン数
+_REDIS_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local capacities = {tonumber(ARGV[1]), tonumber(ARGV[2])}
+local amounts = {1, math.min(tonumber(ARGV[3]), capacities[2])}
+local levels = {}
+local wait = 0
+for i = 1, 2 do
+    local rate = capacities[i] / 60
+    local data = redis.call('HMGET', KEYS[i], 'level', 'ts')
+    local level = tonumber(data[1]) or capacities[i]
+    local ts = tonumber(data[2]) or now
+    level = math.min(capacities[i], level + (now - ts) * rate)
+    levels[i] = level
+    if level < amounts[i] then
+        wait = math.max(wait, (amounts[i] - level) / rate)
+    end
+end
+for i = 1, 2 do
+    if wait == 0 then
+        levels[i] = levels[i] - amounts[i]
+    end
+    redis.call('HSET', KEYS[i], 'level', tostring(levels[i]), 'ts', tostring(now))
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter:
+    """
+    Redisに保存したトークンバケットによるレート制限（全ワーカーで共有）
+
+    Redisに接続できない場合はプロセス内のバケットで代替する。
+    """
+
+    def __init__(self, url, requests_per_minute, tokens_per_minute, key_prefix='llm-rate-limit'):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_timeout=1)
+        self.capacities = (requests_per_minute, tokens_per_minute)
+        self.keys = [f'{key_prefix}:requests', f'{key_prefix}:tokens']
+        self.script = self.client.register_script(_REDIS_BUCKET_SCRIPT)
+        self.fallback = LocalRateLimiter(requests_per_minute, tokens_per_minute)
+
+    def try_acquire(self, tokens):
+        try:
+            return float(self.script(keys=self.keys, args=[*self.capacities, tokens]))
+        except Exception as e:
+            logger.warning('Redisのレート制限を使用できないため、プロセス内の制限を使用します: %s', e)
+            return self.fallback.try_acquire(tokens)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD方式で同時実行数を調整するリミッター
+
+    呼び出しが成功するたびに上限を少しずつ増やし（加算的増加）、
+    429やタイムアウトが発生した場合は上限を半分にする（乗算的減少）。
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, decrease_factor=0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.limit = float(initial)
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+        return False
+
+    def on_success(self):
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def on_overload(self):
+        with self._condition:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+
+def acquire(limiter, tokens):
+    """
+    レート制限に空きができるまで待機してから消費する
+    """
+    while True:
+        wait = limiter.try_acquire(tokens)
+        if wait <= 0:
+            return
+        time.sleep(min(wait, 1.0))
+
+
+_rate_limiter = None
+_concurrency_limiter = None
+_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """
+    settings.LLM_RATE_LIMIT で設定されたレート制限を取得する
+
+    REDIS_URL が設定されている場合は全ワーカーで共有するRedisのバケットを使用する。
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _lock:
+            if _rate_limiter is None:
+                config = getattr(settings, 'LLM_RATE_LIMIT', {})
+                requests_per_minute = config.get('REQUESTS_PER_MINUTE', 500)
+                tokens_per_minute = config.get('TOKENS_PER_MINUTE', 40000)
+                if config.get('REDIS_URL'):
+                    _rate_limiter = RedisRateLimiter(config['REDIS_URL'], requests_per_minute, tokens_per_minute)
+                else:
+                    _rate_limiter = LocalRateLimiter(requests_per_minute, tokens_per_minute)
+    return _rate_limiter
+
+
+def get_concurrency_limiter():
+    """
+    settings.LLM_CONCURRENCY で設定された適応的な同時実行数のリミッターを取得する
+    """
+    global _concurrency_limiter
+    if _concurrency_limiter is None:
+        with _lock:
+            if _concurrency_limiter is None:
+                config = getattr(settings, 'LLM_CONCURRENCY', {})
+                _concurrency_limiter = AdaptiveConcurrencyLimiter(
+                    initial=config.get('INITIAL', 4),
+                    minimum=config.get('MIN', 1),
+                    maximum=config.get('MAX', 16),
+                )
+    return _concurrency_limiter
+
+
+@receiver(setting_changed)
+def _reset_limiters(setting, **kwargs):
+    global _rate_limiter, _concurrency_limiter
+    if setting == 'LLM_RATE_LIMIT':
+        _rate_limiter = None
+    elif setting == 'LLM_CONCURRENCY':
+        _concurrency_limiter = None
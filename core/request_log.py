@@ -0,0 +1,244 @@
+import atexit
+import json
+import logging
+import threading
+import time
+
+from celery import signals as celery_signals
+from django.conf import settings
+from django.core.signals import request_finished, setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+def write_records(records):
+    """
+    (prompt, response, tokens_used) のリストを OpenAIRequest にまとめて保存する
+
+    Returns:
+        list: 保存した OpenAIRequest のリスト
+    """
+    from .models import OpenAIRequest
+
+    return OpenAIRequest.objects.bulk_create([
+        OpenAIRequest(prompt=prompt, response=response, tokens_used=tokens_used)
+        for prompt, response, tokens_used in records
+    ], batch_size=500)
+
+
+class BaseRequestLog:
+    """
+    LLM呼び出しの記録（OpenAIRequest）を保存するログの基底クラス
+
+    サブクラスは record / flush を実装し、保存には write を使用する。
+    """
+
+    def __init__(self, max_batch=50, flush_interval=5.0, max_buffer=10000):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+    def record(self, prompt, response, tokens_used):
+        raise NotImplementedError
+
+    def write(self, records):
+        """
+        (prompt, response, tokens_used) のリストを保存する
+
+        Returns:
+            list: 保存した OpenAIRequest のリスト
+        """
+        return write_records(records)
+
+    def flush(self):
+        """
+        保留中の記録を保存する
+
+        Returns:
+            int: 保存した件数
+        """
+        return 0
+
+
+class ImmediateRequestLog(BaseRequestLog):
+    """
+    呼び出しごとに OpenAIRequest を保存するログ（バッファしない）
+    """
+
+    def record(self, prompt, response, tokens_used):
+        self.write([(prompt, response, tokens_used)])
+
+
+class BufferedRequestLog(BaseRequestLog):
+    """
+    記録をプロセス内にためて bulk_create でまとめて保存するログ
+
+    max_batch 件たまった場合と、前回の保存から flush_interval 秒経過した場合に保存する。
+    リクエスト・Celeryタスクの終了時とプロセスの終了時にも保存する。
+    保存に失敗した記録はバッファに戻して次回に再試行する（max_buffer 件を超えた分は古い順に破棄する）。
+    プロセスが強制終了された場合、保存前の記録は失われる（失われないようにするには RedisRequestLog を使用する）。
+    """
+
+    def __init__(self, max_batch=50, flush_interval=5.0, max_buffer=10000):
+        super().__init__(max_batch=max_batch, flush_interval=flush_interval, max_buffer=max_buffer)
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def record(self, prompt, response, tokens_used):
+        with self._lock:
+            self._buffer.append((prompt, response, tokens_used))
+            due = (len(self._buffer) >= self.max_batch
+                   or time.monotonic() - self._flushed_at >= self.flush_interval)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+            self._flushed_at = time.monotonic()
+        if not records:
+            return 0
+        try:
+            self.write(records)
+        except Exception as e:
+            logger.warning('LLM呼び出しの記録を保存できませんでした（%d件は次回に再試行します）: %s', len(records), e)
+            with self._lock:
+                self._buffer = records + self._buffer
+                overflow = len(self._buffer) - self.max_buffer
+                if overflow > 0:
+                    logger.error('LLM呼び出しの記録がバッファの上限を超えたため、%d件を破棄しました', overflow)
+                    del self._buffer[:overflow]
+            return 0
+        return len(records)
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+
+# KEYS: 記録のリスト, 保存中の記録のリスト
+# ARGV: 1回に保存する件数
+# 前回の保存中の記録が残っている場合はそれを返し、ない場合は記録のリストの先頭から取り出して保存中のリストに移す
+_REDIS_CLAIM_SCRIPT = """
+local processing = redis.call('LRANGE', KEYS[2], 0, -1)
+if #processing > 0 then
+    return processing
+end
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+
+class RedisRequestLog(BufferedRequestLog):
+    """
+    記録をRedisのリストにためて bulk_create でまとめて保存するログ（全ワーカーで共有）
+
+    プロセスが異常終了しても記録はRedisに残り、他のワーカーや定期タスクが保存する。
+    保存する記録は書き込む前に保存中のリストへ移し、書き込みに成功してから削除する。
+    書き込みに失敗した記録は次回の保存で再試行する。
+    Redisに接続できない場合はプロセス内のバッファで代替する。
+    """
+
+    def __init__(self, url, max_batch=50, flush_interval=5.0, max_buffer=10000, key='llm-request-log'):
+        import redis
+
+        super().__init__(max_batch=max_batch, flush_interval=flush_interval, max_buffer=max_buffer)
+        self.client = redis.Redis.from_url(url, socket_timeout=1)
+        self.key = key
+        self.processing_key = f'{key}:processing'
+        self.claim = self.client.register_script(_REDIS_CLAIM_SCRIPT)
+
+    def record(self, prompt, response, tokens_used):
+        try:
+            length = self.client.rpush(self.key, json.dumps([prompt, response, tokens_used], ensure_ascii=False))
+        except Exception as e:
+            logger.warning('Redisに記録できないため、プロセス内のバッファを使用します: %s', e)
+            super().record(prompt, response, tokens_used)
+            return
+        if length >= self.max_batch or time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        flushed = super().flush()
+        self._flushed_at = time.monotonic()
+        # 複数のワーカーが同時に同じ記録を保存しないようにする
+        lock = self.client.lock(f'{self.key}:lock', timeout=60, blocking=False)
+        try:
+            if not lock.acquire():
+                return flushed
+        except Exception as e:
+            logger.warning('Redisに記録された呼び出しを保存できませんでした: %s', e)
+            return flushed
+        try:
+            while True:
+                items = self.claim(keys=[self.key, self.processing_key], args=[self.max_batch])
+                if not items:
+                    return flushed
+                self.write([json.loads(item) for item in items])
+                self.client.delete(self.processing_key)
+                flushed += len(items)
+                # 保存に時間がかかってもロックが期限切れにならないようにする
+                lock.reacquire()
+        except Exception as e:
+            logger.warning('Redisに記録された呼び出しを保存できませんでした: %s', e)
+            return flushed
+        finally:
+            try:
+                lock.release()
+            except Exception as e:
+                logger.warning('Redisのロックを解放できませんでした: %s', e)
+
+
+_request_log = None
+_request_log_lock = threading.Lock()
+
+
+def get_request_log():
+    """
+    settings.LLM_REQUEST_LOG で設定されたログを取得する
+
+    設定例:
+        LLM_REQUEST_LOG = {
+            'BACKEND': 'core.request_log.BufferedRequestLog',
+            'OPTIONS': {'max_batch': 50, 'flush_interval': 5.0},
+        }
+
+    Returns:
+        BaseRequestLog: ログ（未設定の場合は呼び出しごとに保存する）
+    """
+    global _request_log
+    if _request_log is None:
+        with _request_log_lock:
+            if _request_log is None:
+                config = getattr(settings, 'LLM_REQUEST_LOG', None) or {}
+                backend = import_string(config.get('BACKEND') or 'core.request_log.ImmediateRequestLog')
+                _request_log = backend(**config.get('OPTIONS', {}))
+    return _request_log
+
+
+def flush_request_log(**kwargs):
+    """
+    保留中の記録を保存する（リクエスト・タスク・プロセスの終了時に呼び出す）
+    """
+    if _request_log is not None:
+        _request_log.flush()
+
+
+request_finished.connect(flush_request_log, dispatch_uid='core.request_log.request_finished')
+celery_signals.task_postrun.connect(flush_request_log, dispatch_uid='core.request_log.task_postrun')
+celery_signals.worker_process_shutdown.connect(flush_request_log, dispatch_uid='core.request_log.process_shutdown')
+atexit.register(flush_request_log)
+
+
+@receiver(setting_changed)
+def _reset_request_log(setting, **kwargs):
+    global _request_log
+    if setting == 'LLM_REQUEST_LOG':
+        _request_log = None
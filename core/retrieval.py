@@ -0,0 +1,256 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+# 英数字は単語単位、それ以外（日本語など）は文字バイグラムでトークン化する
+_WORD = re.compile(r'[a-z0-9_]+')
+_TEXT_RUN = re.compile(r'[^\Wa-z0-9_]+')
+_BLANK_LINES = re.compile(r'\n\s*\n')
+
+# 構築したインデックスを保持する数（同じ製品説明のセクションを続けて生成するため少数で十分）
+INDEX_CACHE_SIZE = 32
+
+
+def tokenize(text):
+    """
+    テキストを検索用のトークンに分割する
+
+    NFKC正規化と小文字化の後、英数字の連続は単語として、日本語などの連続は文字バイグラムとして扱う。
+    分かち書きを必要としないため、辞書なしで日本語の文書を検索できる。
+
+    Args:
+        text (str): テキスト
+
+    Returns:
+        list: トークンのリスト
+    """
+    text = unicodedata.normalize('NFKC', text).lower()
+    tokens = _WORD.findall(text)
+    for run in _TEXT_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def split_chunks(text, chunk_size):
+    """
+    テキストを段落・行の区切りで chunk_size 文字以下のチャンクに分割する
+
+    1行で chunk_size を超える場合はその行を chunk_size 文字ごとに分割する。
+
+    Args:
+        text (str): テキスト
+        chunk_size (int): チャンクの最大文字数
+
+    Returns:
+        list: チャンクのリスト（元のテキストの順序）
+    """
+    chunks = []
+    for paragraph in _BLANK_LINES.split(text.replace('\r\n', '\n')):
+        current = ''
+        for line in paragraph.strip().split('\n'):
+            line = line.rstrip()
+            if not line:
+                continue
+            if current and len(current) + 1 + len(line) > chunk_size:
+                chunks.append(current)
+                current = ''
+            while len(line) > chunk_size:
+                chunks.append(line[:chunk_size])
+                line = line[chunk_size:]
+            current = f'{current}\n{line}' if current else line
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def idf_weight(document_frequency, n):
+    """
+    IDF（逆文書頻度）を計算する（ProductIndex と select_relevant_chunks で共通）
+
+    Args:
+        document_frequency (int): トークンを含むチャンク数
+        n (int): チャンク数
+
+    Returns:
+        float: 重み
+    """
+    return math.log((1 + n) / (1 + document_frequency)) + 1
+
+
+def tf_weight(count):
+    """
+    出現回数の重みを計算する（対数で抑え、同じ語の繰り返しが有利になりすぎないようにする）
+
+    Args:
+        count (int or numpy.ndarray): 出現回数
+
+    Returns:
+        float or numpy.ndarray: 重み
+    """
+    if isinstance(count, np.ndarray):
+        return 1 + np.log(count)
+    return 1 + math.log(count)
+
+
+def weighted_terms(text, idf):
+    """
+    テキストのトークンごとのTF-IDFの重みを計算する（idf に含まれないトークンは除く）
+
+    Args:
+        text (str): テキスト
+        idf (dict): トークンをキー、IDFを値とする辞書
+
+    Returns:
+        dict: トークンをキー、重みを値とする辞書
+    """
+    return {token: tf_weight(count) * idf[token] for token, count in Counter(tokenize(text)).items() if token in idf}
+
+
+class ProductIndex:
+    """
+    製品説明のチャンクに対するTF-IDFの検索インデックス
+
+    チャンク×語彙の行列は非ゼロ要素（行・列・重み）の配列として保持し、
+    スコアは np.bincount で集計する。長い仕様書でも語彙数×チャンク数の密な行列を作成しない。
+    """
+
+    def __init__(self, text, chunk_size):
+        self.chunks = split_chunks(text, chunk_size)
+        self.vocabulary = {}
+        rows, cols, counts = [], [], []
+        document_frequency = Counter()
+        for row, chunk in enumerate(self.chunks):
+            for token, count in Counter(tokenize(chunk)).items():
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+                counts.append(count)
+                document_frequency[token] += 1
+
+        n = len(self.chunks)
+        self.idf = np.ones(len(self.vocabulary), dtype=np.float32)
+        for token, df in document_frequency.items():
+            self.idf[self.vocabulary[token]] = idf_weight(df, n)
+
+        self.rows = np.array(rows, dtype=np.int32)
+        self.cols = np.array(cols, dtype=np.int32)
+        # 出現回数は対数で抑え、チャンクごとにL2正規化する（長いチャンクが有利にならないようにする）
+        weights = tf_weight(np.array(counts, dtype=np.float32)) * self.idf[self.cols]
+        norms = np.sqrt(np.bincount(self.rows, weights=weights ** 2, minlength=n))
+        self.weights = weights / np.maximum(norms, 1e-12)[self.rows]
+
+    def scores(self, query):
+        """
+        クエリに対する各チャンクのコサイン類似度を計算する
+
+        Returns:
+            numpy.ndarray: チャンクごとのスコア
+        """
+        vector = np.zeros(len(self.vocabulary), dtype=np.float32)
+        for token, count in Counter(tokenize(query)).items():
+            index = self.vocabulary.get(token)
+            if index is not None:
+                vector[index] = tf_weight(count) * self.idf[index]
+        return np.bincount(self.rows, weights=self.weights * vector[self.cols], minlength=len(self.chunks))
+
+    def search(self, query, top_k):
+        """
+        クエリに関連するチャンクを取得する
+
+        一致するチャンクがない場合は先頭のチャンク（概要が書かれていることが多い）を返す。
+
+        Args:
+            query (str): クエリ
+            top_k (int): 取得するチャンク数
+
+        Returns:
+            list: チャンクのリスト（元のテキストの順序）
+        """
+        scores = self.scores(query)
+        ranked = np.argsort(-scores, kind='stable')[:top_k]
+        selected = [int(i) for i in ranked if scores[i] > 0]
+        if not selected:
+            selected = list(range(min(top_k, len(self.chunks))))
+        return [self.chunks[i] for i in sorted(selected)]
+
+
+@lru_cache(maxsize=INDEX_CACHE_SIZE)
+def get_product_index(text, chunk_size):
+    """
+    製品説明のインデックスを取得する（同じテキストのインデックスはプロセス内で再利用する）
+    """
+    return ProductIndex(text, chunk_size)
+
+
+def select_relevant_text(text, query, top_k, chunk_size):
+    """
+    製品説明のうちクエリに関連するチャンクのみを抜き出す
+
+    結果は最大 top_k × chunk_size 文字程度になるため、仕様書が長くてもプロンプトの長さは一定に収まる。
+
+    Args:
+        text (str): 製品説明
+        query (str): クエリ（セクションのタイトル・説明・ガイドラインなど）
+        top_k (int): 取得するチャンク数
+        chunk_size (int): チャンクの最大文字数
+
+    Returns:
+        str: 抜き出したチャンクを元の順序で連結したテキスト
+    """
+    return '\n...\n'.join(get_product_index(text, chunk_size).search(query, top_k))
+
+
+def select_relevant_chunks(iter_chunks, queries, top_k):
+    """
+    保存済みのチャンクを1件ずつ読み込みながら、クエリごとに関連するチャンクを選ぶ
+
+    1回目の読み込みで文書頻度を数え、2回目の読み込みでスコアを計算する。
+    保持するのは語彙ごとの文書頻度と、クエリごとの上位 top_k 件のチャンク番号のみのため、
+    チャンクの合計が大きくてもテキスト全体をメモリに読み込まない。
+
+    Args:
+        iter_chunks (function): 呼び出すたびに先頭からチャンクのテキストを返すイテレータを作成する関数
+        queries (list): クエリのリスト
+        top_k (int): クエリごとに選ぶチャンク数
+
+    Returns:
+        list: クエリごとに選んだチャンク番号のリスト（元の順序。一致しない場合は先頭のチャンク）
+    """
+    document_frequency = Counter()
+    n = 0
+    for chunk in iter_chunks():
+        document_frequency.update(set(tokenize(chunk)))
+        n += 1
+    if n == 0:
+        return [[] for _ in queries]
+    idf = {token: idf_weight(df, n) for token, df in document_frequency.items()}
+    del document_frequency
+
+    query_vectors = [weighted_terms(query, idf) for query in queries]
+    heaps = [[] for _ in queries]
+    for index, chunk in enumerate(iter_chunks()):
+        weights = weighted_terms(chunk, idf)
+        # ProductIndex と同じくチャンクごとにL2正規化する
+        norm = math.sqrt(sum(weight ** 2 for weight in weights.values())) or 1.0
+        for vector, heap in zip(query_vectors, heaps):
+            score = sum(weight * weights.get(token, 0.0) for token, weight in vector.items()) / norm
+            if score <= 0:
+                continue
+            # 同じスコアの場合は先に出現したチャンクを優先する
+            entry = (score, -index)
+            if len(heap) < top_k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+
+    return [
+        sorted(-index for _, index in heap) if heap else list(range(min(top_k, n)))
+        for heap in heaps
+    ]
@@ -0,0 +1,50 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+_END = object()
+
+
+async def iterate_in_thread(iterator):
+    """
+    同期イテレータを1要素ずつスレッドで進める非同期イテレータに変換する
+
+    ASGIでは同期イテレータの StreamingHttpResponse は送信前にすべて読み込まれるため、
+    1要素ずつ取得して送信する。thread_sensitive のスレッドで進めるため、
+    サーバーサイドカーソルなどのデータベース接続は同じスレッドで使用される。
+
+    Args:
+        iterator (iterable): 同期イテレータ
+
+    Yields:
+        iterator の要素
+    """
+    iterator = iter(iterator)
+    next_item = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            item = await next_item(iterator, _END)
+            if item is _END:
+                return
+            yield item
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close, thread_sensitive=True)()
+
+
+def streaming_response(request, iterator, **kwargs):
+    """
+    実行環境（WSGI / ASGI）に合わせて、少しずつ送信する StreamingHttpResponse を作成する
+
+    Args:
+        request (HttpRequest): リクエスト
+        iterator (iterable): 送信する内容の同期イテレータ
+        **kwargs: StreamingHttpResponse の引数（content_type など）
+
+    Returns:
+        StreamingHttpResponse: レスポンス
+    """
+    if isinstance(request, ASGIRequest):
+        iterator = iterate_in_thread(iterator)
+    return StreamingHttpResponse(iterator, **kwargs)
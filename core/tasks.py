@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from .archive import archive_openai_requests
+from .request_log import get_request_log
+
+
+@shared_task
+def archive_openai_requests_task(days=None, batch_size=1000):
+    """
+    保持期間を過ぎた OpenAIRequest をアーカイブして削除するCeleryタスク（定期実行）
+
+    days を省略した場合は settings.OPENAI_REQUEST_RETENTION_DAYS を使用し、0 の場合は何もしない。
+
+    Returns:
+        dict: archive_openai_requests() の戻り値
+    """
+    if days is None:
+        days = getattr(settings, 'OPENAI_REQUEST_RETENTION_DAYS', 90)
+    if not days:
+        return {'archived': 0, 'path': None, 'deleted_blobs': 0}
+    return archive_openai_requests(timezone.now() - timedelta(days=days), batch_size=batch_size)
+
+
+@shared_task
+def flush_request_log_task():
+    """
+    保留中のLLM呼び出しの記録を保存するCeleryタスク（定期実行）
+
+    RedisRequestLog を使用する場合に、異常終了したワーカーが残した記録も保存する。
+
+    Returns:
+        int: 保存した件数
+    """
+    return get_request_log().flush()
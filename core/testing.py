@@ -0,0 +1,31 @@
+from django.test import override_settings
+
+from .request_log import get_request_log
+
+# テストではレート制限による待機が発生しないようにする
+UNLIMITED_RATE_LIMIT = {'REQUESTS_PER_MINUTE': 10 ** 6, 'TOKENS_PER_MINUTE': 10 ** 9}
+
+
+def without_rate_limit(**overrides):
+    """
+    LLM呼び出しのレート制限を外す override_settings を作成する（テストクラス・メソッドのデコレータ）
+
+    Args:
+        **overrides: 合わせて上書きする設定
+
+    Returns:
+        override_settings: 設定の上書き
+    """
+    return override_settings(LLM_RATE_LIMIT=UNLIMITED_RATE_LIMIT, **overrides)
+
+
+class FlushRequestLogMixin:
+    """
+    テストの終了時に、バッファされたLLM呼び出しの記録（OpenAIRequest）を保存するテストケースのミックスイン
+
+    記録が次のテストに持ち越されないようにする。setUp をオーバーライドする場合は super().setUp() を呼び出す。
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(get_request_log().flush)
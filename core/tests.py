@@ -1,6 +1,34 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import tempfile
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import openai
+from asgiref.sync import async_to_sync
+from django.test import TestCase, AsyncClient
+from django.core.cache import cache
 from django.contrib.auth.models import User
-from core.models import OpenAIRequest
+from django.test import override_settings
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from core.archive import archive_openai_requests
+from core.models import OpenAIRequest, PromptBlob, LLMResponseCache
+from core.llm_backends import FakeLLMBackend, OpenAIBackend, LLMOverloadedError, get_llm_backend
+from core.llm_cache import LocMemLLMCache, DjangoLLMCache, DatabaseLLMCache, get_llm_cache
+from core.ratelimit import LocalRateLimiter, AdaptiveConcurrencyLimiter, get_concurrency_limiter
+from core.request_log import BufferedRequestLog, RedisRequestLog, get_request_log
+from core.testing import FlushRequestLogMixin, without_rate_limit
+from core.retrieval import ProductIndex, tokenize, split_chunks, select_relevant_chunks, select_relevant_text
+from core.utils import (
+    generate_test_document_with_progress, generate_test_document_combined, chunk_section_templates, call_llm,
+    build_section_prompt,
+)
 
 # Test models
 class OpenAIRequestModelTest(TestCase):
@@ -18,3 +46,608 @@ class OpenAIRequestModelTest(TestCase):
 
     def test_request_str(self):
         self.assertIn(f"OpenAI Request {self.request.id}", str(self.request))
+
+
+class PromptStorageTest(TestCase):
+    """
+    プロンプトをセグメントごとに重複を除いて圧縮保存するテスト
+    """
+
+    def setUp(self):
+        self.common = '共通のシステムプロンプト。' * 200
+
+    def test_shared_segments_are_stored_once(self):
+        for i in range(3):
+            OpenAIRequest.objects.create(prompt=f'{self.common}\n\nセクション: {i}', response='r')
+
+        # 共通部分1件 + セクションごとの3件
+        self.assertEqual(PromptBlob.objects.count(), 4)
+        blob = PromptBlob.objects.get(size=len(self.common))
+        self.assertLess(len(bytes(blob.data)), blob.size)
+        self.assertEqual(blob.text, self.common)
+
+    def test_prompt_round_trips(self):
+        prompt = f'{self.common}\n\n\n\n末尾\n'
+        request = OpenAIRequest.objects.create(prompt=prompt, response='r')
+        self.assertEqual(OpenAIRequest.objects.get(pk=request.pk).prompt, prompt)
+
+        request.prompt = '更新後'
+        request.save()
+        self.assertEqual(OpenAIRequest.objects.get(pk=request.pk).prompt, '更新後')
+
+    def test_bulk_create_stores_segments(self):
+        requests = OpenAIRequest.objects.bulk_create([
+            OpenAIRequest(prompt=f'{self.common}\n\nセクション: 項目{i}', response='r') for i in range(5)
+        ])
+        self.assertEqual(PromptBlob.objects.count(), 6)
+        for i, request in enumerate(requests):
+            self.assertEqual(OpenAIRequest.objects.get(pk=request.pk).prompt, f'{self.common}\n\nセクション: 項目{i}')
+
+    def test_section_prompt_is_split_by_component(self):
+        # 段落の多い製品説明でも、製品説明・テンプレート部分・品質の指示の3セグメントになる
+        description = '\n\n'.join(f'段落{i}' for i in range(50))
+        templates = [
+            SimpleNamespace(id=i, title=f'セクション{i}', description='', content_guidelines='', ai_prompt='')
+            for i in range(2)
+        ]
+        for template in templates:
+            request = OpenAIRequest.objects.create(prompt=build_section_prompt(description, template), response='r')
+            self.assertEqual(request.segments.count(), 3)
+            self.assertEqual(OpenAIRequest.objects.get(pk=request.pk).prompt, build_section_prompt(description, template))
+
+        # 製品説明と品質の指示は共有され、テンプレート部分のみがセクションごとに保存される
+        self.assertEqual(PromptBlob.objects.count(), 4)
+
+
+class OpenAIRequestArchiveTest(TestCase):
+    """
+    保持期間を過ぎた OpenAIRequest のアーカイブと削除のテスト
+    """
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        override = override_settings(MEDIA_ROOT=media_root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        old = timezone.now() - timedelta(days=100)
+        for i in range(3):
+            request = OpenAIRequest.objects.create(prompt=f'共通\n\n古い{i}', response=f'古い応答{i}', tokens_used=i)
+            OpenAIRequest.objects.filter(pk=request.pk).update(created_at=old)
+        PromptBlob.objects.update(created_at=old)
+        self.recent = OpenAIRequest.objects.create(prompt='共通\n\n新しい', response='新しい応答')
+
+    def test_archive_writes_jsonl_and_deletes(self):
+        result = archive_openai_requests(timezone.now() - timedelta(days=90), batch_size=2)
+
+        self.assertEqual(result['archived'], 3)
+        with default_storage.open(result['path'], 'rb') as f:
+            records = [json.loads(line) for line in gzip.decompress(f.read()).decode('utf-8').splitlines()]
+        self.assertEqual([r['prompt'] for r in records], [f'共通\n\n古い{i}' for i in range(3)])
+        self.assertEqual([r['response'] for r in records], [f'古い応答{i}' for i in range(3)])
+
+        self.assertEqual(list(OpenAIRequest.objects.all()), [self.recent])
+        # 古い記録だけが参照していたブロブは削除し、共有されているブロブは残す
+        self.assertEqual(result['deleted_blobs'], 3)
+        self.assertEqual(OpenAIRequest.objects.get().prompt, '共通\n\n新しい')
+
+    def test_recent_blobs_are_kept_until_referenced(self):
+        # 保存中のリクエスト（ブロブを作成してからセグメントを保存するまでの間）のブロブ
+        blob_ids = PromptBlob.store({'pending': '保存中'})
+        result = archive_openai_requests(timezone.now() - timedelta(days=90))
+
+        self.assertEqual(result['deleted_blobs'], 3)
+        self.assertTrue(PromptBlob.objects.filter(id=blob_ids['pending']).exists())
+
+    def test_admin_download_streams_jsonl_under_asgi(self):
+        self.client.force_login(User.objects.create_superuser(username='admin', password='adminpassword'))
+        url = reverse('admin:core_openairequest_changelist')
+        data = {
+            'action': 'download_jsonl',
+            '_selected_action': list(OpenAIRequest.objects.order_by('id').values_list('id', flat=True)),
+        }
+
+        async def collect():
+            client = AsyncClient()
+            client.cookies = self.client.cookies
+            response = await client.post(url, data)
+            return response, [chunk async for chunk in response.streaming_content]
+
+        response, chunks = async_to_sync(collect)()
+        # 同期イテレータのように送信前にすべて読み込まれず、1件ずつ送信される
+        self.assertTrue(response.is_async)
+        self.assertEqual(len(chunks), 4)
+        records = [json.loads(chunk) for chunk in chunks]
+        self.assertEqual([r['prompt'] for r in records], [f'共通\n\n古い{i}' for i in range(3)] + ['共通\n\n新しい'])
+
+    @override_settings(OPENAI_REQUEST_RETENTION_DAYS=90)
+    def test_command_uses_retention_setting(self):
+        call_command('archive_openai_requests', stdout=io.StringIO())
+        self.assertEqual(OpenAIRequest.objects.count(), 1)
+
+    @override_settings(OPENAI_REQUEST_RETENTION_DAYS=0)
+    def test_zero_retention_keeps_everything(self):
+        call_command('archive_openai_requests', stdout=io.StringIO())
+        self.assertEqual(OpenAIRequest.objects.count(), 4)
+
+
+class FakeRedis:
+    """
+    RedisRequestLog が使用するコマンドのみを実装したRedisクライアント
+    """
+
+    def __init__(self):
+        self.lists = {}
+        # ロックの期限切れなどで解放に失敗する場合の例外
+        self.release_error = None
+
+    def rpush(self, key, *values):
+        items = self.lists.setdefault(key, [])
+        items.extend(value.encode('utf-8') for value in values)
+        return len(items)
+
+    def delete(self, key):
+        self.lists.pop(key, None)
+
+    def lock(self, name, timeout=None, blocking=True):
+        lock = mock.Mock()
+        lock.acquire.return_value = True
+        lock.release.side_effect = self.release_error
+        return lock
+
+    def register_script(self, script):
+        def claim(keys, args):
+            key, processing_key = keys
+            if self.lists.get(processing_key):
+                return list(self.lists[processing_key])
+            items = self.lists.get(key, [])[:args[0]]
+            if items:
+                del self.lists[key][:len(items)]
+                self.lists[processing_key] = list(items)
+            return items
+        return claim
+
+
+class RequestLogTest(TestCase):
+    """
+    LLM呼び出しの記録をまとめて保存するログのテスト
+    """
+
+    def test_records_are_flushed_in_batches(self):
+        log = BufferedRequestLog(max_batch=3, flush_interval=3600)
+        with self.assertNumQueries(0):
+            log.record('共通\n\nプロンプト1', '応答1', 10)
+            log.record('共通\n\nプロンプト2', '応答2', 20)
+        self.assertFalse(OpenAIRequest.objects.exists())
+
+        # max_batch 件たまった時点でまとめて保存する
+        log.record('共通\n\nプロンプト3', '応答3', 30)
+        self.assertEqual(log.pending(), 0)
+        self.assertEqual(
+            sorted((r.prompt, r.response, r.tokens_used) for r in OpenAIRequest.objects.all()),
+            [(f'共通\n\nプロンプト{i}', f'応答{i}', i * 10) for i in range(1, 4)],
+        )
+
+    def test_flush_after_interval(self):
+        log = BufferedRequestLog(max_batch=100, flush_interval=0)
+        log.record('プロンプト', '応答', 1)
+        self.assertEqual(OpenAIRequest.objects.count(), 1)
+
+    def test_failed_flush_is_retried(self):
+        log = BufferedRequestLog(max_batch=100, flush_interval=3600)
+        log.record('プロンプト', '応答', 1)
+        with mock.patch('core.request_log.write_records', side_effect=Exception('database is locked')):
+            self.assertEqual(log.flush(), 0)
+        self.assertEqual(log.pending(), 1)
+
+        self.assertEqual(log.flush(), 1)
+        self.assertEqual(OpenAIRequest.objects.get().prompt, 'プロンプト')
+
+    def test_redis_records_are_retried_without_duplicates(self):
+        client = FakeRedis()
+        with mock.patch('redis.Redis.from_url', return_value=client):
+            log = RedisRequestLog('redis://localhost:6379/0', max_batch=2, flush_interval=3600)
+
+        # 書き込みに失敗した記録は保存中のリストに残り、ロックの解放に失敗しても例外を送出しない
+        client.release_error = Exception('Cannot release a lock that\'s no longer owned')
+        with mock.patch('core.request_log.write_records', side_effect=Exception('database is locked')):
+            log.record('プロンプト1', '応答1', 1)
+            log.record('プロンプト2', '応答2', 2)
+        self.assertFalse(OpenAIRequest.objects.exists())
+        self.assertEqual(client.lists[log.key], [])
+        self.assertEqual(len(client.lists[log.processing_key]), 2)
+
+        self.assertEqual(log.flush(), 2)
+        self.assertEqual(log.flush(), 0)
+        self.assertEqual(
+            sorted(OpenAIRequest.objects.values_list('response', flat=True)), ['応答1', '応答2'],
+        )
+        self.assertNotIn(log.processing_key, client.lists)
+
+    @override_settings(LLM_REQUEST_LOG={
+        'BACKEND': 'core.request_log.BufferedRequestLog', 'OPTIONS': {'max_batch': 100, 'flush_interval': 3600},
+    })
+    def test_pending_records_are_flushed_when_request_finishes(self):
+        get_request_log().record('プロンプト', '応答', 1)
+        self.assertFalse(OpenAIRequest.objects.exists())
+
+        self.client.get('/')
+        self.assertEqual(OpenAIRequest.objects.count(), 1)
+
+
+# Test utils
+@without_rate_limit()
+class GenerateTestDocumentWithProgressTest(FlushRequestLogMixin, TestCase):
+    """並列セクション生成のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        get_llm_cache().clear()
+        self.templates = [
+            SimpleNamespace(id=i, title=f'セクション{i}', description='', content_guidelines='', ai_prompt='', order=order)
+            for i, order in ((1, 3), (2, 1), (3, 2))
+        ]
+
+    def fake_create(self, **kwargs):
+        prompt = kwargs['messages'][1]['content']
+        if 'セクション3' in prompt:
+            raise RuntimeError('rate limited')
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=prompt.split('セクション: ')[1].split('\n')[0]))],
+            usage=SimpleNamespace(total_tokens=10),
+        )
+
+    def test_results_are_ordered_and_errors_isolated(self):
+        progress = []
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=self.fake_create):
+            result = generate_test_document_with_progress(
+                '製品説明', self.templates, lambda i, p: progress.append((i, p)), max_concurrency=3
+            )
+
+        self.assertEqual(list(result.keys()), [2, 3, 1])
+        self.assertEqual(result[1], 'セクション1')
+        self.assertEqual(result[2], 'セクション2')
+        self.assertIn('rate limited', result[3])
+        get_request_log().flush()
+        self.assertEqual(OpenAIRequest.objects.count(), 2)
+        # すべてのセクションが完了として報告される
+        self.assertEqual(sorted(i for i, p in progress if p == 100), [0, 1, 2])
+
+    def test_requests_run_concurrently(self):
+        def slow_create(**kwargs):
+            time.sleep(0.2)
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content='ok'))],
+                usage=SimpleNamespace(total_tokens=10),
+            )
+
+        templates = [
+            SimpleNamespace(id=i, title='', description='', content_guidelines='', ai_prompt='', order=i)
+            for i in range(8)
+        ]
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=slow_create):
+            start = time.perf_counter()
+            generate_test_document_with_progress('製品説明', templates, max_concurrency=8)
+            elapsed = time.perf_counter() - start
+
+        self.assertLess(elapsed, 0.2 * 8 / 2)
+
+
+@without_rate_limit()
+class CombinedGenerationTest(FlushRequestLogMixin, TestCase):
+    """複数セクションをまとめて生成するテスト"""
+
+    def setUp(self):
+        super().setUp()
+        get_llm_cache().clear()
+        self.templates = [
+            SimpleNamespace(id=i, title=f'セクション{i}', description='', content_guidelines='', ai_prompt='',
+                            order=i, form_type='text')
+            for i in range(1, 5)
+        ]
+
+    def fake_create(self, **kwargs):
+        prompt = kwargs['messages'][1]['content']
+        if '### ID:' in prompt:
+            # セクション4の内容を含めず、コードブロックで囲んで返す
+            sections = {str(i): f'まとめて{i}' for i in range(1, 4)}
+            content = '```json\n' + json.dumps({'sections': sections}, ensure_ascii=False) + '\n```'
+        else:
+            content = prompt.split('セクション: ')[1].split('\n')[0]
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(total_tokens=10),
+        )
+
+    def test_missing_sections_fall_back_to_per_section_requests(self):
+        progress = []
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=self.fake_create) as create:
+            result = generate_test_document_combined(
+                '製品説明', self.templates, lambda i, p: progress.append((i, p))
+            )
+
+        self.assertEqual(result, {1: 'まとめて1', 2: 'まとめて2', 3: 'まとめて3', 4: 'セクション4'})
+        # まとめたリクエスト1回と、解析できなかったセクションのリクエスト1回
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(create.call_args_list[0].kwargs['max_tokens'], 800)
+        get_request_log().flush()
+        self.assertEqual(OpenAIRequest.objects.count(), 2)
+        self.assertEqual(sorted(i for i, p in progress if p == 100), [0, 1, 2, 3])
+
+    def test_invalid_json_falls_back(self):
+        def create(**kwargs):
+            return SimpleNamespace(
+                choices=[SimpleNamespace(message=SimpleNamespace(content='JSONではない応答'))],
+                usage=SimpleNamespace(total_tokens=10),
+            )
+
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=create) as create:
+            result = generate_test_document_combined('製品説明', self.templates)
+
+        self.assertEqual(create.call_count, 5)
+        self.assertEqual(set(result.values()), {'JSONではない応答'})
+
+    def test_sections_are_chunked_to_fit_limits(self):
+        self.templates[1].form_type = 'markdown'
+        with override_settings(GENERATION_COMBINED_MAX_SECTIONS=2, GENERATION_COMBINED_MAX_OUTPUT_TOKENS=1300):
+            chunks = chunk_section_templates('製品説明', self.templates)
+        self.assertEqual([[t.id for t in chunk] for chunk in chunks], [[1], [2], [3, 4]])
+
+        with override_settings(LLM_CONTEXT_WINDOW=1500):
+            chunks = chunk_section_templates('製品説明' * 200, self.templates)
+        self.assertTrue(all(len(chunk) == 1 for chunk in chunks))
+
+
+class RetrievalTest(TestCase):
+    """製品説明の関連チャンク検索のテスト"""
+
+    SPEC = """概要:
+勤怠管理システム。従業員の出退勤を記録する。
+
+機能一覧:
+- 打刻機能
+- 休暇申請機能
+
+動作環境:
+OS: Windows 11
+ブラウザ: Chrome 120
+""" + '\n\n'.join(f'付録{i}: 画面遷移の補足説明。' for i in range(200))
+
+    def test_japanese_text_is_tokenized_into_bigrams(self):
+        self.assertEqual(tokenize('テスト環境はＷｉｎｄｏｗｓ'), ['windows', 'テス', 'スト', 'ト環', '環境', '境は'])
+        self.assertTrue(all(len(chunk) <= 20 for chunk in split_chunks('あ' * 50 + '\nい', 20)))
+
+    def test_relevant_chunks_are_selected_in_order(self):
+        text = select_relevant_text(self.SPEC, '動作環境 OS ブラウザ', top_k=2, chunk_size=40)
+        self.assertIn('Windows 11', text)
+        self.assertNotIn('打刻機能', text)
+
+        text = select_relevant_text(self.SPEC, '機能 打刻 動作環境', top_k=2, chunk_size=40)
+        self.assertLess(text.index('打刻機能'), text.index('Windows 11'))
+
+    @override_settings(PRODUCT_RETRIEVAL_ENABLED=True, PRODUCT_RETRIEVAL_MIN_LENGTH=100,
+                       PRODUCT_RETRIEVAL_TOP_K=3, PRODUCT_RETRIEVAL_CHUNK_SIZE=40)
+    def test_section_prompt_size_is_bounded(self):
+        template = SimpleNamespace(id=1, title='テスト環境', description='OSとブラウザ', content_guidelines='',
+                                   ai_prompt='', order=1)
+        prompt = build_section_prompt(self.SPEC * 10, template)
+        self.assertIn('Windows 11', prompt)
+        self.assertLess(len(prompt), len(build_section_prompt('', template)) + 3 * 40 + 20)
+
+    def test_streamed_chunks_match_index_search(self):
+        # 保存済みのチャンクを読み込みながら選ぶ場合も、インデックスの検索と同じチャンクを選ぶ
+        chunks = split_chunks(self.SPEC, 40)
+        queries = ['動作環境 OS ブラウザ', '機能 打刻 動作環境', '該当なし']
+        selected = select_relevant_chunks(lambda: iter(chunks), queries, top_k=2)
+        for query, indexes in zip(queries, selected):
+            self.assertEqual([chunks[i] for i in indexes], ProductIndex(self.SPEC, 40).search(query, 2))
+
+    def test_excerpts_are_added_per_template(self):
+        templates = [
+            SimpleNamespace(id=i, title=f'セクション{i}', description='', content_guidelines='', ai_prompt='', order=i)
+            for i in range(2)
+        ]
+        excerpts = {0: '仕様書の抜粋'}
+        self.assertIn('製品説明:\n概要\n\n仕様書の抜粋\n', build_section_prompt('概要', templates[0], excerpts=excerpts))
+        self.assertNotIn('仕様書の抜粋', build_section_prompt('概要', templates[1], excerpts=excerpts))
+
+
+@without_rate_limit()
+class LLMCacheTest(FlushRequestLogMixin, TestCase):
+    """LLMレスポンスキャッシュのテスト"""
+
+    def setUp(self):
+        super().setUp()
+        get_llm_cache().clear()
+        get_llm_cache().reset_stats()
+        self.templates = [
+            SimpleNamespace(id=1, title='セクション', description='', content_guidelines='', ai_prompt='', order=1)
+        ]
+        self.response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='内容'))],
+            usage=SimpleNamespace(total_tokens=10),
+        )
+
+    def test_locmem_cache_evicts_least_recently_used(self):
+        cache = LocMemLLMCache(max_entries=2)
+        cache.set('a', ('A', 1))
+        cache.set('b', ('B', 1))
+        cache.get('a')
+        cache.set('c', ('C', 1))
+        self.assertEqual(cache.get('a'), ('A', 1))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1})
+
+    def test_locmem_cache_expires_entries(self):
+        cache = LocMemLLMCache(ttl=60)
+        cache.set('a', ('A', 1))
+        with mock.patch('core.llm_cache.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get('a'))
+
+    def test_django_cache_clear_keeps_other_entries(self):
+        cache.set('progress', '進捗')
+        llm_cache = DjangoLLMCache()
+        llm_cache.set('a', ('A', 1))
+        llm_cache.clear()
+        self.assertIsNone(llm_cache.get('a'))
+        # 同じキャッシュの他のエントリは削除しない
+        self.assertEqual(cache.get('progress'), '進捗')
+        llm_cache.set('a', ('B', 1))
+        self.assertEqual(DjangoLLMCache().get('a'), ('B', 1))
+
+    def test_database_cache_evicts_by_size(self):
+        cache = DatabaseLLMCache(max_entries=2)
+        for key in ('a', 'b', 'c'):
+            cache.set(key, (key.upper(), 1))
+        self.assertEqual(LLMResponseCache.objects.count(), 2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('c'), ('C', 1))
+
+    def test_identical_request_is_served_from_cache(self):
+        with mock.patch.object(openai.ChatCompletion, 'create', return_value=self.response) as create:
+            generate_test_document_with_progress('製品説明', self.templates)
+            result = generate_test_document_with_progress('製品説明', self.templates)
+
+        self.assertEqual(create.call_count, 1)
+        self.assertEqual(result, {1: '内容'})
+        self.assertEqual(get_llm_cache().stats(), {'hits': 1, 'misses': 1})
+
+    def test_bypass_flag_skips_cache(self):
+        with mock.patch.object(openai.ChatCompletion, 'create', return_value=self.response) as create:
+            generate_test_document_with_progress('製品説明', self.templates)
+            generate_test_document_with_progress('製品説明', self.templates, use_cache=False)
+
+        self.assertEqual(create.call_count, 2)
+
+    @override_settings(LLM_CACHE=None)
+    def test_cache_can_be_disabled(self):
+        self.assertIsNone(get_llm_cache())
+
+
+class RateLimitTest(FlushRequestLogMixin, TestCase):
+    """レート制限と適応的な同時実行数制御のテスト"""
+
+    def test_token_bucket_limits_requests_and_tokens(self):
+        now = [0.0]
+        limiter = LocalRateLimiter(requests_per_minute=60, tokens_per_minute=600, clock=lambda: now[0])
+
+        self.assertEqual(limiter.try_acquire(500), 0)
+        # トークン数のバケットが足りない: 400トークンの補充に40秒
+        self.assertAlmostEqual(limiter.try_acquire(500), 40.0)
+        now[0] = 40.0
+        self.assertEqual(limiter.try_acquire(500), 0)
+
+    def test_aimd_backs_off_and_ramps_up(self):
+        limiter = AdaptiveConcurrencyLimiter(initial=8, minimum=1, maximum=10)
+        limiter.on_overload()
+        self.assertEqual(limiter.limit, 4)
+        for _ in range(4):
+            limiter.on_success()
+        self.assertAlmostEqual(limiter.limit, 5, places=0)
+        for _ in range(10):
+            limiter.on_overload()
+        self.assertEqual(limiter.limit, 1)
+
+    @without_rate_limit(LLM_CONCURRENCY={'INITIAL': 4})
+    def test_rate_limited_calls_are_retried(self):
+        response = SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='内容'))],
+            usage=SimpleNamespace(total_tokens=10),
+        )
+        side_effect = [openai.error.RateLimitError('429'), response]
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=side_effect), \
+                mock.patch('core.utils.time.sleep') as sleep:
+            self.assertEqual(call_llm('プロンプト'), ('内容', 10))
+
+        sleep.assert_called_once()
+        # 429で半分に減り、成功で少し増える
+        self.assertEqual(get_concurrency_limiter().limit, 2.5)
+
+    @without_rate_limit()
+    def test_streaming_retry_resets_partial_content(self):
+        def chunks(*parts, error=None):
+            for part in parts:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta={'content': part})])
+            if error:
+                raise error
+
+        side_effect = [chunks('途中', error=openai.error.RateLimitError('429')), chunks('最初', 'から')]
+        events = []
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=side_effect), \
+                mock.patch('core.utils.time.sleep'):
+            result = call_llm('プロンプト', on_delta=events.append, on_reset=lambda: events.append(None))
+
+        # 差分のみが通知され、再試行の前に破棄が通知される
+        self.assertEqual(events, ['途中', None, '最初', 'から'])
+        self.assertEqual(result, ('最初から', 2))
+
+
+@without_rate_limit()
+class LLMBackendTest(FlushRequestLogMixin, TestCase):
+    """LLMバックエンドのテスト"""
+
+    def test_fake_backend_is_deterministic(self):
+        messages = [{'role': 'user', 'content': 'プロンプト'}]
+
+        def run():
+            backend = FakeLLMBackend(latency=0.01, distribution='lognormal', jitter=0.5, failure_rate=0.3,
+                                     failure='error', tokens=50, seed=42)
+            outcomes = []
+            for _ in range(10):
+                try:
+                    outcomes.append(backend.complete(messages))
+                except RuntimeError:
+                    outcomes.append('failed')
+            return outcomes
+
+        outcomes = run()
+        self.assertEqual(outcomes, run())
+        self.assertIn('failed', outcomes)
+        self.assertEqual(len(next(o for o in outcomes if o != 'failed')[0]), 50)
+
+    @override_settings(LLM_BACKEND={'BACKEND': 'core.llm_backends.FakeLLMBackend', 'OPTIONS': {'tokens': 30}})
+    def test_generation_uses_configured_backend(self):
+        templates = [
+            SimpleNamespace(id=i, title=f'セクション{i}', description='', content_guidelines='', ai_prompt='', order=i)
+            for i in range(3)
+        ]
+        with mock.patch.object(openai.ChatCompletion, 'create') as create:
+            result = generate_test_document_with_progress('製品説明', templates, use_cache=False)
+
+        create.assert_not_called()
+        self.assertEqual(get_llm_backend().calls, 3)
+        self.assertTrue(all(content.startswith('模擬レスポンス') for content in result.values()))
+        get_request_log().flush()
+        self.assertEqual(next(r for r in OpenAIRequest.objects.all() if 'セクション1' in r.prompt).tokens_used, 30)
+
+    @override_settings(LLM_BACKEND={
+        'BACKEND': 'core.llm_backends.FakeLLMBackend', 'OPTIONS': {'failure_rate': 1.0},
+    }, LLM_MAX_RETRIES=2)
+    def test_injected_overload_is_retried(self):
+        with mock.patch('core.utils.time.sleep'):
+            with self.assertRaises(LLMOverloadedError):
+                call_llm('プロンプト')
+
+        self.assertEqual(get_llm_backend().calls, 3)
+
+    def test_openai_batch_results_are_normalized(self):
+        backend = OpenAIBackend(api_key='test')
+        output = '\n'.join([
+            json.dumps({'custom_id': '1-1', 'error': None, 'response': {'status_code': 200, 'body': {
+                'choices': [{'message': {'content': '内容'}}], 'usage': {'total_tokens': 12},
+            }}}),
+            json.dumps({'custom_id': '1-2', 'error': None, 'response': {'status_code': 429, 'body': {
+                'error': {'message': 'Rate limit'},
+            }}}),
+        ]).encode('utf-8')
+        batch = {'status': 'completed', 'error': '', 'output_file_id': 'file-out', 'error_file_id': None}
+
+        with mock.patch.object(openai.File, 'download', return_value=output) as download:
+            results = list(backend.get_batch_results(batch))
+
+        download.assert_called_once_with('file-out', api_key='test')
+        self.assertEqual(results, [
+            {'custom_id': '1-1', 'content': '内容', 'tokens_used': 12, 'error': ''},
+            {'custom_id': '1-2', 'content': '', 'tokens_used': 0, 'error': 'Rate limit'},
+        ])
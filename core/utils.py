@@ -1,169 +1,804 @@
-import os
-import openai
+import json
+import queue
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
-from .models import OpenAIRequest
+from .llm_backends import get_llm_backend
+from .llm_cache import get_llm_cache, make_cache_key
+from .ratelimit import acquire, get_rate_limiter, get_concurrency_limiter
+from .request_log import get_request_log
+from .retrieval import select_relevant_text
 
-# OpenAI APIキーを設定
-openai.api_key = os.environ.get('OPENAI_API_KEY')
+# システムプロンプト
+SYSTEM_PROMPT = "あなたはISO/IEC/IEEE 29119標準に基づいたテスト文書を生成する専門家です。テスト計画、テスト仕様書、テスト結果報告書などの文書を作成するための豊富な知識と経験を持っています。"
 
+# 生成に失敗したセクションの内容の接頭辞
+ERROR_MESSAGE_PREFIX = "エラーが発生しました"
 
-def generate_test_document(product_description, section_templates):
+# APIに送信するパラメータ
+COMPLETION_PARAMS = {
+    'model': 'gpt-4',
+    'max_tokens': 1500,
+    'temperature': 0.5,
+}
+
+# セクションの指示が空の場合に使用する指示
+DEFAULT_SECTION_INSTRUCTION = '以下のセクションの内容を生成してください。'
+
+# すべてのセクションに共通する品質の指示
+QUALITY_GUIDELINES = """以下の点に注意して、ISO/IEC/IEEE 29119標準に準拠した高品質なテスト文書を生成してください：
+1. 具体的かつ明確な内容を記述してください
+2. テスト対象の製品特性を考慮してください
+3. 実用的で実施可能な内容にしてください
+4. 論理的な構成と適切な専門用語を使用してください
+5. 必要に応じて箇条書きや表形式を使用して読みやすくしてください"""
+
+# 複数セクションをまとめて生成する場合の、フォームタイプごとの出力トークン数の目安
+SECTION_OUTPUT_TOKENS = {
+    'text': 200,
+    'textarea': 600,
+    'list': 500,
+    'markdown': 1200,
+    'table': 1200,
+}
+
+# 複数セクションをまとめて生成する場合の、フォームタイプごとの出力形式の指示
+FORM_TYPE_INSTRUCTIONS = {
+    'text': '1〜2文の短いテキスト',
+    'textarea': '複数段落のテキスト',
+    'list': '1行1項目の箇条書き',
+    'markdown': 'マークダウン形式の文章',
+    'table': 'マークダウン形式の表',
+}
+
+
+def build_template_prompt(template):
+    """
+    セクション生成用のプロンプトのうち、テンプレートから作成する部分を作成する
+
+    製品説明に依存しないため、複数のドキュメントを生成する場合は1回だけ作成して共有できる。
+
+    Args:
+        template (SectionTemplate): セクションテンプレート
+
+    Returns:
+        str: プロンプトのテンプレート部分
+    """
+    return f"""セクション: {template.title}
+説明: {template.description}
+ガイドライン: {template.content_guidelines}
+
+{template.ai_prompt if template.ai_prompt else DEFAULT_SECTION_INSTRUCTION}
+
+{QUALITY_GUIDELINES}
+        """
+
+
+def template_query(template):
+    """
+    製品説明から関連する部分を検索するためのクエリをテンプレートから作成する
+    """
+    return '\n'.join([template.title, template.description, template.content_guidelines, template.ai_prompt])
+
+
+def product_text(product_description, template, product_digest=None, excerpts=None):
+    """
+    セクションのプロンプトに埋め込む製品説明を取得する
+
+    要約が指定され、テンプレートが要約の使用を無効にしていない場合は要約を返す。
+    settings.PRODUCT_RETRIEVAL_ENABLED が有効で、製品説明が settings.PRODUCT_RETRIEVAL_MIN_LENGTH
+    文字以上の場合は、テンプレートに関連するチャンクのみを返す。それ以外の場合は全文を返す。
+    excerpts にテンプレートの抜粋（長い仕様書から選んだチャンクなど）がある場合は後に追加する。
+    """
+    if product_digest and getattr(template, 'use_product_digest', True):
+        text = product_digest
+    elif (getattr(settings, 'PRODUCT_RETRIEVAL_ENABLED', False)
+            and len(product_description) >= getattr(settings, 'PRODUCT_RETRIEVAL_MIN_LENGTH', 3000)):
+        text = select_relevant_text(
+            product_description,
+            template_query(template),
+            getattr(settings, 'PRODUCT_RETRIEVAL_TOP_K', 4),
+            getattr(settings, 'PRODUCT_RETRIEVAL_CHUNK_SIZE', 500),
+        )
+    else:
+        text = product_description
+    excerpt = (excerpts or {}).get(template.id)
+    if excerpt:
+        text = '\n\n'.join(part for part in (text.strip(), excerpt.strip()) if part)
+    return text
+
+
+def build_section_prompt(product_description, template, template_prompt=None, product_digest=None, excerpts=None):
+    """
+    セクション生成用のプロンプトを作成する
+
+    Args:
+        product_description (str): 製品説明
+        template (SectionTemplate): セクションテンプレート
+        template_prompt (str): build_template_prompt() で作成済みのテンプレート部分（省略時は作成する）
+        product_digest (str): 製品説明の要約（指定した場合は product_text() で製品説明の代わりに使用する）
+        excerpts (dict): テンプレートのIDをキーとする仕様書の抜粋（product_text() で製品説明の後に追加する）
+
+    Returns:
+        str: プロンプト
+    """
+    if template_prompt is None:
+        template_prompt = build_template_prompt(template)
+    return f"""
+製品説明:
+{product_text(product_description, template, product_digest, excerpts)}
+
+{template_prompt}"""
+
+
+def build_messages(prompt):
+    """
+    APIに送信するメッセージを作成する
+    """
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def completion_params(max_tokens=None):
+    """
+    APIに送信するパラメータを作成する（max_tokens を指定した場合は上書きする）
+    """
+    if max_tokens is None:
+        return COMPLETION_PARAMS
+    return {**COMPLETION_PARAMS, 'max_tokens': max_tokens}
+
+
+def completion_cache_key(prompt, max_tokens=None):
+    """
+    プロンプトとパラメータからレスポンスキャッシュのキーを作成する
+    """
+    return make_cache_key(messages=build_messages(prompt), **completion_params(max_tokens))
+
+
+def section_fingerprint(product_description, template, template_prompt=None, product_digest=None, excerpts=None):
+    """
+    セクションの生成に使用する入力のフィンガープリントを作成する
+
+    製品説明（または要約）、テンプレートのフィールド、モデルパラメータのいずれかが変わると値が変わる。
+
+    Args:
+        product_description (str): 製品説明
+        template (SectionTemplate): セクションテンプレート
+        template_prompt (str): build_template_prompt() で作成済みのテンプレート部分
+        product_digest (str): 製品説明の要約
+        excerpts (dict): テンプレートのIDをキーとする仕様書の抜粋
+
+    Returns:
+        str: フィンガープリント
+    """
+    return completion_cache_key(
+        build_section_prompt(product_description, template, template_prompt, product_digest, excerpts)
+    )
+
+
+def is_error_content(content):
+    """
+    生成結果がエラーメッセージかどうかを判定する
+    """
+    return content.startswith(ERROR_MESSAGE_PREFIX)
+
+
+def request_completion(prompt, max_tokens=None):
+    """
+    settings.LLM_BACKEND のバックエンドを呼び出してセクションの内容を取得する
+
+    Args:
+        prompt (str): プロンプト
+        max_tokens (int): 最大出力トークン数（省略時は COMPLETION_PARAMS の値）
+
+    Returns:
+        tuple: (生成された内容, 使用トークン数)
+    """
+    return get_llm_backend().complete(build_messages(prompt), **completion_params(max_tokens))
+
+
+def request_completion_stream(prompt, on_delta):
+    """
+    settings.LLM_BACKEND のバックエンドをストリーミングモードで呼び出してセクションの内容を取得する
+
+    Args:
+        prompt (str): プロンプト
+        on_delta (function): 内容を受信するたびに呼ばれるコールバック関数
+            引数: delta (str) 新たに受信した内容
+
+    Returns:
+        tuple: (生成された内容, 使用トークン数)
+    """
+    return get_llm_backend().stream(build_messages(prompt), on_delta, **COMPLETION_PARAMS)
+
+
+def estimate_tokens(prompt, max_tokens=None):
+    """
+    プロンプトと最大出力トークン数から使用トークン数を概算する（レート制限用）
+
+    日本語では1文字がおよそ1トークンになるため、文字数をそのまま使用する。
+    """
+    return len(SYSTEM_PROMPT) + len(prompt) + completion_params(max_tokens)['max_tokens']
+
+
+def call_llm(prompt, on_delta=None, max_tokens=None, on_reset=None):
+    """
+    レート制限と適応的な同時実行数の制御を行ってAPIを呼び出す
+
+    全ワーカーで共有するトークンバケット（リクエスト数・トークン数）に空きができるまで待機し、
+    429やタイムアウトが発生した場合は同時実行数を下げて、指数バックオフで再試行する。
+
+    Args:
+        prompt (str): プロンプト
+        on_delta (function): 指定した場合はストリーミングモードで呼び出す（引数: 新たに受信した内容）
+        max_tokens (int): 最大出力トークン数（省略時は COMPLETION_PARAMS の値。ストリーミング時は無視する）
+        on_reset (function): ストリーミングモードで再試行する前に呼ばれる（受信済みの内容を破棄させる）
+
+    Returns:
+        tuple: (生成された内容, 使用トークン数)
+    """
+    rate_limiter = get_rate_limiter()
+    # 429・タイムアウトなど、待機して再試行すべきエラーはバックエンドごとに異なる
+    retryable_errors = get_llm_backend().retryable_errors
+    concurrency_limiter = get_concurrency_limiter()
+    max_retries = getattr(settings, 'LLM_MAX_RETRIES', 3)
+    tokens = estimate_tokens(prompt, max_tokens)
+
+    received = False
+
+    def forward_delta(delta):
+        nonlocal received
+        received = True
+        on_delta(delta)
+
+    for attempt in range(max_retries + 1):
+        acquire(rate_limiter, tokens)
+        received = False
+        try:
+            with concurrency_limiter:
+                if on_delta is not None:
+                    result = request_completion_stream(prompt, forward_delta)
+                else:
+                    result = request_completion(prompt, max_tokens)
+        except retryable_errors:
+            concurrency_limiter.on_overload()
+            if attempt == max_retries:
+                raise
+            # 再試行では最初から受信し直すため、途中まで受信した内容を破棄させる
+            if received and on_reset is not None:
+                on_reset()
+            time.sleep(min(2 ** attempt, 30))
+            continue
+        concurrency_limiter.on_success()
+        return result
+
+
+def _cached_completion(cache, prompt, max_tokens=None):
+    """
+    キャッシュからレスポンスを取得する（キャッシュが無効な場合は None）
+    """
+    if cache is None:
+        return None
+    return cache.get(completion_cache_key(prompt, max_tokens))
+
+
+def _store_completion(cache, prompt, content, tokens_used, max_tokens=None):
+    """
+    レスポンスをキャッシュに保存する
+    """
+    if cache is not None:
+        cache.set(completion_cache_key(prompt, max_tokens), (content, tokens_used))
+
+
+def generate_test_document(product_description, section_templates, use_cache=True):
     """
     OpenAI APIを使用してテスト文書を生成する
-    
+
     Args:
         product_description (str): 製品説明
         section_templates (list): セクションテンプレートのリスト
-        
+        use_cache (bool): Falseの場合はレスポンスキャッシュを使用しない
+
     Returns:
         dict: 生成されたセクションの内容
     """
-    sections_content = {}
-    
-    for template in section_templates:
-        # プロンプトを作成
-        prompt = f"""
+    return generate_test_document_with_progress(product_description, section_templates, use_cache=use_cache)
+
+
+def generate_section(product_description, template, use_cache=True, product_digest=None, excerpts=None):
+    """
+    OpenAI APIを使用して1つのセクションを生成する
+
+    Args:
+        product_description (str): 製品説明
+        template (SectionTemplate): セクションテンプレート
+        use_cache (bool): Falseの場合はレスポンスキャッシュを使用しない
+        product_digest (str): 製品説明の要約
+        excerpts (dict): テンプレートのIDをキーとする仕様書の抜粋
+
+    Returns:
+        str: 生成されたセクションの内容（エラー時はエラーメッセージ）
+    """
+    prompt = build_section_prompt(product_description, template, product_digest=product_digest, excerpts=excerpts)
+    return _complete(prompt, use_cache)
+
+
+def build_digest_prompt(product_description):
+    """
+    製品説明の要約を作成するためのプロンプトを作成する
+    """
+    return f"""
+以下の製品説明を、テスト文書の作成に必要な情報を落とさずに簡潔に要約してください。
+製品の目的、主な機能、対象ユーザー、動作環境、インターフェース、非機能要件、制約を箇条書きで整理し、
+数値・名称・バージョンなどの具体的な値はそのまま残してください。要約のみを出力してください。
+
 製品説明:
-{product_description}
+{product_description}"""
 
-セクション: {template.title}
-説明: {template.description}
-ガイドライン: {template.content_guidelines}
 
-{template.ai_prompt if template.ai_prompt else '以下のセクションの内容を生成してください。'}
+def generate_product_digest(product_description, use_cache=True):
+    """
+    OpenAI APIを使用して製品説明の要約を作成する
 
-以下の点に注意して、ISO/IEC/IEEE 29119標準に準拠した高品質なテスト文書を生成してください：
-1. 具体的かつ明確な内容を記述してください
-2. テスト対象の製品特性を考慮してください
-3. 実用的で実施可能な内容にしてください
-4. 論理的な構成と適切な専門用語を使用してください
-5. 必要に応じて箇条書きや表形式を使用して読みやすくしてください
-        """
-        
-        try:
-            # OpenAI APIを呼び出し
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "あなたはISO/IEC/IEEE 29119標準に基づいたテスト文書を生成する専門家です。テスト計画、テスト仕様書、テスト結果報告書などの文書を作成するための豊富な知識と経験を持っています。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.5,
-            )
-            
-            # レスポンスからコンテンツを取得
-            content = response.choices[0].message.content
-            
-            # トークン使用量を計算
-            tokens_used = response.usage.total_tokens
-            
-            # OpenAIRequestモデルに保存
-            OpenAIRequest.objects.create(
-                prompt=prompt,
-                response=content,
-                tokens_used=tokens_used
-            )
-            
-            # 結果を辞書に追加
-            sections_content[template.id] = content
-            
-        except Exception as e:
-            # エラーが発生した場合はエラーメッセージを返す
-            sections_content[template.id] = f"エラーが発生しました: {str(e)}"
-    
-    return sections_content
-
-
-def generate_test_document_with_progress(product_description, section_templates, progress_callback=None):
+    要約はセクションのプロンプトで製品説明の代わりに使用し、同じ長い製品説明を
+    セクションごとに送信しないようにする。
+
+    Args:
+        product_description (str): 製品説明
+        use_cache (bool): Falseの場合はレスポンスキャッシュを使用しない
+
+    Returns:
+        str: 要約（エラー時はエラーメッセージ）
+    """
+    max_tokens = getattr(settings, 'PRODUCT_DIGEST_MAX_TOKENS', 800)
+    return _complete(build_digest_prompt(product_description), use_cache, max_tokens)
+
+
+def _complete(prompt, use_cache=True, max_tokens=None):
+    """
+    キャッシュを確認してからAPIを呼び出し、結果をキャッシュと OpenAIRequest に保存する
+
+    Returns:
+        str: 生成された内容（エラー時はエラーメッセージ）
+    """
+    cache = get_llm_cache() if use_cache else None
+
+    cached = _cached_completion(cache, prompt, max_tokens)
+    if cached is not None:
+        return cached[0]
+
+    try:
+        content, tokens_used = call_llm(prompt, max_tokens=max_tokens)
+        _store_completion(cache, prompt, content, tokens_used, max_tokens)
+
+        # OpenAIRequestモデルに保存（まとめて保存するため、ここではバッファに追加する）
+        get_request_log().record(prompt, content, tokens_used)
+        return content
+    except Exception as e:
+        return f"{ERROR_MESSAGE_PREFIX}: {str(e)}"
+
+
+def _run_section(index, prompt, events, stream=False, max_tokens=None):
+    """
+    ワーカースレッドでAPIを呼び出し、結果をイベントキューに送る
+
+    データベースへのアクセスや進捗コールバックは呼び出し元のスレッドで行うため、
+    ここではAPI呼び出しのみを実行する。
+    """
+    events.put((index, 10, None))
+    try:
+        if stream:
+            result = call_llm(prompt, on_delta=lambda delta: events.put((index, 'delta', delta)),
+                              on_reset=lambda: events.put((index, 'delta', None)))
+        else:
+            result = call_llm(prompt, max_tokens=max_tokens)
+    except Exception as e:
+        events.put((index, None, e))
+        return
+    events.put((index, 50, result))
+
+
+def generate_test_document_with_progress(product_description, section_templates, progress_callback=None,
+                                         max_concurrency=None, use_cache=True, partial_callback=None,
+                                         product_digest=None, excerpts=None):
     """
     OpenAI APIを使用してテスト文書を生成し、進捗状況を更新する
-    
+
+    セクションごとのリクエストはスレッドプールで並列に送信される。
+    同時実行数は max_concurrency（省略時は settings.OPENAI_MAX_CONCURRENCY）で制限する。
+    プロンプトとパラメータが同一のリクエストは settings.LLM_CACHE のキャッシュから返す。
+
     Args:
         product_description (str): 製品説明
         section_templates (list): セクションテンプレートのリスト
         progress_callback (function): 進捗状況を更新するコールバック関数
             引数: section_index (int), section_progress (int)
-        
+            呼び出し元のスレッドから呼ばれる。セクションは並列に進むため、
+            section_index は単調増加しない。
+        max_concurrency (int): 同時に送信するリクエストの最大数
+        use_cache (bool): Falseの場合はレスポンスキャッシュを使用しない
+        partial_callback (function): 指定した場合はストリーミングモードでAPIを呼び出し、
+            内容を受信するたびに呼び出し元のスレッドから呼ばれる
+            引数: section_index (int), delta (str) 新たに受信した内容
+            （再試行により受信済みの内容を破棄する場合は None）
+        product_digest (str): 製品説明の要約（要約の使用を無効にしたテンプレート以外で使用する）
+        excerpts (dict): テンプレートのIDをキーとする仕様書の抜粋
+
     Returns:
-        dict: 生成されたセクションの内容
+        dict: 生成されたセクションの内容（テンプレートの order 順）
+    """
+    templates = sorted(section_templates, key=lambda t: t.order)
+    prompts = [
+        build_section_prompt(product_description, template, product_digest=product_digest, excerpts=excerpts)
+        for template in templates
+    ]
+    contents = generate_completions(prompts, progress_callback, max_concurrency, use_cache, partial_callback)
+    return {template.id: content for template, content in zip(templates, contents)}
+
+
+def generate_completions(prompts, progress_callback=None, max_concurrency=None, use_cache=True,
+                         partial_callback=None, result_callback=None, max_tokens=None):
+    """
+    複数のプロンプトに対するAPIリクエストをスレッドプールで並列に送信する
+
+    generate_test_document_with_progress() と複数ドキュメントの一括生成で共有する。
+    キャッシュ・OpenAIRequest への保存・コールバックはすべて呼び出し元のスレッドで行う。
+
+    Args:
+        prompts (list): プロンプトのリスト
+        progress_callback (function): 進捗状況を更新するコールバック関数
+            引数: index (int) プロンプトのインデックス, progress (int)
+        max_concurrency (int): 同時に送信するリクエストの最大数
+        use_cache (bool): Falseの場合はレスポンスキャッシュを使用しない
+        partial_callback (function): 指定した場合はストリーミングモードでAPIを呼び出す
+            引数: index (int), delta (str) 新たに受信した内容（再試行により受信済みの内容を破棄する場合は None）
+        result_callback (function): 各プロンプトの内容が確定するたびに呼び出し元のスレッドから呼ばれる
+            引数: index (int), content (str) 生成された内容（エラー時はエラーメッセージ）
+        max_tokens (list): プロンプトごとの最大出力トークン数（prompts と同じ順序。None の要素と
+            省略時は COMPLETION_PARAMS の値）
+
+    Returns:
+        list: 生成された内容（prompts と同じ順序。エラー時はエラーメッセージ）
     """
-    sections_content = {}
-    
-    for i, template in enumerate(section_templates):
-        # 進捗状況を更新（セクション開始時）
+    if not prompts:
+        return []
+
+    if max_concurrency is None:
+        max_concurrency = getattr(settings, 'OPENAI_MAX_CONCURRENCY', 4)
+    max_workers = max(1, min(max_concurrency, len(prompts)))
+
+    def notify(index, progress):
         if progress_callback:
-            progress_callback(i, 0)
-        
-        # プロンプトを作成
-        prompt = f"""
-製品説明:
-{product_description}
+            progress_callback(index, progress)
+
+    if max_tokens is None:
+        max_tokens = [None] * len(prompts)
+    results = [None] * len(prompts)
+
+    def finish(index, content):
+        results[index] = content
+        if result_callback:
+            result_callback(index, content)
+        # 進捗状況を更新（セクション完了時）
+        notify(index, 100)
+
+    cache = get_llm_cache() if use_cache else None
+    events = queue.Queue()
 
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='section-generation') as executor:
+        remaining = 0
+        for i, prompt in enumerate(prompts):
+            # 進捗状況を更新（セクション開始時）
+            notify(i, 0)
+
+            # キャッシュにある場合はAPIを呼び出さない
+            cached = _cached_completion(cache, prompt, max_tokens[i])
+            if cached is not None:
+                finish(i, cached[0])
+                continue
+
+            executor.submit(_run_section, i, prompt, events, partial_callback is not None, max_tokens[i])
+            remaining += 1
+
+        while remaining:
+            index, progress, payload = events.get()
+
+            if progress == 10:
+                # 進捗状況を更新（APIリクエスト開始時）
+                notify(index, 10)
+                continue
+
+            if progress == 'delta':
+                # 受信途中の内容（再試行時は None）を通知
+                partial_callback(index, payload)
+                continue
+
+            remaining -= 1
+
+            if progress is None:
+                # エラーが発生した場合はエラーメッセージを返す（他のセクションには影響しない）
+                finish(index, f"{ERROR_MESSAGE_PREFIX}: {str(payload)}")
+                continue
+
+            # 進捗状況を更新（APIレスポンス受信時）
+            notify(index, 50)
+            content, tokens_used = payload
+
+            try:
+                _store_completion(cache, prompts[index], content, tokens_used, max_tokens[index])
+
+                # 進捗状況を更新（データベース保存前）
+                notify(index, 75)
+
+                # OpenAIRequestモデルに保存（まとめて保存するため、ここではバッファに追加する）
+                get_request_log().record(prompts[index], content, tokens_used)
+            except Exception as e:
+                content = f"{ERROR_MESSAGE_PREFIX}: {str(e)}"
+
+            finish(index, content)
+
+    return results
+
+
+def section_output_tokens(template):
+    """
+    複数セクションをまとめて生成する場合の、セクションの出力トークン数の目安を取得する
+    """
+    return SECTION_OUTPUT_TOKENS.get(getattr(template, 'form_type', 'textarea'), COMPLETION_PARAMS['max_tokens'])
+
+
+def build_multi_section_prompt(product_description, section_templates):
+    """
+    複数のセクションを1回のリクエストで生成するためのプロンプトを作成する
+
+    製品説明と品質の指示は1回だけ含め、各セクションの内容を SectionTemplate.id を
+    キーとしたJSONオブジェクトで出力させる。
+
+    Args:
+        product_description (str): 製品説明
+        section_templates (list): セクションテンプレートのリスト
+
+    Returns:
+        str: プロンプト
+    """
+    sections = []
+    for template in section_templates:
+        form_type = getattr(template, 'form_type', 'textarea')
+        sections.append(f"""### ID: {template.id}
 セクション: {template.title}
 説明: {template.description}
 ガイドライン: {template.content_guidelines}
+指示: {template.ai_prompt if template.ai_prompt else DEFAULT_SECTION_INSTRUCTION}
+形式: {FORM_TYPE_INSTRUCTIONS.get(form_type, FORM_TYPE_INSTRUCTIONS['textarea'])}""")
 
-{template.ai_prompt if template.ai_prompt else '以下のセクションの内容を生成してください。'}
+    example = json.dumps({'sections': {str(template.id): '...' for template in section_templates[:2]}},
+                         ensure_ascii=False)
+    section_list = '\n\n'.join(sections)
+    return f"""
+製品説明:
+{product_description}
 
-以下の点に注意して、ISO/IEC/IEEE 29119標準に準拠した高品質なテスト文書を生成してください：
-1. 具体的かつ明確な内容を記述してください
-2. テスト対象の製品特性を考慮してください
-3. 実用的で実施可能な内容にしてください
-4. 論理的な構成と適切な専門用語を使用してください
-5. 必要に応じて箇条書きや表形式を使用して読みやすくしてください
-        """
-        
-        try:
-            # 進捗状況を更新（APIリクエスト開始時）
-            if progress_callback:
-                progress_callback(i, 10)
-            
-            # OpenAI APIを呼び出し
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "あなたはISO/IEC/IEEE 29119標準に基づいたテスト文書を生成する専門家です。テスト計画、テスト仕様書、テスト結果報告書などの文書を作成するための豊富な知識と経験を持っています。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1500,
-                temperature=0.5,
-            )
-            
-            # 進捗状況を更新（APIレスポンス受信時）
-            if progress_callback:
-                progress_callback(i, 50)
-            
-            # レスポンスからコンテンツを取得
-            content = response.choices[0].message.content
-            
-            # トークン使用量を計算
-            tokens_used = response.usage.total_tokens
-            
-            # 進捗状況を更新（データベース保存前）
-            if progress_callback:
-                progress_callback(i, 75)
-            
-            # OpenAIRequestモデルに保存
-            OpenAIRequest.objects.create(
-                prompt=prompt,
-                response=content,
-                tokens_used=tokens_used
-            )
-            
-            # 結果を辞書に追加
-            sections_content[template.id] = content
-            
-            # 進捗状況を更新（セクション完了時）
-            if progress_callback:
-                progress_callback(i, 100)
-                
-            # 少し待機して、進捗状況の変化を視覚的に確認できるようにする
-            time.sleep(0.5)
-            
-        except Exception as e:
-            # エラーが発生した場合はエラーメッセージを返す
-            sections_content[template.id] = f"エラーが発生しました: {str(e)}"
-    
-    return sections_content 
\ No newline at end of file
+以下の各セクションの内容をまとめて生成してください。
+
+{section_list}
+
+{QUALITY_GUIDELINES}
+
+出力は次の形式のJSONオブジェクトのみとし、前後に説明文を付けないでください。
+"sections" のキーはセクションのID（文字列）、値はそのセクションの内容（文字列）です。
+すべてのIDの内容を含めてください。
+{example}"""
+
+
+def chunk_section_templates(product_description, section_templates):
+    """
+    セクションテンプレートを1回のリクエストで生成するグループに分割する
+
+    各グループは、出力トークン数の目安の合計が settings.GENERATION_COMBINED_MAX_OUTPUT_TOKENS 以下、
+    プロンプトを含めた合計が settings.LLM_CONTEXT_WINDOW 以下、セクション数が
+    settings.GENERATION_COMBINED_MAX_SECTIONS 以下になるように順番にまとめる。
+    1つで上限を超えるセクションは単独のグループにする。
+
+    Args:
+        product_description (str): 製品説明
+        section_templates (list): セクションテンプレートのリスト（生成順）
+
+    Returns:
+        list: セクションテンプレートのリストのリスト
+    """
+    context_window = getattr(settings, 'LLM_CONTEXT_WINDOW', 8192)
+    max_output_tokens = getattr(settings, 'GENERATION_COMBINED_MAX_OUTPUT_TOKENS', 4000)
+    max_sections = getattr(settings, 'GENERATION_COMBINED_MAX_SECTIONS', 10)
+
+    chunks = []
+    chunk = []
+    for template in section_templates:
+        candidate = chunk + [template]
+        output_tokens = sum(section_output_tokens(t) for t in candidate)
+        # 日本語では1文字がおよそ1トークンになるため、文字数で概算する
+        input_tokens = len(SYSTEM_PROMPT) + len(build_multi_section_prompt(product_description, candidate))
+        fits = (len(candidate) <= max_sections and output_tokens <= max_output_tokens
+                and input_tokens + output_tokens <= context_window)
+        if chunk and not fits:
+            chunks.append(chunk)
+            chunk = [template]
+        else:
+            chunk = candidate
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+_CODE_FENCE = re.compile(r'^```[a-zA-Z]*\s*|\s*```$')
+
+
+def parse_multi_section_response(content, section_templates):
+    """
+    複数セクションをまとめて生成したレスポンスを解析する
+
+    コードブロックで囲まれている場合は取り除く。JSONとして解析できない場合や、
+    内容が空・文字列以外のセクションは結果に含めない。
+
+    Args:
+        content (str): レスポンスの内容
+        section_templates (list): リクエストしたセクションテンプレートのリスト
+
+    Returns:
+        dict: {テンプレートID: 生成された内容}（解析できたセクションのみ）
+    """
+    try:
+        data = json.loads(_CODE_FENCE.sub('', content.strip()))
+    except ValueError:
+        return {}
+    sections = data.get('sections') if isinstance(data, dict) else None
+    if not isinstance(sections, dict):
+        return {}
+
+    parsed = {}
+    for template in section_templates:
+        value = sections.get(str(template.id))
+        if isinstance(value, str) and value.strip():
+            parsed[template.id] = value.strip()
+    return parsed
+
+
+def generate_test_document_combined(product_description, section_templates, progress_callback=None,
+                                    max_concurrency=None, use_cache=True, product_digest=None, excerpts=None):
+    """
+    複数のセクションを1回のリクエストでまとめて生成する
+
+    セクションは chunk_section_templates() で分割したグループごとにリクエストし、
+    製品説明とシステムプロンプトの重複を減らす。グループのリクエストが失敗した場合や
+    解析できなかったセクションは、セクションごとのリクエストで生成し直す。
+
+    Args:
+        product_description (str): 製品説明
+        section_templates (list): セクションテンプレートのリスト
+        progress_callback (function): 進捗状況を更新するコールバック関数
+            引数: section_index (int), section_progress (int)
+        max_concurrency (int): 同時に送信するリクエストの最大数
+        use_cache (bool): Falseの場合はレスポンスキャッシュを使用しない
+        product_digest (str): 製品説明の要約（要約の使用を無効にしたテンプレート以外で使用する）
+        excerpts (dict): テンプレートのIDをキーとする仕様書の抜粋
+
+    Returns:
+        dict: 生成されたセクションの内容（テンプレートの order 順）
+    """
+    templates = sorted(section_templates, key=lambda t: t.order)
+    indexes = {template.id: i for i, template in enumerate(templates)}
+
+    # 要約を使用するセクションと製品説明の全文を使用するセクションは別のグループにする
+    chunks = []
+    texts = []
+    for text in dict.fromkeys(product_text(product_description, t, product_digest, excerpts) for t in templates):
+        group = [t for t in templates if product_text(product_description, t, product_digest, excerpts) == text]
+        for chunk in chunk_section_templates(text, group):
+            chunks.append(chunk)
+            texts.append(text)
+
+    def notify(template, progress):
+        if progress_callback:
+            progress_callback(indexes[template.id], progress)
+
+    prompts = []
+    max_tokens = []
+    for chunk, text in zip(chunks, texts):
+        if len(chunk) == 1:
+            # 1セクションのみのグループは通常のプロンプトで生成する
+            prompts.append(build_section_prompt(product_description, chunk[0], product_digest=product_digest,
+                                                excerpts=excerpts))
+            max_tokens.append(None)
+        else:
+            prompts.append(build_multi_section_prompt(text, chunk))
+            max_tokens.append(min(sum(section_output_tokens(t) for t in chunk),
+                                  getattr(settings, 'GENERATION_COMBINED_MAX_OUTPUT_TOKENS', 4000)))
+
+    contents = {}
+
+    def collect(index, content):
+        chunk = chunks[index]
+        if len(chunk) == 1:
+            contents[chunk[0].id] = content
+        elif not is_error_content(content):
+            contents.update(parse_multi_section_response(content, chunk))
+
+    def update_chunk_progress(index, progress):
+        for template in chunks[index]:
+            # 解析できなかったセクションは生成し直すまで完了にしない
+            if progress < 100 or template.id in contents:
+                notify(template, progress)
+            else:
+                notify(template, 50)
+
+    generate_completions(prompts, update_chunk_progress, max_concurrency, use_cache,
+                         result_callback=collect, max_tokens=max_tokens)
+
+    # まとめて生成できなかったセクションはセクションごとに生成する
+    retry = [template for template in templates if template.id not in contents]
+    if retry:
+        retry_contents = generate_completions(
+            [build_section_prompt(product_description, template, product_digest=product_digest, excerpts=excerpts)
+             for template in retry],
+            lambda index, progress: notify(retry[index], max(progress, 50)),
+            max_concurrency, use_cache,
+        )
+        contents.update({template.id: content for template, content in zip(retry, retry_contents)})
+
+    return {template.id: contents[template.id] for template in templates}
+
+
+def build_batch_request(custom_id, prompt):
+    """
+    バッチAPIに送信する1件分のリクエストを作成する（JSONLの1行）
+
+    Args:
+        custom_id (str): 結果と対応付けるためのID
+        prompt (str): プロンプト
+
+    Returns:
+        dict: リクエスト
+    """
+    return {
+        'custom_id': custom_id,
+        'method': 'POST',
+        'url': '/v1/chat/completions',
+        'body': {'messages': build_messages(prompt), **COMPLETION_PARAMS},
+    }
+
+
+def ingest_batch_results(prompts, results, use_cache=True):
+    """
+    バッチAPIの結果をレスポンスキャッシュに保存する
+
+    OpenAIRequest の記録は保存せずに返すため、呼び出し元がトランザクションの外で
+    get_request_log() に記録する。
+
+    Args:
+        prompts (dict): {custom_id: プロンプト}
+        results (iterable): バックエンドの get_batch_results() の戻り値
+        use_cache (bool): Falseの場合はレスポンスキャッシュに保存しない
+
+    Returns:
+        tuple: ({custom_id: 生成された内容}（失敗・結果がないリクエストはエラーメッセージ）,
+                (prompt, response, tokens_used) のリスト)
+    """
+    cache = get_llm_cache() if use_cache else None
+    contents = {}
+    records = []
+    for result in results:
+        prompt = prompts.get(result['custom_id'])
+        if prompt is None:
+            continue
+        if result['error']:
+            contents[result['custom_id']] = f"{ERROR_MESSAGE_PREFIX}: {result['error']}"
+            continue
+        contents[result['custom_id']] = result['content']
+        _store_completion(cache, prompt, result['content'], result['tokens_used'])
+        records.append((prompt, result['content'], result['tokens_used']))
+
+    for custom_id in prompts.keys() - contents.keys():
+        contents[custom_id] = f"{ERROR_MESSAGE_PREFIX}: バッチジョブの結果に含まれていません"
+    return contents, records
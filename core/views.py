@@ -3,6 +3,7 @@ from django.contrib.auth.decorators import login_required
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from documents.models import Project
+from documents.pagination import keyset_paginate
 
 
 class HomeView(TemplateView):
@@ -20,5 +21,6 @@ class DashboardView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['projects'] = Project.objects.filter(owner=self.request.user)
+        # 最近更新したプロジェクトのみ取得する（件数は数えない）
+        context['projects'] = keyset_paginate(Project.objects.filter(owner=self.request.user), per_page=5)
         return context
@@ -0,0 +1,76 @@
+import hashlib
+
+from django.conf import settings
+
+from core.utils import generate_product_digest, is_error_content
+
+
+def product_description_hash(product_description):
+    """
+    製品説明のハッシュを作成する（要約が現在の製品説明から作成されたものかの判定に使用する）
+    """
+    return hashlib.sha256(product_description.encode('utf-8')).hexdigest()
+
+
+def digest_applies(document):
+    """
+    ドキュメントの生成で製品説明の要約を使用するかどうかを判定する
+
+    settings.PRODUCT_DIGEST_ENABLED が有効で、製品説明が settings.PRODUCT_DIGEST_MIN_LENGTH
+    文字以上の場合のみ要約する。短い製品説明は要約しても削減できるトークン数が少ない。
+    """
+    if not getattr(settings, 'PRODUCT_DIGEST_ENABLED', False):
+        return False
+    return len(document.product_description) >= getattr(settings, 'PRODUCT_DIGEST_MIN_LENGTH', 2000)
+
+
+def get_product_digest(document):
+    """
+    保存済みの製品説明の要約を取得する
+
+    要約の作成後に製品説明が変更された場合や、要約を使用しない場合は None を返す。
+
+    Args:
+        document (Document): product_description, product_digest, product_digest_hash を読み込んだドキュメント
+
+    Returns:
+        str: 要約
+    """
+    if not digest_applies(document) or not document.product_digest:
+        return None
+    if document.product_digest_hash != product_description_hash(document.product_description):
+        return None
+    return document.product_digest
+
+
+def ensure_product_digest(document, use_cache=True):
+    """
+    製品説明の要約を取得し、現在の製品説明の要約がなければ作成して保存する
+
+    要約は製品説明のハッシュと合わせて保存するため、製品説明が変わるまでは再作成しない。
+    要約の作成に失敗した場合は None を返し、製品説明の全文で生成する。
+
+    Args:
+        document (Document): ドキュメント
+        use_cache (bool): Falseの場合はレスポンスキャッシュを使用しない
+
+    Returns:
+        str: 要約
+    """
+    if not digest_applies(document):
+        return None
+    digest = get_product_digest(document)
+    if digest is not None:
+        return digest
+
+    digest = generate_product_digest(document.product_description, use_cache=use_cache)
+    if is_error_content(digest):
+        return None
+
+    document.product_digest = digest
+    document.product_digest_hash = product_description_hash(document.product_description)
+    # 要約の保存ではドキュメントの更新日時を変更しない
+    type(document).objects.filter(pk=document.pk).update(
+        product_digest=document.product_digest, product_digest_hash=document.product_digest_hash,
+    )
+    return digest
@@ -0,0 +1,330 @@
+import re
+import zipfile
+from xml.sax.saxutils import escape as xml_escape
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import escape
+
+from .models import DocumentSection
+from .rendering import render_section
+
+# エクスポート形式ごとの Content-Type と拡張子
+EXPORT_FORMATS = {
+    'md': {'label': 'Markdown', 'content_type': 'text/markdown; charset=utf-8', 'extension': 'md'},
+    'html': {'label': 'HTML', 'content_type': 'text/html; charset=utf-8', 'extension': 'html'},
+    'docx': {
+        'label': 'Word',
+        'content_type': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+        'extension': 'docx',
+    },
+}
+
+# サーバーサイドカーソルで一度に取得するセクション数
+EXPORT_CHUNK_SIZE = 100
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+_BULLET = re.compile(r'^\s*(?:[-*+・]|\d+[.)])\s+(.*)$')
+_TABLE_ROW = re.compile(r'^\s*\|.*\|\s*$')
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+_INLINE_MARKUP = re.compile(r'\*\*|`')
+# XML 1.0 で使用できない制御文字
+_INVALID_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def iter_documents(documents):
+    """
+    ドキュメントと、その生成済みセクションのイテレータを順番に取得する
+
+    ドキュメントとセクションをそれぞれ1つのクエリで iterator() により取得し、順番に突き合わせる。
+    ドキュメント数・セクション数が多くてもクエリ数は増えず、一度にメモリに読み込まない。
+    セクションのイテレータは次のドキュメントに進む前に最後まで読み込む必要がある。
+
+    Args:
+        documents (QuerySet): Document のクエリセット
+
+    Yields:
+        tuple: (Document, DocumentSection のイテレータ)
+    """
+    documents = documents.order_by('created_at', 'id')
+    sections = (
+        DocumentSection.objects.filter(document__in=documents.values('pk'), is_partial=False)
+        .select_related('template')
+        .order_by('document__created_at', 'document_id', 'order', 'id')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    pending = next(sections, None)
+
+    def document_sections(document_id):
+        nonlocal pending
+        while pending is not None and pending.document_id == document_id:
+            yield pending
+            pending = next(sections, None)
+
+    for document in documents.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield document, document_sections(document.id)
+
+
+def export_markdown(documents, title=None):
+    """
+    ドキュメントをマークダウンとして出力する
+
+    Args:
+        documents (QuerySet): Document のクエリセット
+        title (str): 複数のドキュメントをまとめる場合の見出し（プロジェクト名など）
+
+    Yields:
+        str: マークダウンの断片
+    """
+    level = 1
+    if title:
+        yield f'# {title}\n\n'
+        level = 2
+    for document, sections in iter_documents(documents):
+        yield f'{"#" * level} {document.title}\n\n'
+        if document.description:
+            yield f'{document.description}\n\n'
+        for section in sections:
+            yield f'{"#" * (level + 1)} {section.title}\n\n{section.content.strip()}\n\n'
+
+
+HTML_HEADER = """<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="UTF-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; max-width: 48rem; margin: 2rem auto; padding: 0 1rem; line-height: 1.6; color: #111827; }}
+table {{ border-collapse: collapse; width: 100%; }}
+th, td {{ border: 1px solid #d1d5db; padding: 0.25rem 0.5rem; text-align: left; }}
+th {{ background: #f3f4f6; }}
+pre {{ background: #f3f4f6; padding: 0.75rem; overflow-x: auto; }}
+</style>
+</head>
+<body>
+"""
+
+
+def export_html(documents, title=None):
+    """
+    ドキュメントを単体で表示できるHTMLとして出力する
+
+    セクションの内容は画面表示と同じ変換結果（キャッシュ）を使用する。
+
+    Yields:
+        str: HTMLの断片
+    """
+    level = 2 if title else 1
+    header_sent = False
+    if title:
+        yield HTML_HEADER.format(title=escape(title))
+        yield f'<h1>{escape(title)}</h1>\n'
+        header_sent = True
+
+    for document, sections in iter_documents(documents):
+        if not header_sent:
+            # 単一のドキュメントの場合はドキュメントのタイトルをページのタイトルにする
+            yield HTML_HEADER.format(title=escape(document.title))
+            header_sent = True
+        yield f'<article>\n<h{level}>{escape(document.title)}</h{level}>\n'
+        if document.description:
+            yield f'<p>{escape(document.description)}</p>\n'
+        for section in sections:
+            yield f'<section>\n<h{level + 1}>{escape(section.title)}</h{level + 1}>\n{render_section(section)}\n</section>\n'
+        yield '</article>\n'
+
+    if not header_sent:
+        yield HTML_HEADER.format(title='')
+    yield '</body>\n</html>\n'
+
+
+DOCX_CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+DOCX_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCX_DOCUMENT_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>
+</Relationships>"""
+
+DOCX_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>
+<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/><w:rPr><w:b/><w:sz w:val="40"/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/><w:rPr><w:b/><w:sz w:val="32"/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/><w:basedOn w:val="Normal"/><w:rPr><w:b/><w:sz w:val="28"/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Heading3"><w:name w:val="heading 3"/><w:basedOn w:val="Normal"/><w:rPr><w:b/><w:sz w:val="24"/></w:rPr></w:style>
+</w:styles>"""
+
+DOCX_BODY_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+)
+DOCX_BODY_END = '<w:sectPr/></w:body></w:document>'
+
+
+def _docx_text(text):
+    text = _INVALID_XML_CHARS.sub('', _INLINE_MARKUP.sub('', text))
+    return f'<w:r><w:t xml:space="preserve">{xml_escape(text)}</w:t></w:r>'
+
+
+def _docx_paragraph(text, style=None):
+    properties = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ''
+    return f'<w:p>{properties}{_docx_text(text)}</w:p>'
+
+
+def _docx_table(lines):
+    rows = []
+    for line in lines:
+        if _TABLE_SEPARATOR.match(line):
+            continue
+        cells = [cell.strip() for cell in line.strip().strip('|').split('|')]
+        rows.append('<w:tr>' + ''.join(f'<w:tc><w:p>{_docx_text(cell)}</w:p></w:tc>' for cell in cells) + '</w:tr>')
+    borders = ''.join(
+        f'<w:{side} w:val="single" w:sz="4" w:space="0" w:color="auto"/>'
+        for side in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV')
+    )
+    return f'<w:tbl><w:tblPr><w:tblBorders>{borders}</w:tblBorders></w:tblPr>{"".join(rows)}</w:tbl>'
+
+
+def _docx_section_body(content):
+    """
+    セクションの内容（マークダウンを含むテキスト）を WordprocessingML の段落とテーブルに変換する
+    """
+    lines = content.replace('\r\n', '\n').split('\n')
+    parts = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if _TABLE_ROW.match(line):
+            table = []
+            while i < len(lines) and _TABLE_ROW.match(lines[i]):
+                table.append(lines[i])
+                i += 1
+            parts.append(_docx_table(table))
+            continue
+        i += 1
+        if not line.strip() or line.strip().startswith('```'):
+            continue
+        heading = _HEADING.match(line.strip())
+        bullet = _BULLET.match(line)
+        if heading:
+            parts.append(_docx_paragraph(heading.group(2), 'Heading3'))
+        elif bullet:
+            parts.append(_docx_paragraph(f'・{bullet.group(1)}'))
+        else:
+            parts.append(_docx_paragraph(line))
+    return ''.join(parts)
+
+
+class _ChunkBuffer:
+    """
+    zipfile の書き込み先として、書き込まれたバイト列を取り出せるようにするバッファ
+
+    tell() / seek() を持たないため、zipfile はシークせずにデータディスクリプタ付きで書き込む。
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def export_docx(documents, title=None):
+    """
+    ドキュメントをDOCX（Office Open XML）として出力する
+
+    ZIPアーカイブをシークせずに書き込み、セクションごとに圧縮済みのバイト列を返す。
+
+    Yields:
+        bytes: DOCXファイルの断片
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', DOCX_RELS)
+        archive.writestr('word/_rels/document.xml.rels', DOCX_DOCUMENT_RELS)
+        archive.writestr('word/styles.xml', DOCX_STYLES)
+
+        with archive.open('word/document.xml', 'w', force_zip64=True) as body:
+            body.write(DOCX_BODY_START.encode('utf-8'))
+            if title:
+                body.write(_docx_paragraph(title, 'Title').encode('utf-8'))
+            for document, sections in iter_documents(documents):
+                body.write(_docx_paragraph(document.title, 'Heading1' if title else 'Title').encode('utf-8'))
+                if document.description:
+                    body.write(_docx_paragraph(document.description).encode('utf-8'))
+                for section in sections:
+                    body.write(_docx_paragraph(section.title, 'Heading2').encode('utf-8'))
+                    body.write(_docx_section_body(section.content).encode('utf-8'))
+                    chunk = buffer.drain()
+                    if chunk:
+                        yield chunk
+            body.write(DOCX_BODY_END.encode('utf-8'))
+    yield buffer.drain()
+
+
+EXPORTERS = {
+    'md': export_markdown,
+    'html': export_html,
+    'docx': export_docx,
+}
+
+
+def export_documents(documents, export_format, title=None):
+    """
+    指定された形式でドキュメントを出力する
+
+    Args:
+        documents (QuerySet): Document のクエリセット
+        export_format (str): EXPORT_FORMATS のキー
+        title (str): 複数のドキュメントをまとめる場合の見出し
+
+    Yields:
+        bytes: 出力ファイルの断片
+    """
+    for chunk in EXPORTERS[export_format](documents, title=title):
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+
+def _job_key(job_id):
+    return f'project-export:{job_id}'
+
+
+def set_export_state(job_id, **state):
+    """
+    エクスポートジョブの状態をキャッシュに保存する
+    """
+    current = cache.get(_job_key(job_id)) or {}
+    current.update(state)
+    cache.set(_job_key(job_id), current, timeout=getattr(settings, 'EXPORT_JOB_TIMEOUT', 60 * 60 * 24))
+    return current
+
+
+def get_export_state(job_id):
+    """
+    エクスポートジョブの状態をキャッシュから取得する
+
+    Returns:
+        dict: 状態（存在しない場合は None）
+    """
+    return cache.get(_job_key(job_id))
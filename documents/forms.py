@@ -1,5 +1,9 @@
 from django import forms
+from django.conf import settings
+from django.core.validators import MaxValueValidator
+from django.template.defaultfilters import filesizeformat
 from .models import Project, SectionTemplate, Document, DocumentSection
+from .specifications import SPECIFICATION_EXTENSIONS, specification_kind
 
 
 class ProjectForm(forms.ModelForm):
@@ -27,7 +31,7 @@ class SectionTemplateForm(forms.ModelForm):
     """
     class Meta:
         model = SectionTemplate
-        fields = ['title', 'description', 'form_type', 'content_guidelines', 'ai_prompt', 'order']
+        fields = ['title', 'description', 'form_type', 'content_guidelines', 'ai_prompt', 'use_product_digest', 'order']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-gray-700 text-gray-900'}),
             'description': forms.Textarea(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-gray-700 text-gray-900', 'rows': 2}),
@@ -42,6 +46,7 @@ class SectionTemplateForm(forms.ModelForm):
             'form_type': 'フォームタイプ',
             'content_guidelines': 'コンテンツガイドライン',
             'ai_prompt': 'AIプロンプト',
+            'use_product_digest': '製品説明の要約を使用する（オフにすると全文をプロンプトに含める）',
             'order': '表示順',
         }
 
@@ -52,18 +57,34 @@ class DocumentForm(forms.ModelForm):
     """
     class Meta:
         model = Document
-        fields = ['title', 'description', 'product_description']
+        fields = ['title', 'description', 'product_description', 'specification_file']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-gray-700 text-gray-900'}),
             'description': forms.Textarea(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-gray-700 text-gray-900', 'rows': 2}),
             'product_description': forms.Textarea(attrs={'class': 'w-full px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-gray-700 text-gray-900', 'rows': 6}),
+            'specification_file': forms.ClearableFileInput(attrs={'class': 'w-full text-sm text-gray-700', 'accept': ','.join(SPECIFICATION_EXTENSIONS)}),
         }
         labels = {
             'title': 'タイトル',
             'description': '説明',
             'product_description': '製品説明',
+            'specification_file': '仕様書ファイル（Markdown・テキスト・Word・PDF）',
         }
 
+    def clean_specification_file(self):
+        """
+        仕様書ファイルの形式とサイズを検証する（ファイルの内容は読み込まない）
+        """
+        file = self.cleaned_data.get('specification_file')
+        if not file or 'specification_file' not in self.changed_data:
+            return file
+        if specification_kind(file.name) is None:
+            raise forms.ValidationError(f'対応しているファイル形式は {", ".join(SPECIFICATION_EXTENSIONS)} です。')
+        max_size = getattr(settings, 'SPECIFICATION_MAX_UPLOAD_SIZE', 50 * 1024 * 1024)
+        if file.size > max_size:
+            raise forms.ValidationError(f'ファイルサイズは {filesizeformat(max_size)} 以下にしてください。')
+        return file
+
 
 class DocumentSectionForm(forms.ModelForm):
     """
@@ -79,4 +100,33 @@ class DocumentSectionForm(forms.ModelForm):
         labels = {
             'title': 'タイトル',
             'content': '内容',
-        } 
\ No newline at end of file
+        }
+
+
+class GenerationBatchForm(forms.Form):
+    """
+    複数ドキュメントの一括生成フォーム
+    """
+    documents = forms.ModelMultipleChoiceField(
+        queryset=Document.objects.none(),
+        widget=forms.CheckboxSelectMultiple,
+        label='生成するドキュメント',
+    )
+    force = forms.BooleanField(required=False, label='変更がないセクションもすべて再生成する')
+    deferred = forms.BooleanField(
+        required=False,
+        label='急がない（バッチAPIで生成し、完了後に取り込む）',
+    )
+    max_concurrency = forms.IntegerField(
+        min_value=1,
+        label='同時実行数',
+        widget=forms.NumberInput(attrs={'class': 'w-24 px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-gray-700 text-gray-900'}),
+    )
+
+    def __init__(self, *args, project, max_concurrency, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['documents'].queryset = project.documents.order_by('created_at', 'id')
+        # バッチごとの同時実行数は settings.GENERATION_BATCH_MAX_CONCURRENCY までに制限する
+        self.fields['max_concurrency'].widget.attrs['max'] = max_concurrency
+        self.fields['max_concurrency'].validators.append(MaxValueValidator(max_concurrency))
+        self.fields['max_concurrency'].initial = max_concurrency
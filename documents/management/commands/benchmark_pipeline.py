@@ -0,0 +1,330 @@
+import json
+import math
+import platform
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import OpenAIRequest
+from core.request_log import get_request_log
+from documents.models import Project, SectionTemplate, Document
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# データベースへの書き込みとして数えるSQL
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def percentile(values, ratio):
+    """
+    最近接順位法でパーセンタイルを求める
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(ratio * len(ordered)) - 1)]
+
+
+def peak_rss_kb():
+    """
+    プロセスの最大常駐メモリサイズ（KB）を取得する（取得できない場合は None）
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOSではバイト単位で返される
+    return rss // 1024 if platform.system() == 'Darwin' else rss
+
+
+class QueryCounter:
+    """
+    スレッドのデータベース接続で実行されたクエリ数と書き込み数を数える
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        if sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class RequestLogTracker:
+    """
+    設定されたログ（get_request_log()）が保存した計測中の記録の OpenAIRequest のIDを記録する
+
+    ログの record・write を置き換えて記録・保存を観察するため、計測は設定されたログ
+    （BufferedRequestLog・RedisRequestLog など）のまま行われる。RedisRequestLog では
+    他のプロセスの記録もまとめて保存されるため、このプロセスで記録したもののみを対象とする
+    （他のプロセスが先に保存した計測中の記録は対象外になる）。
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.ids = []
+        self._recorded = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(prompt, response, tokens_used):
+        return hash((prompt, response, tokens_used))
+
+    def __enter__(self):
+        self._replaced = {name: vars(self.log).get(name) for name in ('record', 'write')}
+        record = self.log.record
+        write = self.log.write
+
+        def tracking_record(prompt, response, tokens_used):
+            with self._lock:
+                self._recorded[self._fingerprint(prompt, response, tokens_used)] += 1
+            return record(prompt, response, tokens_used)
+
+        def tracking_write(records):
+            requests = write(records)
+            with self._lock:
+                for values, request in zip(records, requests):
+                    fingerprint = self._fingerprint(*values)
+                    if self._recorded[fingerprint] > 0:
+                        self._recorded[fingerprint] -= 1
+                        self.ids.append(request.pk)
+            return requests
+
+        self.log.record = tracking_record
+        self.log.write = tracking_write
+        return self
+
+    def __exit__(self, *exc_info):
+        for name, method in self._replaced.items():
+            if method is None:
+                delattr(self.log, name)
+            else:
+                setattr(self.log, name, method)
+
+    def pop_ids(self):
+        """
+        記録したIDを取得して消去する
+        """
+        with self._lock:
+            ids, self.ids = self.ids, []
+        return ids
+
+
+class Command(BaseCommand):
+    """
+    生成パイプライン全体のベンチマークを実行するコマンド
+
+    模擬バックエンド（FakeLLMBackend）を使用して、生成ビュー → Celeryタスク（eager） → core.utils →
+    DocumentSection の保存 → 進捗状況APIのポーリングまでを、同時に操作するユーザー数と
+    セクション数の組み合わせごとに計測する。計測用のデータは終了時に削除する。
+
+    例:
+        python manage.py benchmark_pipeline --sections 5 20 100 --users 1 10 50 --output benchmark.json
+    """
+    help = '模擬バックエンドで生成パイプライン全体の性能を計測し、結果をJSONで出力します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sections', type=int, nargs='+', default=[5, 20, 100], help='ドキュメントあたりのセクション数')
+        parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 50], help='同時に操作するユーザー数')
+        parser.add_argument('--documents-per-user', type=int, default=1, help='ユーザーごとに生成するドキュメント数')
+        parser.add_argument('--latency', type=float, default=0.05, help='1リクエストあたりの平均レイテンシ（秒）')
+        parser.add_argument('--distribution', default='lognormal', help='レイテンシの分布')
+        parser.add_argument('--jitter', type=float, default=0.5, help='レイテンシのばらつき')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='失敗（過負荷）の発生率')
+        parser.add_argument('--seed', type=int, default=0, help='乱数のシード')
+        parser.add_argument('--poll-interval', type=float, default=0.1, help='進捗状況APIのポーリング間隔（秒）')
+        parser.add_argument('--output', help='結果を書き込むJSONファイルのパス（省略時は表のみ出力）')
+
+    def handle(self, *args, **options):
+        overrides = {
+            'LLM_BACKEND': {
+                'BACKEND': 'core.llm_backends.FakeLLMBackend',
+                'OPTIONS': {
+                    'latency': options['latency'],
+                    'distribution': options['distribution'],
+                    'jitter': options['jitter'],
+                    'failure_rate': options['failure_rate'],
+                    'seed': options['seed'],
+                },
+            },
+            # 生成ビューのリクエスト内でタスクを実行する
+            'CELERY_TASK_ALWAYS_EAGER': True,
+            # 2回目以降の計測がキャッシュヒットにならないようにする
+            'LLM_CACHE': {'BACKEND': ''},
+            'LLM_RATE_LIMIT': {'REQUESTS_PER_MINUTE': 10 ** 6, 'TOKENS_PER_MINUTE': 10 ** 9},
+            'ALLOWED_HOSTS': ['testserver'],
+        }
+
+        results = []
+        self.stdout.write(
+            f"{'sections':>8} {'users':>5} {'docs':>5} {'wall(s)':>8} {'p50(s)':>7} {'p95(s)':>7} "
+            f"{'queries/doc':>11} {'writes/doc':>10} {'errors':>6} {'peak_rss(KB)':>12}"
+        )
+        with override_settings(**overrides):
+            for sections in options['sections']:
+                for users in options['users']:
+                    result = self.run_scenario(sections, users, options)
+                    results.append(result)
+                    self.stdout.write(
+                        f"{sections:>8} {users:>5} {result['documents']:>5} {result['wall_time']:>8.3f} "
+                        f"{result['latency_p50']:>7.3f} {result['latency_p95']:>7.3f} "
+                        f"{result['queries_per_document']:>11.1f} {result['writes_per_document']:>10.1f} "
+                        f"{result['errors']:>6} {result['peak_rss_kb'] or 0:>12}"
+                    )
+
+        if options['output']:
+            report = {
+                'created_at': timezone.now().isoformat(),
+                'environment': {
+                    'python': platform.python_version(),
+                    'django': django.get_version(),
+                    'database': connection.vendor,
+                },
+                'options': {
+                    key: options[key] for key in (
+                        'documents_per_user', 'latency', 'distribution', 'jitter', 'failure_rate', 'seed',
+                        'poll_interval',
+                    )
+                },
+                'results': results,
+            }
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"結果を {options['output']} に書き込みました")
+
+    def run_scenario(self, sections, users, options):
+        """
+        1つの組み合わせ（セクション数 × ユーザー数）を計測する
+        """
+        marker = f'benchmark-{uuid.uuid4().hex[:12]}'
+        documents = self.create_fixtures(marker, sections, users, options['documents_per_user'])
+        latencies = []
+        totals = {'queries': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+
+        def run_user(user, user_documents):
+            client = Client()
+            client.force_login(user)
+            counter = QueryCounter()
+            user_latencies = []
+            errors = 0
+            with connection.execute_wrapper(counter):
+                for document in user_documents:
+                    start = time.perf_counter()
+                    if self.generate(client, document, options['poll_interval']):
+                        user_latencies.append(time.perf_counter() - start)
+                    else:
+                        errors += 1
+            with lock:
+                latencies.extend(user_latencies)
+                totals['queries'] += counter.queries
+                totals['writes'] += counter.writes
+                totals['errors'] += errors
+
+        def run_user_in_thread(user, user_documents):
+            try:
+                run_user(user, user_documents)
+            finally:
+                connection.close()
+
+        with RequestLogTracker(get_request_log()) as tracker:
+            try:
+                start = time.perf_counter()
+                if users == 1:
+                    run_user(*documents[0])
+                else:
+                    with ThreadPoolExecutor(max_workers=users) as executor:
+                        futures = [
+                            executor.submit(run_user_in_thread, user, user_documents)
+                            for user, user_documents in documents
+                        ]
+                        for future in futures:
+                            future.result()
+                wall_time = time.perf_counter() - start
+            finally:
+                self.delete_fixtures(marker, tracker)
+
+        document_count = sum(len(user_documents) for _, user_documents in documents)
+        return {
+            'sections': sections,
+            'users': users,
+            'documents': document_count,
+            'wall_time': wall_time,
+            'latency_p50': percentile(latencies, 0.5) or 0.0,
+            'latency_p95': percentile(latencies, 0.95) or 0.0,
+            'queries_per_document': totals['queries'] / document_count,
+            'writes_per_document': totals['writes'] / document_count,
+            'errors': totals['errors'],
+            'peak_rss_kb': peak_rss_kb(),
+        }
+
+    def generate(self, client, document, poll_interval):
+        """
+        生成ビューにPOSTし、進捗状況APIで完了するまでポーリングする
+
+        Returns:
+            bool: 生成が完了した場合は True
+        """
+        response = client.post(reverse('generate_document_sections', kwargs={'pk': document.pk}))
+        if response.status_code != 302:
+            return False
+        task_id = response.url.rstrip('/').split('/')[-1]
+        status_url = reverse('get_generation_status', kwargs={'task_id': task_id})
+        while True:
+            data = client.get(status_url).json()
+            if data['status'] == 'completed':
+                return True
+            if data['status'] == 'failed':
+                return False
+            time.sleep(poll_interval)
+
+    def create_fixtures(self, marker, sections, users, documents_per_user):
+        """
+        計測用のユーザー・プロジェクト・テンプレート・ドキュメントを作成する
+
+        Returns:
+            list: (ユーザー, ドキュメントのリスト) のリスト
+        """
+        fixtures = []
+        for i in range(users):
+            user = User.objects.create(username=f'{marker}-{i}')
+            project = Project.objects.create(name=marker, owner=user)
+            SectionTemplate.objects.bulk_create([
+                SectionTemplate(project=project, title=f'セクション{order}', order=order)
+                for order in range(1, sections + 1)
+            ])
+            documents = Document.objects.bulk_create([
+                Document(project=project, title=f'{marker}-{j}', created_by=user,
+                         product_description=f'{marker} ユーザー{i} ドキュメント{j} の製品説明')
+                for j in range(documents_per_user)
+            ])
+            fixtures.append((user, documents))
+        return fixtures
+
+    def delete_fixtures(self, marker, tracker):
+        """
+        計測用のデータと、計測中に記録されたOpenAIRequestを削除する
+
+        同時に動作している他のプロセスの記録は削除しない。参照されなくなったプロンプトのブロブは
+        保持期間の経過後に archive_openai_requests が削除する。
+        """
+        User.objects.filter(username__startswith=f'{marker}-').delete()
+        tracker.log.flush()
+        ids = tracker.pop_ids()
+        for start in range(0, len(ids), 500):
+            OpenAIRequest.objects.filter(id__in=ids[start:start + 500]).delete()
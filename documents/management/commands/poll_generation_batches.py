@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from documents.tasks import poll_generation_batches_task
+
+
+class Command(BaseCommand):
+    """
+    遅延モードの一括生成のバッチジョブを確認し、完了したものの結果を取り込むコマンド
+
+    Celery beat を使用しない環境では cron などから定期的に実行する。
+
+    例:
+        python manage.py poll_generation_batches
+    """
+    help = '送信済みのバッチジョブの結果を取り込みます'
+
+    def handle(self, *args, **options):
+        ingested = poll_generation_batches_task()
+        self.stdout.write(f'取り込んだ一括生成: {ingested}')
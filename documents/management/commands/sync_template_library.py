@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from documents.template_library import sync_template_library
+
+
+class Command(BaseCommand):
+    """
+    default_templates.py の変更を共有テンプレートライブラリに反映するコマンド
+
+    例:
+        python manage.py sync_template_library
+    """
+    help = 'default_templates.py の内容で共有テンプレートライブラリを更新します'
+
+    def handle(self, *args, **options):
+        result = sync_template_library()
+        self.stdout.write(
+            f"作成: {result['created']} 更新: {result['updated']} 削除: {result['deleted']}"
+        )
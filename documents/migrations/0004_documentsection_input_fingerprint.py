@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_generationtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentsection',
+            name='input_fingerprint',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 10:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_documentsection_input_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentsection',
+            name='is_partial',
+            field=models.BooleanField(default=False),
+        ),
+    ]
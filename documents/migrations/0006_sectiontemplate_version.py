@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_documentsection_is_partial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sectiontemplate',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
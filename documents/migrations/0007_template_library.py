@@ -0,0 +1,40 @@
+# Generated by Django 4.2.10 on 2026-10-18 10:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_template_library(apps, schema_editor):
+    # 共有テンプレートライブラリを default_templates.py の内容で作成する
+    from documents.template_library import sync_template_library
+    sync_template_library(apps.get_model('documents', 'SectionTemplate'))
+
+
+def remove_template_library(apps, schema_editor):
+    apps.get_model('documents', 'SectionTemplate').objects.filter(project__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_sectiontemplate_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='project',
+            name='uses_template_library',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='sectiontemplate',
+            name='library_type',
+            field=models.CharField(blank=True, db_index=True, max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='sectiontemplate',
+            name='project',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='section_templates', to='documents.project'),
+        ),
+        migrations.RunPython(seed_template_library, remove_template_library),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.10 on 2026-10-18 10:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_template_library'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['project', '-updated_at', '-id'], name='document_project_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='generationtask',
+            index=models.Index(fields=['document', '-created_at'], name='task_document_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['owner', '-updated_at', '-id'], name='project_owner_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0008_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('status', models.CharField(choices=[('pending', '待機中'), ('processing', '処理中'), ('completed', '完了'), ('failed', '失敗')], default='pending', max_length=20)),
+                ('progress', models.IntegerField(default=0)),
+                ('max_concurrency', models.PositiveIntegerField(default=4)),
+                ('total_documents', models.IntegerField(default=0)),
+                ('completed_documents', models.IntegerField(default=0)),
+                ('failed_documents', models.IntegerField(default=0)),
+                ('total_sections', models.IntegerField(default=0)),
+                ('completed_sections', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_batches', to=settings.AUTH_USER_MODEL)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_batches', to='documents.project')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='generationtask',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tasks', to='documents.generationbatch'),
+        ),
+    ]
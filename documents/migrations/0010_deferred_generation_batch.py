@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_generation_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationbatch',
+            name='mode',
+            field=models.CharField(choices=[('immediate', '即時'), ('deferred', '遅延（バッチAPI）')], default='immediate', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='generationbatch',
+            name='provider_batch_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='generationbatch',
+            name='request_file',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
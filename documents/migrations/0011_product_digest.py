@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0010_deferred_generation_batch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='product_digest',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='product_digest_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='sectiontemplate',
+            name='use_product_digest',
+            field=models.BooleanField(default=True),
+        ),
+    ]
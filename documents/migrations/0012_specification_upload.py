@@ -0,0 +1,50 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0011_product_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='specification_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='specification_file',
+            field=models.FileField(blank=True, upload_to='specifications/%Y/%m/'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='specification_length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='specification_status',
+            field=models.CharField(blank=True, choices=[('', 'なし'), ('pending', '待機中'), ('processing', '抽出中'), ('completed', '完了'), ('failed', '失敗')], max_length=20),
+        ),
+        migrations.CreateModel(
+            name='SpecificationChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('content', models.TextField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='specification_chunks', to='documents.document')),
+            ],
+            options={
+                'ordering': ['index'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='specificationchunk',
+            constraint=models.UniqueConstraint(fields=('document', 'index'), name='specification_chunk_unique_index'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_specification_upload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generationbatch',
+            name='use_cache',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import os
+
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -14,12 +16,33 @@ class Project(models.Model):
     description = models.TextField(blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='projects')
     template_type = models.CharField(max_length=50, choices=TEMPLATE_CHOICES, default='test_specification')
+    # True の場合、template_type の共有テンプレートライブラリを参照する
+    # テンプレートをカスタマイズすると、プロジェクト専用のテンプレートにコピーされて False になる
+    uses_template_library = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 一覧のキーセットページネーション用
+            models.Index(fields=['owner', '-updated_at', '-id'], name='project_owner_updated_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    def get_section_templates(self):
+        """
+        プロジェクトで使用するセクションテンプレートを取得する
+
+        Returns:
+            QuerySet: 共有ライブラリを参照している場合はライブラリのテンプレート、
+                それ以外の場合はプロジェクト専用のテンプレート
+        """
+        if self.uses_template_library:
+            return SectionTemplate.objects.filter(project__isnull=True, library_type=self.template_type)
+        return self.section_templates.all()
+
 
 class SectionTemplate(models.Model):
     FORM_TYPE_CHOICES = [
@@ -30,13 +53,20 @@ class SectionTemplate(models.Model):
         ('list', 'リスト'),
     ]
 
-    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='section_templates')
+    # 共有ライブラリのテンプレートは project が空で、library_type にテンプレートタイプを持つ
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='section_templates',
+                                null=True, blank=True)
+    library_type = models.CharField(max_length=50, blank=True, db_index=True)
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     form_type = models.CharField(max_length=20, choices=FORM_TYPE_CHOICES, default='textarea')
     content_guidelines = models.TextField(blank=True)
     ai_prompt = models.TextField(blank=True)
     order = models.PositiveIntegerField(default=0)
+    # False の場合、製品説明の要約ではなく全文をプロンプトに含める（詳細な情報が必要なセクション用）
+    use_product_digest = models.BooleanField(default=True)
+    # 楽観的排他制御用のバージョン（更新のたびに加算する）
+    version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -44,21 +74,65 @@ class SectionTemplate(models.Model):
         ordering = ['order']
 
     def __str__(self):
+        if self.project_id is None:
+            return f"ライブラリ - {self.title}"
         return f"{self.project.name} - {self.title}"
 
 
 class Document(models.Model):
+    SPECIFICATION_STATUS_CHOICES = [
+        ('', 'なし'),
+        ('pending', '待機中'),
+        ('processing', '抽出中'),
+        ('completed', '完了'),
+        ('failed', '失敗'),
+    ]
+
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='documents')
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     product_description = models.TextField(blank=True)
+    # アップロードされた仕様書ファイル（抽出したテキストは SpecificationChunk に分割して保存する）
+    specification_file = models.FileField(upload_to='specifications/%Y/%m/', blank=True)
+    specification_status = models.CharField(max_length=20, choices=SPECIFICATION_STATUS_CHOICES, blank=True)
+    specification_error = models.TextField(blank=True)
+    # 抽出したテキストの文字数
+    specification_length = models.PositiveIntegerField(default=0)
+    # セクションのプロンプトで製品説明の代わりに使用する要約と、要約した製品説明のハッシュ
+    product_digest = models.TextField(blank=True)
+    product_digest_hash = models.CharField(max_length=64, blank=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 一覧のキーセットページネーション用
+            models.Index(fields=['project', '-updated_at', '-id'], name='document_project_updated_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    @property
+    def specification_filename(self):
+        return os.path.basename(self.specification_file.name)
+
+
+class SpecificationChunk(models.Model):
+    """
+    仕様書ファイルから抽出したテキストの断片（index 順に連結すると全文になる）
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='specification_chunks')
+    index = models.PositiveIntegerField()
+    content = models.TextField()
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'index'], name='specification_chunk_unique_index'),
+        ]
+
 
 class DocumentSection(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='sections')
@@ -66,6 +140,10 @@ class DocumentSection(models.Model):
     title = models.CharField(max_length=255)
     content = models.TextField(blank=True)
     order = models.PositiveIntegerField(default=0)
+    # 生成に使用した入力（製品説明・テンプレート・モデルパラメータ）のハッシュ
+    input_fingerprint = models.CharField(max_length=64, blank=True)
+    # ストリーミング生成中（または中断された）途中の内容
+    is_partial = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -85,6 +163,9 @@ class GenerationTask(models.Model):
     ]
     
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='generation_tasks')
+    # 一括生成の一部として作成された場合のバッチ
+    batch = models.ForeignKey('GenerationBatch', on_delete=models.SET_NULL, null=True, blank=True,
+                              related_name='tasks')
     task_id = models.CharField(max_length=255, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     progress = models.IntegerField(default=0)  # 0-100の進捗率
@@ -93,6 +174,50 @@ class GenerationTask(models.Model):
     error_message = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # 最新の生成タスクの取得用
+            models.Index(fields=['document', '-created_at'], name='task_document_created_idx'),
+        ]
     
     def __str__(self):
         return f"Generation Task for {self.document.title} ({self.status})"
+
+
+class GenerationBatch(models.Model):
+    """
+    プロジェクト内の複数のドキュメントの一括生成
+
+    ドキュメントごとの GenerationTask をまとめ、全体の進捗状況を保持する。
+    """
+    MODE_CHOICES = [
+        ('immediate', '即時'),
+        # プロバイダのバッチAPIに送信し、結果は定期的なポーリングで取り込む
+        ('deferred', '遅延（バッチAPI）'),
+    ]
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='generation_batches')
+    created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='generation_batches')
+    task_id = models.CharField(max_length=255, blank=True, null=True)
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='immediate')
+    # 遅延モードで送信したバッチジョブのIDと、送信したリクエスト（JSONL）の保存先
+    provider_batch_id = models.CharField(max_length=255, blank=True)
+    request_file = models.CharField(max_length=255, blank=True)
+    # 取り込んだ結果をLLMレスポンスキャッシュに保存するか（すべて再生成する場合は保存しない）
+    use_cache = models.BooleanField(default=True)
+    status = models.CharField(max_length=20, choices=GenerationTask.STATUS_CHOICES, default='pending')
+    progress = models.IntegerField(default=0)  # 0-100の進捗率
+    # バッチ全体で同時に送信するAPIリクエストの最大数
+    max_concurrency = models.PositiveIntegerField(default=4)
+    total_documents = models.IntegerField(default=0)
+    completed_documents = models.IntegerField(default=0)
+    failed_documents = models.IntegerField(default=0)
+    total_sections = models.IntegerField(default=0)
+    completed_sections = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Generation Batch for {self.project.name} ({self.status})"
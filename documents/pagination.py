@@ -0,0 +1,126 @@
+import base64
+import json
+
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_datetime
+
+from .models import Document, DocumentSection, GenerationTask
+
+
+class KeysetPage:
+    """
+    キーセットページネーションの1ページ分の結果
+    """
+
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+def encode_cursor(obj):
+    """
+    オブジェクトの (updated_at, id) からカーソル文字列を作成する
+    """
+    payload = json.dumps([obj.updated_at.isoformat(), obj.pk])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    カーソル文字列を (updated_at, id) に戻す
+
+    Returns:
+        tuple: (updated_at, id)（不正なカーソルの場合は None）
+    """
+    try:
+        updated_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        updated_at = parse_datetime(updated_at)
+        if updated_at is None:
+            return None
+        return updated_at, int(pk)
+    except (ValueError, TypeError, UnicodeError):
+        return None
+
+
+def keyset_paginate(queryset, cursor=None, per_page=20):
+    """
+    (updated_at, id) の降順でキーセットページネーションを行う
+
+    OFFSET を使用しないため、何ページ目でも取得にかかる時間は件数に依存しない。
+
+    Args:
+        queryset (QuerySet): updated_at を持つモデルのクエリセット
+        cursor (str): 前のページの next_cursor（省略時は最初のページ）
+        per_page (int): 1ページあたりの件数
+
+    Returns:
+        KeysetPage: ページ
+    """
+    queryset = queryset.order_by('-updated_at', '-id')
+    position = decode_cursor(cursor) if cursor else None
+    if position is not None:
+        updated_at, pk = position
+        queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=pk))
+
+    # 次のページがあるかどうかを判定するために1件多く取得する
+    items = list(queryset[:per_page + 1])
+    if len(items) > per_page:
+        items = items[:per_page]
+        return KeysetPage(items, encode_cursor(items[-1]))
+    return KeysetPage(items)
+
+
+def add_status_labels(page):
+    """
+    annotate_*_counts で追加した最新の生成タスクのステータスに表示名を設定する
+    """
+    labels = dict(GenerationTask.STATUS_CHOICES)
+    for item in page:
+        item.last_generation_status_label = labels.get(item.last_generation_status, '')
+    return page
+
+
+def _count_subquery(queryset, field):
+    """
+    OuterRef('pk') に関連する行数を数えるサブクエリを作成する
+    """
+    counts = queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(count=Count('*'))
+    return Coalesce(Subquery(counts.values('count')[:1]), 0)
+
+
+def annotate_project_counts(queryset):
+    """
+    プロジェクトのドキュメント数と最新の生成タスクのステータスを追加する
+
+    サブクエリは取得したページの行に対してのみ実行されるため、1クエリで一覧を表示できる。
+    """
+    last_task = GenerationTask.objects.filter(document__project=OuterRef('pk')).order_by('-created_at', '-id')
+    return queryset.annotate(
+        document_count=_count_subquery(Document.objects.all(), 'project'),
+        last_generation_status=Subquery(last_task.values('status')[:1]),
+    )
+
+
+def annotate_document_counts(queryset):
+    """
+    ドキュメントのセクション数と最新の生成タスクのステータスを追加する
+    """
+    last_task = GenerationTask.objects.filter(document=OuterRef('pk')).order_by('-created_at', '-id')
+    return queryset.annotate(
+        section_count=_count_subquery(DocumentSection.objects.filter(is_partial=False), 'document'),
+        last_generation_status=Subquery(last_task.values('status')[:1]),
+    )
@@ -0,0 +1,148 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _state_key(task_id):
+    return f'generation-progress:{task_id}'
+
+
+def _completed_key(task_id):
+    return f'generation-progress:{task_id}:completed'
+
+
+def _section_key(task_id, template_id):
+    return f'generation-progress:{task_id}:section:{template_id}'
+
+
+def _batch_key(batch_id):
+    return f'generation-batch:{batch_id}'
+
+
+class GenerationProgress:
+    """
+    生成タスクの進捗状況をキャッシュ（Redisなど）に保持するクラス
+
+    進捗状況の更新はメモリ上でまとめ、前回の書き込みから
+    settings.GENERATION_PROGRESS_INTERVAL 秒以上経過した場合にのみキャッシュに書き込む。
+    GenerationTask には最終状態のみを保存する。
+    """
+
+    def __init__(self, task, section_ids=(), min_interval=None):
+        self.task_id = task.id
+        self.key = _state_key(task.id)
+        self.min_interval = (
+            min_interval if min_interval is not None
+            else getattr(settings, 'GENERATION_PROGRESS_INTERVAL', 0.5)
+        )
+        self.state = {
+            'status': task.status,
+            'progress': task.progress,
+            'total_sections': task.total_sections,
+            'completed_sections': task.completed_sections,
+            'error_message': task.error_message,
+            'document_id': task.document_id,
+            'owner_id': task.document.project.owner_id,
+            # 生成対象のセクションテンプレートIDと、セクションごとの進捗状況（0-100）
+            'section_ids': list(section_ids),
+            'sections': {},
+        }
+        self._last_write = None
+        self._dirty = False
+
+    def update(self, force=False, **fields):
+        """
+        進捗状況を更新する（一定間隔でのみキャッシュに書き込む）
+        """
+        self.state.update(fields)
+        self._dirty = True
+        now = time.monotonic()
+        if force or self._last_write is None or now - self._last_write >= self.min_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        未書き込みの進捗状況をキャッシュに書き込む
+        """
+        if not self._dirty:
+            return
+        cache.set(self.key, self.state, timeout=getattr(settings, 'GENERATION_PROGRESS_TIMEOUT', 3600))
+        self._last_write = time.monotonic()
+        self._dirty = False
+
+    @staticmethod
+    def set_section(task_id, template_id, progress):
+        """
+        サブタスクからセクションの進捗状況を書き込む
+        """
+        cache.set(_section_key(task_id, template_id), progress,
+                  timeout=getattr(settings, 'GENERATION_PROGRESS_TIMEOUT', 3600))
+
+    @staticmethod
+    def increment_completed(task_id):
+        """
+        完了したセクション数を加算する（複数のワーカーから同時に呼ばれても安全）
+        """
+        key = _completed_key(task_id)
+        cache.add(key, 0, timeout=getattr(settings, 'GENERATION_PROGRESS_TIMEOUT', 3600))
+        return cache.incr(key)
+
+    @staticmethod
+    def get_state(task_id):
+        """
+        キャッシュから進捗状況を取得する
+
+        Returns:
+            dict: 進捗状況（キャッシュにない場合は None）
+        """
+        state = cache.get(_state_key(task_id))
+        if state is None:
+            return None
+        if state.get('section_ids'):
+            keys = {_section_key(task_id, template_id): template_id for template_id in state['section_ids']}
+            for key, progress in cache.get_many(list(keys)).items():
+                state['sections'][keys[key]] = progress
+        completed = cache.get(_completed_key(task_id))
+        if completed is not None and state['status'] == 'processing' and state['total_sections']:
+            state['completed_sections'] = completed
+            state['progress'] = min(completed * 100 // state['total_sections'], 99)  # 完全に完了するまでは99%まで
+        return state
+
+
+class BatchProgress(GenerationProgress):
+    """
+    一括生成（GenerationBatch）の全体の進捗状況をキャッシュに保持するクラス
+
+    GenerationProgress と同様に書き込みを間引き、GenerationBatch には最終状態のみを保存する。
+    """
+
+    def __init__(self, batch, min_interval=None):
+        self.key = _batch_key(batch.id)
+        self.min_interval = (
+            min_interval if min_interval is not None
+            else getattr(settings, 'GENERATION_PROGRESS_INTERVAL', 0.5)
+        )
+        self.state = {
+            'status': batch.status,
+            'progress': batch.progress,
+            'total_documents': batch.total_documents,
+            'completed_documents': batch.completed_documents,
+            'failed_documents': batch.failed_documents,
+            'total_sections': batch.total_sections,
+            'completed_sections': batch.completed_sections,
+            'error_message': batch.error_message,
+            'owner_id': batch.created_by_id,
+        }
+        self._last_write = None
+        self._dirty = False
+
+    @staticmethod
+    def get_state(batch_id):
+        """
+        キャッシュから一括生成の進捗状況を取得する
+
+        Returns:
+            dict: 進捗状況（キャッシュにない場合は None）
+        """
+        return cache.get(_batch_key(batch_id))
@@ -0,0 +1,249 @@
+import hashlib
+import re
+
+from django.core.cache import cache
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+# レンダラーの出力を変更した場合は上げる（古いキャッシュを参照しないようにする）
+RENDERER_VERSION = 1
+CACHE_PREFIX = 'section_html'
+CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*)$')
+_BULLET = re.compile(r'^\s*[-*+・]\s+(.*)$')
+_NUMBERED = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+_TABLE_ROW = re.compile(r'^\s*\|.*\|\s*$')
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$')
+_CODE = re.compile(r'`([^`]+)`')
+_BOLD = re.compile(r'\*\*(.+?)\*\*')
+_EMPHASIS = re.compile(r'(?<!\*)\*(?!\s)(.+?)(?<!\s)\*(?!\*)')
+_LINK = re.compile(r'\[([^\]]+)\]\((https?://[^\s)*]+)\)')
+
+
+def render_inline(text):
+    """
+    インライン要素（コード、強調、リンク）をHTMLに変換する
+
+    入力はすべてエスケープしてからタグを組み立てるため、元の文字列に含まれるHTMLは出力されない。
+    リンクは http(s) のURLのみ許可する。
+    """
+    codes = []
+
+    def stash_code(match):
+        codes.append(match.group(1))
+        return f'\x00{len(codes) - 1}\x00'
+
+    # コード内は他のインライン要素として解釈しない
+    text = escape(_CODE.sub(stash_code, text))
+    text = _LINK.sub(r'<a href="\2" rel="noopener noreferrer nofollow">\1</a>', text)
+    text = _BOLD.sub(r'<strong>\1</strong>', text)
+    text = _EMPHASIS.sub(r'<em>\1</em>', text)
+    return re.sub(r'\x00(\d+)\x00', lambda m: f'<code>{escape(codes[int(m.group(1))])}</code>', text)
+
+
+def _split_row(line):
+    return [cell.strip() for cell in line.strip().strip('|').split('|')]
+
+
+def _render_table(lines):
+    rows = [_split_row(line) for line in lines if not _TABLE_SEPARATOR.match(line)]
+    has_header = len(lines) > 1 and _TABLE_SEPARATOR.match(lines[1])
+    html = ['<table>']
+    if has_header:
+        header = rows.pop(0)
+        html.append('<thead><tr>' + ''.join(f'<th>{render_inline(cell)}</th>' for cell in header) + '</tr></thead>')
+    html.append('<tbody>')
+    for row in rows:
+        html.append('<tr>' + ''.join(f'<td>{render_inline(cell)}</td>' for cell in row) + '</tr>')
+    html.append('</tbody></table>')
+    return ''.join(html)
+
+
+def _render_list(items, ordered):
+    tag = 'ol' if ordered else 'ul'
+    return f'<{tag}>' + ''.join(f'<li>{render_inline(item)}</li>' for item in items) + f'</{tag}>'
+
+
+def render_markdown(text):
+    """
+    マークダウンのサブセット（見出し、リスト、テーブル、コードブロック、段落）をHTMLに変換する
+
+    Args:
+        text (str): マークダウン
+
+    Returns:
+        str: HTML
+    """
+    lines = text.replace('\r\n', '\n').split('\n')
+    html = []
+    paragraph = []
+
+    def flush_paragraph():
+        if paragraph:
+            html.append('<p>' + '<br>'.join(render_inline(line) for line in paragraph) + '</p>')
+            paragraph.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+
+        if stripped.startswith('```'):
+            flush_paragraph()
+            code = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith('```'):
+                code.append(lines[i])
+                i += 1
+            html.append('<pre><code>' + escape('\n'.join(code)) + '</code></pre>')
+            i += 1
+            continue
+
+        if not stripped:
+            flush_paragraph()
+            i += 1
+            continue
+
+        heading = _HEADING.match(stripped)
+        if heading:
+            flush_paragraph()
+            level = len(heading.group(1))
+            html.append(f'<h{level}>{render_inline(heading.group(2))}</h{level}>')
+            i += 1
+            continue
+
+        if _TABLE_ROW.match(line):
+            flush_paragraph()
+            rows = []
+            while i < len(lines) and _TABLE_ROW.match(lines[i]):
+                rows.append(lines[i])
+                i += 1
+            html.append(_render_table(rows))
+            continue
+
+        for pattern, ordered in ((_BULLET, False), (_NUMBERED, True)):
+            if pattern.match(line):
+                flush_paragraph()
+                items = []
+                while i < len(lines) and pattern.match(lines[i]):
+                    items.append(pattern.match(lines[i]).group(1))
+                    i += 1
+                html.append(_render_list(items, ordered))
+                break
+        else:
+            paragraph.append(stripped)
+            i += 1
+
+    flush_paragraph()
+    return '\n'.join(html)
+
+
+def render_plain_list(text):
+    """
+    1行1項目のテキストをリストに変換する（行頭の記号や番号は取り除く）
+    """
+    items = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        match = _BULLET.match(line) or _NUMBERED.match(line)
+        items.append(match.group(1) if match else line.strip())
+    return _render_list(items, ordered=False)
+
+
+def render_plain_text(text):
+    """
+    テキストを段落と改行を保持したHTMLに変換する
+    """
+    paragraphs = re.split(r'\n\s*\n', text.replace('\r\n', '\n').strip())
+    return '\n'.join(
+        '<p>' + '<br>'.join(escape(line) for line in paragraph.split('\n')) + '</p>'
+        for paragraph in paragraphs if paragraph
+    )
+
+
+def render_content(content, form_type):
+    """
+    セクションの内容をテンプレートのフォームタイプに応じてHTMLに変換する
+
+    Args:
+        content (str): セクションの内容
+        form_type (str): SectionTemplate.form_type
+
+    Returns:
+        str: HTML
+    """
+    if not content:
+        return ''
+    if form_type in ('markdown', 'table'):
+        # テーブル以外の文章が含まれていても表示できるよう、マークダウンとして変換する
+        return render_markdown(content)
+    if form_type == 'list':
+        # マークダウンのリスト以外の行（見出しなど）が含まれる場合はマークダウンとして扱う
+        lines = [line for line in content.splitlines() if line.strip()]
+        if all(_BULLET.match(line) or _NUMBERED.match(line) for line in lines):
+            return render_plain_list(content)
+        if any(_BULLET.match(line) or _NUMBERED.match(line) for line in lines):
+            return render_markdown(content)
+        return render_plain_list(content)
+    return render_plain_text(content)
+
+
+def _cache_key(content, form_type):
+    digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return f'{CACHE_PREFIX}:{RENDERER_VERSION}:{form_type}:{digest}'
+
+
+def _form_type(section):
+    return section.template.form_type if section.template_id else 'textarea'
+
+
+def render_section(section):
+    """
+    セクションの内容をHTMLに変換する（キャッシュ付き）
+
+    キャッシュキーは内容のハッシュのため、内容が変わると自動的に新しいキーで変換し直す。
+
+    Args:
+        section (DocumentSection): セクション
+
+    Returns:
+        SafeString: HTML
+    """
+    form_type = _form_type(section)
+    key = _cache_key(section.content, form_type)
+    html = cache.get(key)
+    if html is None:
+        html = render_content(section.content, form_type)
+        cache.set(key, html, CACHE_TIMEOUT)
+    return mark_safe(html)
+
+
+def render_sections(sections):
+    """
+    複数のセクションの内容をまとめてHTMLに変換し、rendered_content に設定する
+
+    キャッシュは get_many / set_many で1往復ずつ参照するため、セクション数が多くても
+    変更のないセクションは再変換しない。
+
+    Args:
+        sections (list): DocumentSection のリスト（template を select_related しておく）
+
+    Returns:
+        list: 引数のセクション
+    """
+    keys = {section.pk: _cache_key(section.content, _form_type(section)) for section in sections}
+    cached = cache.get_many(set(keys.values()))
+    missing = {}
+    for section in sections:
+        key = keys[section.pk]
+        html = cached.get(key)
+        if html is None:
+            html = missing.get(key)
+            if html is None:
+                html = missing[key] = render_content(section.content, _form_type(section))
+        section.rendered_content = mark_safe(html)
+    if missing:
+        cache.set_many(missing, CACHE_TIMEOUT)
+    return sections
@@ -0,0 +1,300 @@
+import codecs
+import os
+import shutil
+import tempfile
+import zipfile
+from xml.etree import ElementTree
+
+from django.conf import settings
+
+from core.retrieval import select_relevant_chunks
+from core.utils import template_query
+
+# アップロードできる仕様書ファイルの拡張子と抽出方法
+SPECIFICATION_EXTENSIONS = {
+    '.md': 'text',
+    '.markdown': 'text',
+    '.txt': 'text',
+    '.docx': 'docx',
+    '.pdf': 'pdf',
+}
+
+# ファイルを読み込む単位（バイト）
+READ_SIZE = 64 * 1024
+# まとめて保存するチャンク数
+CHUNK_BATCH_SIZE = 50
+
+_WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def specification_kind(name):
+    """
+    ファイル名から抽出方法を取得する（対応していない場合は None）
+    """
+    return SPECIFICATION_EXTENSIONS.get(os.path.splitext(name)[1].lower())
+
+
+def _detect_encoding(head):
+    """
+    ファイルの先頭のバイト列から文字コードを判定する（UTF-8 として読めない場合は CP932）
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    try:
+        # 先頭部分の末尾で文字が途中で切れている場合を許容する
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return 'cp932'
+    return 'utf-8'
+
+
+def iter_text_file(file):
+    """
+    テキストファイル（Markdown・プレーンテキスト）を少しずつデコードする
+
+    Args:
+        file: バイナリモードで開いたファイル
+
+    Yields:
+        str: デコードしたテキスト
+    """
+    head = file.read(READ_SIZE)
+    decoder = codecs.getincrementaldecoder(_detect_encoding(head))(errors='replace')
+    data = head
+    while data:
+        text = decoder.decode(data)
+        if text:
+            yield text.replace('\r\n', '\n')
+        data = file.read(READ_SIZE)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_docx_text(file):
+    """
+    DOCXファイルの本文を段落ごとに取り出す
+
+    word/document.xml を展開しながら iterparse で読み込み、処理済みの要素は破棄する。
+
+    Args:
+        file: バイナリモードで開いたシーク可能なファイル
+
+    Yields:
+        str: 段落のテキスト（末尾に改行を付ける）
+    """
+    with zipfile.ZipFile(file) as archive, archive.open('word/document.xml') as xml:
+        parents = []
+        for event, element in ElementTree.iterparse(xml, events=('start', 'end')):
+            if event == 'start':
+                parents.append(element)
+                continue
+            parents.pop()
+            if element.tag != f'{_WORD_NAMESPACE}p':
+                continue
+            parts = []
+            for node in element.iter():
+                if node.tag == f'{_WORD_NAMESPACE}t' and node.text:
+                    parts.append(node.text)
+                elif node.tag == f'{_WORD_NAMESPACE}tab':
+                    parts.append('\t')
+                elif node.tag == f'{_WORD_NAMESPACE}br':
+                    parts.append('\n')
+            yield ''.join(parts) + '\n'
+            # 段落を親要素から取り除き、読み込み済みの内容をメモリに残さない
+            if parents:
+                parents[-1].remove(element)
+
+
+def iter_pdf_text(file):
+    """
+    PDFファイルのテキストをページごとに取り出す（pypdf が必要）
+
+    Args:
+        file: バイナリモードで開いたシーク可能なファイル
+
+    Yields:
+        str: ページのテキスト
+    """
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ValueError('PDFファイルの読み込みには pypdf をインストールしてください。')
+
+    for page in PdfReader(file).pages:
+        yield (page.extract_text() or '') + '\n\n'
+
+
+EXTRACTORS = {
+    'text': iter_text_file,
+    'docx': iter_docx_text,
+    'pdf': iter_pdf_text,
+}
+
+
+class ChunkWriter:
+    """
+    抽出したテキストを一定の文字数のチャンクに分割して保存する
+
+    できるだけ改行の位置で区切り、CHUNK_BATCH_SIZE 件ごとに bulk_create するため、
+    保持するテキストは最大で chunk_size × CHUNK_BATCH_SIZE 文字程度になる。
+    """
+
+    def __init__(self, document, chunk_size=None):
+        from .models import SpecificationChunk
+
+        self.model = SpecificationChunk
+        self.document = document
+        self.chunk_size = chunk_size or getattr(settings, 'SPECIFICATION_CHUNK_SIZE', 4000)
+        self.buffer = ''
+        self.pending = []
+        self.index = 0
+        self.length = 0
+
+    def write(self, text):
+        self.buffer += text
+        while len(self.buffer) >= self.chunk_size:
+            cut = self.buffer.rfind('\n', 0, self.chunk_size) + 1
+            if cut < self.chunk_size // 2:
+                cut = self.chunk_size
+            self._add(self.buffer[:cut])
+            self.buffer = self.buffer[cut:]
+
+    def close(self):
+        """
+        残りのテキストを保存する
+
+        Returns:
+            int: 保存したテキストの文字数
+        """
+        if self.buffer:
+            self._add(self.buffer)
+            self.buffer = ''
+        self._flush()
+        return self.length
+
+    def _add(self, content):
+        self.pending.append(self.model(document=self.document, index=self.index, content=content))
+        self.index += 1
+        self.length += len(content)
+        if len(self.pending) >= CHUNK_BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self.model.objects.bulk_create(self.pending)
+        self.pending = []
+
+
+def _open_seekable(file):
+    """
+    シークできないストレージのファイルは一時ファイルに少しずつコピーしてから開く
+    """
+    if file.seekable():
+        return file
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(file, copy, READ_SIZE)
+    file.close()
+    copy.seek(0)
+    return copy
+
+
+def extract_specification(document):
+    """
+    仕様書ファイルのテキストを抽出し、チャンクに分割して保存する
+
+    ファイルは READ_SIZE ずつ（DOCX は段落ごと、PDF はページごと）に読み込むため、
+    ファイル全体をメモリに読み込むことはない。既存のチャンクは置き換える。
+
+    Args:
+        document (Document): 仕様書ファイルがアップロードされたドキュメント
+
+    Returns:
+        int: 抽出したテキストの文字数
+    """
+    kind = specification_kind(document.specification_file.name)
+    if kind is None:
+        raise ValueError('対応していないファイル形式です。')
+
+    document.specification_chunks.all().delete()
+    writer = ChunkWriter(document)
+    with document.specification_file.open('rb') as file:
+        source = _open_seekable(file) if kind != 'text' else file
+        try:
+            for text in EXTRACTORS[kind](source):
+                writer.write(text)
+        finally:
+            if source is not file:
+                source.close()
+    return writer.close()
+
+
+def iter_specification_text(document):
+    """
+    保存済みの仕様書のテキストをチャンクごとに取得する（1チャンクずつデータベースから読み込む）
+    """
+    for content in document.specification_chunks.values_list('content', flat=True).iterator(chunk_size=20):
+        yield content
+
+
+def _select_specification_excerpts(document, templates):
+    """
+    テンプレートごとに、保存済みの仕様書から関連するチャンクを選んで連結する
+
+    チャンクはデータベースから1件ずつ読み込んでスコアを計算し、選んだチャンクのみを取得するため、
+    仕様書の全文をメモリに読み込むことはない。
+
+    Args:
+        document (Document): ドキュメント
+        templates (list): セクションテンプレートのリスト
+
+    Returns:
+        dict: テンプレートのIDをキー、仕様書の抜粋を値とする辞書
+    """
+    if not templates:
+        return {}
+    selected = select_relevant_chunks(
+        lambda: iter_specification_text(document),
+        [template_query(template) for template in templates],
+        getattr(settings, 'SPECIFICATION_RETRIEVAL_TOP_K', 2),
+    )
+    contents = dict(document.specification_chunks.filter(
+        index__in={index for indexes in selected for index in indexes},
+    ).values_list('index', 'content'))
+    return {
+        template.id: '\n\n'.join(contents[index].strip() for index in indexes)
+        for template, indexes in zip(templates, selected)
+    }
+
+
+def load_product_description(document, templates=None):
+    """
+    生成に使用する製品説明を取得する
+
+    仕様書ファイルの抽出が完了している場合、仕様書が settings.SPECIFICATION_INLINE_MAX_LENGTH 文字以下であれば
+    入力された製品説明の後に仕様書のテキストを連結する。それより長い場合は全文を連結せず、
+    テンプレートごとに関連するチャンクを選んで抜粋にする。
+    結果は document.product_description に、抜粋（テンプレートのIDをキーとする辞書）は
+    document.specification_excerpts に設定する（保存はしない）。抜粋は build_section_prompt() などに
+    excerpts として渡す。
+
+    Args:
+        document (Document): ドキュメント
+        templates (list): 生成するセクションテンプレート（省略時はプロジェクトのすべてのテンプレート）
+
+    Returns:
+        str: 製品説明
+    """
+    if not hasattr(document, 'specification_excerpts'):
+        document.specification_excerpts = {}
+    if document.specification_status == 'completed' and not getattr(document, '_specification_loaded', False):
+        description = document.product_description.strip()
+        if document.specification_length <= getattr(settings, 'SPECIFICATION_INLINE_MAX_LENGTH', 20000):
+            specification = ''.join(iter_specification_text(document))
+            document.product_description = '\n\n'.join(
+                text for text in (description, specification.strip()) if text
+            )
+        else:
+            if templates is None:
+                templates = list(document.project.get_section_templates())
+            document.product_description = description
+            document.specification_excerpts = _select_specification_excerpts(document, templates)
+        document._specification_loaded = True
+    return document.product_description
@@ -1,86 +1,701 @@
-from celery import shared_task
-from .models import Document, DocumentSection, GenerationTask, SectionTemplate
-from core.utils import generate_test_document_with_progress
+import json
+import logging
+import tempfile
+import time
+
+from celery import shared_task, chord
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .models import Project, Document, DocumentSection, GenerationTask, GenerationBatch, SectionTemplate
+from .export import EXPORT_FORMATS, export_documents, set_export_state
+from .progress import GenerationProgress, BatchProgress
+from django.core.files.base import ContentFile
+from core.llm_backends import get_llm_backend
+from core.request_log import get_request_log
+from core.utils import (
+    generate_test_document_with_progress, generate_test_document_combined, generate_section,
+    generate_completions, section_fingerprint, is_error_content, build_template_prompt, build_section_prompt,
+    completion_cache_key, build_batch_request, ingest_batch_results,
+)
+from .digest import ensure_product_digest, get_product_digest
+from .specifications import extract_specification, load_product_description
+
+logger = logging.getLogger(__name__)
+
+
+def _templates_to_generate(document, section_templates, force=False, product_digest=None, excerpts=None):
+    """
+    再生成が必要なセクションテンプレートとそのフィンガープリントを取得する
+
+    既存のセクションのフィンガープリントが現在の入力と一致するテンプレートは除外する。
+
+    Returns:
+        tuple: (テンプレートのリスト, {テンプレートID: フィンガープリント})
+    """
+    fingerprints = {
+        template.id: section_fingerprint(document.product_description, template, product_digest=product_digest,
+                                         excerpts=excerpts)
+        for template in section_templates
+    }
+    if force:
+        return list(section_templates), fingerprints
+
+    existing = dict(
+        document.sections.filter(template__isnull=False, is_partial=False).values_list('template_id', 'input_fingerprint')
+    )
+    templates = [
+        template for template in section_templates
+        if existing.get(template.id) != fingerprints[template.id]
+    ]
+    return templates, fingerprints
+
+
+def _save_sections(document, section_templates, sections_content, fingerprints):
+    """
+    生成されたセクションを保存する
+
+    sections_content に含まれるテンプレートのセクションを置き換え、テンプレートが
+    削除されたセクションと途中の内容のセクションを削除する。それ以外の既存セクションはそのまま残す。
+    置き換えは1つのトランザクション内で一括して行うため、閲覧中のユーザーに
+    途中の状態が見えることはなく、クエリ数はセクション数に依存しない。
+    """
+    kept_template_ids = [template.id for template in section_templates if template.id not in sections_content]
+    orders = {template.id: template.order for template in section_templates}
+
+    new_sections = [
+        DocumentSection(
+            document=document,
+            template=template,
+            title=template.title,
+            content=sections_content[template.id],
+            order=template.order,
+            # 失敗したセクションは次回の生成で再試行する
+            input_fingerprint='' if is_error_content(sections_content[template.id]) else fingerprints[template.id]
+        )
+        for template in section_templates
+        if template.id in sections_content
+    ]
+
+    with transaction.atomic():
+        document.sections.exclude(template_id__in=kept_template_ids, is_partial=False).delete()
+
+        # 残したセクションの順序をテンプレートに合わせる
+        reordered_sections = []
+        for section in document.sections.only('id', 'template_id', 'order'):
+            if section.order != orders[section.template_id]:
+                section.order = orders[section.template_id]
+                reordered_sections.append(section)
+        if reordered_sections:
+            DocumentSection.objects.bulk_update(reordered_sections, ['order'])
+
+        DocumentSection.objects.bulk_create(new_sections)
 
 
 @shared_task
-def generate_document_sections_task(document_id, task_id):
+def generate_document_sections_task(document_id, task_id, fanout=None, use_cache=True, force=False, stream=None,
+                                    strategy=None):
     """
     ドキュメントセクションを生成するCeleryタスク
+
+    入力が変わっていないセクションは再生成しない。force が真の場合はすべて再生成する。
+    fanout が真の場合（省略時は settings.GENERATION_FANOUT）、セクションごとに
+    サブタスクを作成し、chord のコールバックでドキュメントを組み立てる。
+    use_cache が偽の場合はLLMレスポンスキャッシュを使用せずに再生成する（force が真の場合も使用しない）。
+    stream が真の場合（省略時は settings.GENERATION_STREAMING）、受信途中の内容を
+    進捗状況として配信し、一定間隔で途中のセクションとして保存する（fanout 時は無効）。
+    strategy が 'combined' の場合（省略時は settings.GENERATION_STRATEGY）、複数のセクションを
+    1回のリクエストでまとめて生成する（fanout・stream 時は無効）。
     """
+    if fanout is None:
+        fanout = getattr(settings, 'GENERATION_FANOUT', False)
+    if stream is None:
+        stream = getattr(settings, 'GENERATION_STREAMING', False)
+    if strategy is None:
+        strategy = getattr(settings, 'GENERATION_STRATEGY', 'per_section')
+    if force:
+        # キャッシュキーはフィンガープリントと同じため、キャッシュを使用すると同じ内容が返される
+        use_cache = False
+
     try:
         # タスクと関連するドキュメントを取得
-        task = GenerationTask.objects.get(id=task_id)
-        document = Document.objects.get(id=document_id)
-        
-        # タスクのステータスを更新
-        task.status = 'processing'
-        task.save()
-        
-        # 既存のセクションを削除
-        document.sections.all().delete()
-        
+        task = GenerationTask.objects.select_related('document__project').get(id=task_id)
+        document = task.document
         # プロジェクトのセクションテンプレートを取得
-        section_templates = document.project.section_templates.all()
-        
-        # 合計セクション数を設定
-        total_sections = section_templates.count()
+        section_templates = list(document.project.get_section_templates())
+
+        # 仕様書ファイルのテキストを製品説明に含める（長い仕様書はテンプレートごとの抜粋にする）
+        load_product_description(document, section_templates)
+        excerpts = document.specification_excerpts
+
+        # 長い製品説明は要約してからセクションのプロンプトに含める（製品説明が変わるまで再利用する）
+        product_digest = ensure_product_digest(document, use_cache=use_cache)
+
+        # 入力が変わったセクションのみを生成対象とする
+        templates_to_generate, fingerprints = _templates_to_generate(
+            document, section_templates, force, product_digest, excerpts
+        )
+
+        # タスクのステータスと合計セクション数を設定
+        total_sections = len(templates_to_generate)
+        task.status = 'processing'
         task.total_sections = total_sections
-        task.save()
-        
+        task.save(update_fields=['status', 'total_sections', 'updated_at'])
+
+        # 途中の進捗状況はキャッシュにのみ書き込む
+        progress_store = GenerationProgress(task, section_ids=[template.id for template in templates_to_generate])
+        progress_store.update(force=True)
+
+        if fanout and total_sections > 0:
+            # セクションごとのサブタスクを並列に実行し、完了後にドキュメントを組み立てる
+            header = [
+                generate_section_task.s(document_id, task_id, template.id, use_cache=use_cache)
+                for template in templates_to_generate
+            ]
+            callback = assemble_document_task.s(document_id, task_id).on_error(
+                mark_generation_failed_task.si(task_id)
+            )
+            chord(header)(callback)
+            return
+
         if total_sections == 0:
-            task.status = 'completed'
-            task.progress = 100
-            task.save()
+            # テンプレートが削除されたセクションのみ整理する
+            _save_sections(document, section_templates, {}, fingerprints)
+            _complete_task(task)
             return
-        
+
+        # セクションごとの進捗状況（0-100）
+        # セクションは並列に生成されるため、インデックスごとに保持して全体を集計する
+        section_progress = [0] * total_sections
+
         # 進捗状況を更新する関数
-        def update_progress(section_index, section_progress):
-            # セクションごとの進捗状況を計算
-            # section_indexは0から始まるので、完了したセクション数は+1する
-            completed_sections = section_index
-            
-            # 現在処理中のセクションの進捗状況（0-100）
-            current_section_progress = section_progress
-            
+        def update_progress(section_index, progress):
+            section_progress[section_index] = progress
+            progress_store.state['sections'][templates_to_generate[section_index].id] = progress
+
+            # 完了したセクション数
+            completed_sections = sum(1 for p in section_progress if p >= 100)
+
             # 全体の進捗状況を計算
-            # 完了したセクションは100%として計算し、現在処理中のセクションは部分的に計算
-            overall_progress = int(((completed_sections * 100) + current_section_progress) / total_sections)
-            
-            # 進捗状況を更新
-            task.completed_sections = completed_sections
-            task.progress = min(overall_progress, 99)  # 完全に完了するまでは99%まで
-            task.save()
-        
-        # OpenAI APIを使用してセクションを生成（進捗状況を更新しながら）
-        sections_content = generate_test_document_with_progress(
-            document.product_description, 
-            section_templates,
-            update_progress
-        )
-        
-        # 生成されたセクションを保存
-        for i, template in enumerate(section_templates):
-            content = sections_content.get(template.id, '')
-            DocumentSection.objects.create(
-                document=document,
-                template=template,
-                title=template.title,
-                content=content,
-                order=template.order
+            overall_progress = int(sum(section_progress) / total_sections)
+
+            # 進捗状況を更新（一定間隔でまとめてキャッシュに書き込まれる）
+            progress_store.update(
+                completed_sections=completed_sections,
+                progress=min(overall_progress, 99)  # 完全に完了するまでは99%まで
+            )
+
+        if strategy == 'combined' and not stream:
+            # 複数のセクションをまとめて生成（解析できなかったセクションはセクションごとに生成）
+            sections_content = generate_test_document_combined(
+                document.product_description,
+                templates_to_generate,
+                update_progress,
+                use_cache=use_cache,
+                product_digest=product_digest,
+                excerpts=excerpts
             )
-        
+        else:
+            partial_callback = None
+            if stream:
+                partial_callback = _PartialSectionWriter(document, templates_to_generate, progress_store)
+
+            # OpenAI APIを使用してセクションを生成（進捗状況を更新しながら）
+            sections_content = generate_test_document_with_progress(
+                document.product_description,
+                templates_to_generate,
+                update_progress,
+                use_cache=use_cache,
+                partial_callback=partial_callback,
+                product_digest=product_digest,
+                excerpts=excerpts
+            )
+
+        # 生成されたセクションを保存
+        _save_sections(document, section_templates, sections_content, fingerprints)
+
         # タスクを完了としてマーク
-        task.status = 'completed'
-        task.progress = 100
-        task.completed_sections = total_sections
-        task.save()
-        
+        _complete_task(task)
+
     except Exception as e:
         # エラーが発生した場合
         if task_id:
-            task = GenerationTask.objects.get(id=task_id)
-            task.status = 'failed'
-            task.error_message = str(e)
-            task.save()
-        raise 
\ No newline at end of file
+            _fail_task(task_id, str(e))
+        raise
+
+
+class _PartialSectionWriter:
+    """
+    ストリーミング生成中の内容を進捗状況に反映し、途中のセクションとして保存する
+
+    受信した差分はセクションごとのリストにため、連結は進捗状況への反映とデータベースへの保存の
+    タイミングでのみ行う（受信のたびに全体を連結しない）。
+    進捗状況への反映は settings.GENERATION_PROGRESS_INTERVAL 秒、データベースへの保存は
+    settings.GENERATION_PARTIAL_SAVE_INTERVAL 秒以上経過した場合にのみ行う。
+    生成が中断された場合も、途中までの内容が残る。
+    再試行により受信済みの内容が破棄された場合は、再試行の回数を partial_attempts に記録する。
+    """
+
+    def __init__(self, document, templates, progress_store):
+        self.templates = templates
+        self.progress_store = progress_store
+        self.interval = getattr(settings, 'GENERATION_PARTIAL_SAVE_INTERVAL', 2.0)
+        self.parts = [[] for _ in templates]
+        self.last_published = {}
+        self.last_saved = {}
+        self.progress_store.state['partial'] = {}
+        self.progress_store.state['partial_attempts'] = {}
+
+        # 途中の内容を保存するセクションを作成する（前回中断時のものは置き換える）
+        with transaction.atomic():
+            document.sections.filter(is_partial=True).delete()
+            sections = DocumentSection.objects.bulk_create([
+                DocumentSection(document=document, template=template, title=template.title,
+                                order=template.order, is_partial=True)
+                for template in templates
+            ])
+        self.section_ids = [section.id for section in sections]
+
+    def __call__(self, section_index, delta):
+        template_id = self.templates[section_index].id
+        now = time.monotonic()
+        if delta is None:
+            # 再試行で最初から受信し直すため、受信済みの内容を破棄する
+            self.parts[section_index] = []
+            attempts = self.progress_store.state['partial_attempts']
+            attempts[template_id] = attempts.get(template_id, 0) + 1
+            self.progress_store.state['partial'][template_id] = ''
+            self.progress_store.update(force=True)
+            DocumentSection.objects.filter(id=self.section_ids[section_index]).update(content='')
+            self.last_published[section_index] = self.last_saved[section_index] = now
+            return
+
+        self.parts[section_index].append(delta)
+        last_published = self.last_published.get(section_index)
+        publish = last_published is None or now - last_published >= self.progress_store.min_interval
+        last_saved = self.last_saved.get(section_index)
+        save = last_saved is None or now - last_saved >= self.interval
+        if not (publish or save):
+            return
+
+        content = ''.join(self.parts[section_index])
+        if publish:
+            self.progress_store.state['partial'][template_id] = content
+            self.progress_store.update()
+            self.last_published[section_index] = now
+        if save:
+            DocumentSection.objects.filter(id=self.section_ids[section_index]).update(content=content)
+            self.last_saved[section_index] = now
+
+
+def _complete_task(task):
+    """
+    タスクを完了としてマークし、最終状態をデータベースとキャッシュに保存する
+    """
+    task.status = 'completed'
+    task.progress = 100
+    task.completed_sections = task.total_sections
+    task.save(update_fields=['status', 'progress', 'completed_sections', 'updated_at'])
+    GenerationProgress(task).update(force=True)
+
+
+def _fail_task(task_id, error_message):
+    """
+    タスクを失敗としてマークし、最終状態をデータベースとキャッシュに保存する
+    """
+    task = GenerationTask.objects.select_related('document__project').get(id=task_id)
+    task.status = 'failed'
+    task.error_message = error_message
+    task.save(update_fields=['status', 'error_message', 'updated_at'])
+    GenerationProgress(task).update(force=True)
+
+
+@shared_task
+def generate_section_task(document_id, task_id, template_id, use_cache=True):
+    """
+    1つのセクションを生成するCeleryサブタスク
+
+    完了したセクション数はキャッシュ上のカウンターで集計するため、
+    他のサブタスクと競合せず、データベースへの書き込みも発生しない。
+    """
+    document = Document.objects.only(
+        'product_description', 'product_digest', 'product_digest_hash', 'specification_status',
+        'specification_length',
+    ).get(id=document_id)
+    template = SectionTemplate.objects.get(id=template_id)
+    load_product_description(document, [template])
+    # 要約は親タスクで作成済み
+    product_digest = get_product_digest(document)
+
+    GenerationProgress.set_section(task_id, template_id, 10)
+
+    excerpts = document.specification_excerpts
+    fingerprint = section_fingerprint(document.product_description, template, product_digest=product_digest,
+                                      excerpts=excerpts)
+    content = generate_section(document.product_description, template, use_cache=use_cache,
+                               product_digest=product_digest, excerpts=excerpts)
+
+    GenerationProgress.set_section(task_id, template_id, 100)
+    GenerationProgress.increment_completed(task_id)
+
+    return {'template_id': template_id, 'content': content, 'fingerprint': fingerprint}
+
+
+@shared_task
+def assemble_document_task(results, document_id, task_id):
+    """
+    サブタスクの結果からドキュメントを組み立てる chord コールバック
+    """
+    task = GenerationTask.objects.select_related('document__project').get(id=task_id)
+    document = task.document
+    section_templates = list(document.project.get_section_templates())
+
+    sections_content = {result['template_id']: result['content'] for result in results}
+    fingerprints = {result['template_id']: result['fingerprint'] for result in results}
+
+    # 再生成したセクションを置き換える
+    _save_sections(document, section_templates, sections_content, fingerprints)
+
+    # タスクを完了としてマーク
+    _complete_task(task)
+
+
+@shared_task
+def mark_generation_failed_task(task_id):
+    """
+    サブタスクまたはコールバックが失敗した場合に生成タスクを失敗としてマークする
+    """
+    _fail_task(task_id, 'セクションの生成中にエラーが発生しました。')
+
+
+class _BatchDocument:
+    """
+    一括生成中の1つのドキュメントの生成対象と結果
+    """
+
+    def __init__(self, task):
+        self.task = task
+        self.document = task.document
+        self.fingerprints = {}
+        self.templates = []
+        self.contents = {}
+
+    @property
+    def done(self):
+        return len(self.contents) == len(self.templates)
+
+
+def _plan_batch(batch, force=False, use_cache=True):
+    """
+    一括生成で再生成が必要なセクションを集める
+
+    セクションテンプレートの取得とプロンプトのテンプレート部分の作成はバッチ全体で1回だけ行い、
+    既存セクションのフィンガープリントは1クエリで取得する。
+    製品説明の要約が必要なドキュメントは、ここで要約を作成する。
+
+    Returns:
+        tuple: (セクションテンプレートのリスト, _BatchDocument のリスト,
+                [(_BatchDocument, テンプレート, プロンプト)])
+    """
+    tasks = list(batch.tasks.select_related('document').order_by('id'))
+    section_templates = list(batch.project.get_section_templates())
+    template_prompts = {template.id: build_template_prompt(template) for template in section_templates}
+
+    existing = {
+        (document_id, template_id): fingerprint
+        for document_id, template_id, fingerprint in DocumentSection.objects.filter(
+            document__in=[task.document_id for task in tasks], template__isnull=False, is_partial=False,
+        ).values_list('document_id', 'template_id', 'input_fingerprint')
+    }
+
+    documents = []
+    jobs = []
+    for task in tasks:
+        item = _BatchDocument(task)
+        load_product_description(item.document, section_templates)
+        product_digest = ensure_product_digest(item.document, use_cache=use_cache)
+        for template in section_templates:
+            prompt = build_section_prompt(item.document.product_description, template,
+                                          template_prompts[template.id], product_digest,
+                                          item.document.specification_excerpts)
+            fingerprint = item.fingerprints[template.id] = completion_cache_key(prompt)
+            if force or existing.get((item.document.id, template.id)) != fingerprint:
+                item.templates.append(template)
+                jobs.append((item, template, prompt))
+        item.task.status = 'processing'
+        item.task.total_sections = len(item.templates)
+        documents.append(item)
+
+    GenerationTask.objects.bulk_update([item.task for item in documents], ['status', 'total_sections'])
+    batch.status = 'processing'
+    batch.total_sections = len(jobs)
+    batch.save(update_fields=['status', 'total_sections', 'updated_at'])
+    return section_templates, documents, jobs
+
+
+def _finish_batch_document(batch, item, section_templates):
+    """
+    セクションが揃ったドキュメントを保存し、バッチの集計に反映する
+    """
+    _save_sections(item.document, section_templates, item.contents, item.fingerprints)
+    _complete_task(item.task)
+    batch.completed_documents += 1
+    if any(is_error_content(content) for content in item.contents.values()):
+        batch.failed_documents += 1
+
+
+def _complete_batch(batch, progress_store=None):
+    """
+    一括生成を完了としてマークし、最終状態をデータベースとキャッシュに保存する
+    """
+    batch.status = 'completed'
+    batch.progress = 100
+    batch.save(update_fields=['status', 'progress', 'completed_documents', 'failed_documents',
+                              'completed_sections', 'updated_at'])
+    (progress_store or BatchProgress(batch)).update(
+        force=True, status='completed', progress=100, completed_documents=batch.completed_documents,
+        failed_documents=batch.failed_documents, completed_sections=batch.completed_sections,
+    )
+
+
+@shared_task
+def generate_batch_task(batch_id, use_cache=True, force=False):
+    """
+    プロジェクト内の複数のドキュメントを一括生成するCeleryタスク
+
+    すべてのドキュメントのセクションを1つのスレッドプールで生成し、同時に送信するリクエスト数は
+    batch.max_concurrency で制限する。ドキュメントはすべてのセクションが揃った時点で保存する。
+    入力が変わっていないセクションは再生成しない。force が真の場合はLLMレスポンスキャッシュを使用せずにすべて再生成する。
+    """
+    if force:
+        use_cache = False
+    try:
+        batch = GenerationBatch.objects.select_related('project').get(id=batch_id)
+        section_templates, documents, jobs = _plan_batch(batch, force, use_cache)
+        progress_store = BatchProgress(batch)
+        progress_store.update(force=True)
+
+        def finish_document(item):
+            _finish_batch_document(batch, item, section_templates)
+            progress_store.update(
+                completed_documents=batch.completed_documents,
+                failed_documents=batch.failed_documents,
+            )
+
+        def on_result(index, content):
+            item, template, _ = jobs[index]
+            item.contents[template.id] = content
+            batch.completed_sections += 1
+            progress_store.update(
+                completed_sections=batch.completed_sections,
+                progress=min(batch.completed_sections * 100 // batch.total_sections, 99),
+            )
+            if item.done:
+                finish_document(item)
+
+        # 再生成するセクションがないドキュメント
+        for item in documents:
+            if not item.templates:
+                finish_document(item)
+
+        generate_completions([prompt for _, _, prompt in jobs], max_concurrency=batch.max_concurrency,
+                             use_cache=use_cache, result_callback=on_result)
+        _complete_batch(batch, progress_store)
+
+    except Exception as e:
+        _fail_batch(batch_id, str(e))
+        raise
+
+
+def _custom_id(task, template):
+    return f'{task.id}-{template.id}'
+
+
+@shared_task
+def submit_deferred_batch_task(batch_id, force=False):
+    """
+    一括生成のセクションのプロンプトをJSONLのバッチジョブとしてプロバイダのバッチAPIに送信する
+
+    結果は poll_generation_batches_task が取り込むため、ワーカーは応答を待たずに終了する。
+    送信したリクエストはファイルストレージに保存し、取り込み時にプロンプトとの対応付けに使用する。
+    force が真の場合は取り込んだ結果もLLMレスポンスキャッシュに保存しない。
+    """
+    try:
+        batch = GenerationBatch.objects.select_related('project').get(id=batch_id)
+        backend = get_llm_backend()
+        if not backend.supports_batch:
+            raise ValueError(f'{type(backend).__name__} はバッチAPIに対応していません。')
+
+        batch.use_cache = not force
+        section_templates, documents, jobs = _plan_batch(batch, force, batch.use_cache)
+        for item in documents:
+            if not item.templates:
+                _finish_batch_document(batch, item, section_templates)
+
+        if not jobs:
+            _complete_batch(batch)
+            return
+
+        requests = ''.join(
+            json.dumps(build_batch_request(_custom_id(item.task, template), prompt), ensure_ascii=False) + '\n'
+            for item, template, prompt in jobs
+        ).encode('utf-8')
+        batch.request_file = default_storage.save(f'generation_batches/{batch.id}/requests.jsonl',
+                                                  ContentFile(requests))
+        batch.provider_batch_id = backend.submit_batch(requests)
+        batch.save(update_fields=['request_file', 'provider_batch_id', 'use_cache', 'completed_documents',
+                                  'failed_documents', 'updated_at'])
+        BatchProgress(batch).update(force=True)
+
+    except Exception as e:
+        _fail_batch(batch_id, str(e))
+        raise
+
+
+@shared_task
+def poll_generation_batches_task():
+    """
+    送信済みのバッチジョブの状態を確認し、完了したものの結果を取り込む（定期実行）
+
+    Returns:
+        int: 結果を取り込んだ一括生成の数
+    """
+    batch_ids = GenerationBatch.objects.filter(
+        mode='deferred', status='processing',
+    ).exclude(provider_batch_id='').values_list('id', flat=True)
+
+    ingested = 0
+    for batch_id in batch_ids:
+        try:
+            ingested += _poll_deferred_batch(batch_id)
+        except Exception:
+            # 一時的なエラーの可能性があるため、次回のポーリングで再試行する
+            logger.exception('バッチジョブの結果を取り込めませんでした: %s', batch_id)
+    return ingested
+
+
+def _poll_deferred_batch(batch_id):
+    """
+    1つのバッチジョブの状態を確認し、完了していれば結果をセクションとして保存する
+
+    プロバイダへの問い合わせと結果ファイルの取得はトランザクションの外で行い、
+    行をロックするのは結果の保存とステータスの更新の間のみにする。
+    LLM呼び出しの記録はトランザクションのコミット後に保存する。
+
+    Returns:
+        bool: 結果を取り込んだかどうか
+    """
+    batch = GenerationBatch.objects.filter(id=batch_id, status='processing').first()
+    if batch is None:
+        return False
+
+    backend = get_llm_backend()
+    state = backend.get_batch(batch.provider_batch_id)
+    if state['status'] == 'in_progress':
+        return False
+    if state['status'] == 'failed':
+        _fail_batch(batch.id, state['error'] or 'バッチジョブが失敗しました。')
+        return False
+
+    with default_storage.open(batch.request_file, 'rb') as request_file:
+        prompts = {}
+        for line in request_file:
+            request = json.loads(line)
+            prompts[request['custom_id']] = request['body']['messages'][-1]['content']
+    results = list(backend.get_batch_results(state))
+
+    with transaction.atomic():
+        # 複数のワーカーが同時に取り込まないようにロックし、取り込み済みでないことを確認し直す
+        batch = GenerationBatch.objects.select_for_update(skip_locked=True).select_related('project').filter(
+            id=batch_id, status='processing',
+        ).first()
+        if batch is None:
+            return False
+
+        contents, records = ingest_batch_results(prompts, results, use_cache=batch.use_cache)
+
+        section_templates = list(batch.project.get_section_templates())
+        items = []
+        for task in batch.tasks.select_related('document').exclude(status='completed'):
+            item = _BatchDocument(task)
+            for template in section_templates:
+                custom_id = _custom_id(task, template)
+                if custom_id in contents:
+                    item.contents[template.id] = contents[custom_id]
+                    item.fingerprints[template.id] = completion_cache_key(prompts[custom_id])
+            items.append(item)
+
+        for item in items:
+            # 送信後に削除されたテンプレートのセクションは保存しない
+            _finish_batch_document(batch, item, section_templates)
+        batch.completed_sections = len(contents)
+        _complete_batch(batch)
+
+    request_log = get_request_log()
+    for record in records:
+        request_log.record(*record)
+    return True
+
+
+def _fail_batch(batch_id, error_message):
+    """
+    一括生成と、完了していないドキュメントの生成タスクを失敗としてマークする
+    """
+    batch = GenerationBatch.objects.get(id=batch_id)
+    batch.status = 'failed'
+    batch.error_message = error_message
+    batch.save(update_fields=['status', 'error_message', 'updated_at'])
+    BatchProgress(batch).update(force=True)
+    for task_id in batch.tasks.exclude(status='completed').values_list('id', flat=True):
+        _fail_task(task_id, error_message)
+
+
+@shared_task
+def export_project_task(job_id, project_id, export_format):
+    """
+    プロジェクトのすべてのドキュメントをエクスポートし、ファイルストレージに保存する
+
+    出力は一時ファイルに書き込んでから保存するため、ドキュメント数が多くてもメモリに保持しない。
+
+    Args:
+        job_id (str): エクスポートジョブID
+        project_id (int): プロジェクトID
+        export_format (str): EXPORT_FORMATS のキー
+    """
+    set_export_state(job_id, status='processing')
+    try:
+        project = Project.objects.get(id=project_id)
+        documents = project.documents.all()
+        extension = EXPORT_FORMATS[export_format]['extension']
+        with tempfile.TemporaryFile() as output:
+            for chunk in export_documents(documents, export_format, title=project.name):
+                output.write(chunk)
+            output.seek(0)
+            path = default_storage.save(f'exports/{project_id}/{job_id}.{extension}', File(output))
+    except Exception as e:
+        set_export_state(job_id, status='failed', error_message=str(e))
+        raise
+    set_export_state(job_id, status='completed', path=path)
+    return path
+
+
+@shared_task
+def extract_specification_task(document_id):
+    """
+    アップロードされた仕様書ファイルからテキストを抽出するCeleryタスク
+
+    抽出したテキストは SpecificationChunk に分割して保存する。ファイルは少しずつ読み込むため、
+    大きな仕様書でもワーカーのメモリ使用量は一定に収まる。
+    """
+    documents = Document.objects.filter(id=document_id)
+    documents.update(specification_status='processing', specification_error='')
+    try:
+        document = documents.only('specification_file').get()
+        with transaction.atomic():
+            length = extract_specification(document)
+        documents.update(specification_status='completed', specification_length=length)
+    except Exception as e:
+        logger.exception('仕様書ファイルの抽出に失敗しました: document=%s', document_id)
+        documents.update(specification_status='failed', specification_error=str(e))
+        raise
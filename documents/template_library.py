@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models import Case, When
+
+from .default_templates import DEFAULT_TEMPLATES
+
+# ライブラリのテンプレートとしてコピー・比較するフィールド
+LIBRARY_FIELDS = ['title', 'description', 'form_type', 'content_guidelines', 'ai_prompt', 'order']
+
+
+def sync_template_library(template_model=None):
+    """
+    default_templates.py の内容で共有テンプレートライブラリを作成・更新する
+
+    テンプレートタイプと order をキーに、内容が変わったテンプレートのみ更新してバージョンを上げる。
+    更新内容はライブラリを参照しているすべてのプロジェクトに反映される。
+
+    Args:
+        template_model: SectionTemplate モデル（データマイグレーションでは過去のモデルを渡す）
+
+    Returns:
+        dict: 作成・更新・削除したテンプレート数
+    """
+    if template_model is None:
+        from .models import SectionTemplate
+        template_model = SectionTemplate
+
+    existing = {
+        (template.library_type, template.order): template
+        for template in template_model.objects.filter(project__isnull=True)
+    }
+    created = []
+    updated = []
+    for library_type, template_data in DEFAULT_TEMPLATES.items():
+        for section_data in template_data['sections']:
+            values = {field: section_data[field] for field in LIBRARY_FIELDS}
+            template = existing.pop((library_type, section_data['order']), None)
+            if template is None:
+                created.append(template_model(library_type=library_type, **values))
+            elif any(getattr(template, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(template, field, value)
+                template.version += 1
+                updated.append(template)
+
+    with transaction.atomic():
+        template_model.objects.bulk_create(created)
+        template_model.objects.bulk_update(updated, LIBRARY_FIELDS + ['version'])
+        # default_templates.py から削除されたテンプレート
+        template_model.objects.filter(pk__in=[template.pk for template in existing.values()]).delete()
+
+    return {'created': len(created), 'updated': len(updated), 'deleted': len(existing)}
+
+
+def materialize_templates(project):
+    """
+    共有ライブラリのテンプレートをプロジェクト専用のテンプレートとしてコピーする（コピーオンライト）
+
+    プロジェクトのテンプレートを変更する前に呼び出す。既存のドキュメントセクションはコピー後の
+    テンプレートを参照するように付け替えるため、内容が同じセクションは再生成されない。
+    ライブラリを参照していないプロジェクトでは何もしない。
+
+    Args:
+        project (Project): プロジェクト
+
+    Returns:
+        dict: {ライブラリのテンプレートID: コピーしたテンプレート}
+    """
+    from .models import Project, SectionTemplate, DocumentSection
+
+    if not project.uses_template_library:
+        return {}
+
+    with transaction.atomic():
+        # 同時にカスタマイズされた場合に二重にコピーしないようにロックする
+        locked = Project.objects.select_for_update().only('uses_template_library').get(pk=project.pk)
+        if not locked.uses_template_library:
+            project.uses_template_library = False
+            return {}
+
+        library = list(project.get_section_templates())
+        copies = SectionTemplate.objects.bulk_create([
+            SectionTemplate(
+                project=project,
+                # バージョンを引き継ぎ、ライブラリのバージョンを元にした編集を受け付ける
+                version=template.version,
+                use_product_digest=template.use_product_digest,
+                **{field: getattr(template, field) for field in LIBRARY_FIELDS}
+            )
+            for template in library
+        ])
+        replaced = {template.id: copy for template, copy in zip(library, copies)}
+
+        if replaced:
+            DocumentSection.objects.filter(document__project=project, template_id__in=list(replaced)).update(
+                template_id=Case(*[When(template_id=old_id, then=copy.id) for old_id, copy in replaced.items()])
+            )
+
+        Project.objects.filter(pk=project.pk).update(uses_template_library=False)
+        project.uses_template_library = False
+
+    return replaced
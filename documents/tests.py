@@ -1,8 +1,38 @@
-from django.test import TestCase, Client
+import io
+import json
+import tempfile
+import zipfile
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import openai
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, Client, AsyncClient, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
-from documents.models import Project, SectionTemplate, Document, DocumentSection, GenerationTask
+from core.llm_cache import get_llm_cache
+from core.models import OpenAIRequest
+from core.llm_backends import get_llm_backend
+from core.request_log import get_request_log
+from core.testing import FlushRequestLogMixin, without_rate_limit
+from core.utils import build_template_prompt, completion_cache_key
+from documents.models import Project, SectionTemplate, Document, DocumentSection, GenerationTask, GenerationBatch
 from documents.forms import ProjectForm, SectionTemplateForm, DocumentForm, DocumentSectionForm
+from documents.progress import GenerationProgress
+from documents.default_templates import DEFAULT_TEMPLATES
+from documents.template_library import sync_template_library
+from documents.rendering import render_content, render_sections
+from documents.pagination import keyset_paginate, annotate_project_counts, annotate_document_counts
+from documents.export import set_export_state
+from documents.tasks import export_project_task, poll_generation_batches_task, generate_document_sections_task, generate_section_task, _save_sections
 
 # Model Tests
 class ProjectModelTest(TestCase):
@@ -108,3 +138,1189 @@ class ProjectViewsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'documents/project_detail.html')
         self.assertContains(response, 'テストプロジェクト')
+
+# Query Budget Tests
+# URL名ごとのリクエスト（メソッド, URLの引数, POSTデータ）。f はテストケース（作成したデータを参照する）
+QUERY_BUDGET_REQUESTS = {
+    # documents/urls.py
+    'project_list': ('get', lambda f: {}, None),
+    'project_create': ('get', lambda f: {}, None),
+    'project_detail': ('get', lambda f: {'pk': f.project.pk}, None),
+    'project_update': ('get', lambda f: {'pk': f.project.pk}, None),
+    'project_delete': ('get', lambda f: {'pk': f.project.pk}, None),
+    'section_template_create': ('get', lambda f: {'project_pk': f.project.pk}, None),
+    'section_template_update': ('get', lambda f: {'pk': f.template.pk}, None),
+    'section_template_delete': ('get', lambda f: {'pk': f.template.pk}, None),
+    'add_section_template': ('post', lambda f: {'project_pk': f.project.pk}, lambda f: {'title': '追加'}),
+    'bulk_edit_section_templates': (
+        'json', lambda f: {'project_pk': f.project.pk},
+        lambda f: {'update': [
+            {'id': template.id, 'version': template.version, 'order': template.order + 1}
+            for template in f.project.section_templates.all()
+        ]},
+    ),
+    'customize_section_templates': ('post', lambda f: {'project_pk': f.project.pk}, lambda f: {}),
+    'document_create': ('get', lambda f: {'project_pk': f.project.pk}, None),
+    'document_detail': ('get', lambda f: {'pk': f.document.pk}, None),
+    'document_update': ('get', lambda f: {'pk': f.document.pk}, None),
+    'document_delete': ('get', lambda f: {'pk': f.document.pk}, None),
+    'generate_document_sections': ('get', lambda f: {'pk': f.document.pk}, None),
+    'document_generation_status': ('get', lambda f: {'pk': f.document.pk, 'task_id': f.task.pk}, None),
+    'get_generation_status': ('get', lambda f: {'task_id': f.task.pk}, None),
+    'document_section_update': ('get', lambda f: {'pk': f.section.pk}, None),
+    'generate_batch': ('get', lambda f: {'project_pk': f.project.pk}, None),
+    'generation_batch_status': ('get', lambda f: {'pk': f.batch.pk}, None),
+    'get_generation_batch_status': ('get', lambda f: {'batch_id': f.batch.pk}, None),
+    'export_document': ('get', lambda f: {'pk': f.document.pk, 'export_format': 'docx'}, None),
+    'export_project': ('post', lambda f: {'pk': f.project.pk}, lambda f: {'format': 'html'}),
+    'export_status': ('get', lambda f: {'job_id': f.export_job_id}, None),
+    'export_download': ('get', lambda f: {'job_id': f.export_job_id}, None),
+    # core/urls.py
+    'home': ('get', lambda f: {}, None),
+    'dashboard': ('get', lambda f: {}, None),
+    # accounts/urls.py
+    'signup': ('get', lambda f: {}, None),
+    'login': ('get', lambda f: {}, None),
+    'logout': ('post', lambda f: {}, lambda f: {}),
+}
+
+# 計測しないURL（理由）
+QUERY_BUDGET_EXCLUDED = {
+    # 非同期のストリーミングレスポンス。GenerationProgressTest でキャッシュのみを読むことを確認している
+    'generation_events',
+}
+
+# 一括処理を行うURL。SQLiteではパラメータ数の上限により1000件の一括処理が複数のクエリに分割されるため、
+# 少数の件数ではクエリ数が同じであること、1000件でも件数に比例しないことのみを確認する
+QUERY_BUDGET_BATCHED = {
+    'bulk_edit_section_templates',
+}
+
+
+def use_temporary_media_root(test):
+    """
+    テスト中のファイルストレージの保存先を一時ディレクトリにする
+    """
+    media_root = tempfile.TemporaryDirectory()
+    test.addCleanup(media_root.cleanup)
+    override = override_settings(MEDIA_ROOT=media_root.name)
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+                   CELERY_TASK_ALWAYS_EAGER=True)
+class QueryBudgetTest(TestCase):
+    """
+    すべてのURLのクエリ数がデータ量に依存しないことを確認するテスト
+
+    データ量を 1 → 10 → 1000 件に増やしながら各URLのクエリ数を記録し、
+    件数によってクエリ数が変わるビュー（N+1）を検出する。
+    """
+
+    SIZES = (1, 10, 1000)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        self.template = SectionTemplate.objects.create(project=self.project, title='セクション', order=1)
+        self.document = Document.objects.create(title='Test Document', project=self.project, created_by=self.user)
+        self.section = DocumentSection.objects.create(document=self.document, template=self.template,
+                                                      title='セクション', content='内容', order=1)
+        self.batch = GenerationBatch.objects.create(project=self.project, created_by=self.user)
+        self.task = GenerationTask.objects.create(document=self.document, batch=self.batch)
+        use_temporary_media_root(self)
+        self.export_job_id = 'query-budget'
+        set_export_state(self.export_job_id, status='pending', owner_id=self.user.id, filename='export.md')
+        export_project_task(self.export_job_id, self.project.pk, 'md')
+
+    def grow(self, size):
+        """
+        プロジェクト・テンプレート・ドキュメント・セクション・生成タスクをそれぞれ size 件にする
+        """
+        count = self.user.projects.count()
+        Project.objects.bulk_create([
+            Project(name=f'Project {i}', owner=self.user) for i in range(count, size)
+        ])
+        count = self.project.section_templates.count()
+        templates = SectionTemplate.objects.bulk_create([
+            SectionTemplate(project=self.project, title=f'セクション{i}', order=i + 1) for i in range(count, size)
+        ])
+        count = self.project.documents.count()
+        Document.objects.bulk_create([
+            Document(title=f'Document {i}', project=self.project, created_by=self.user) for i in range(count, size)
+        ])
+        DocumentSection.objects.bulk_create([
+            DocumentSection(document=self.document, template=template, title=template.title, order=template.order)
+            for template in templates
+        ])
+        count = self.document.generation_tasks.count()
+        GenerationTask.objects.bulk_create([
+            GenerationTask(document=self.document, batch=self.batch) for _ in range(count, size)
+        ])
+
+    def count_queries(self, name):
+        method, kwargs, data = QUERY_BUDGET_REQUESTS[name]
+        url = reverse(name, kwargs=kwargs(self))
+        data = data(self) if data else None
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            if method == 'json':
+                response = self.client.post(url, data, content_type='application/json',
+                                            HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            elif method == 'post':
+                response = self.client.post(url, data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+            else:
+                response = self.client.get(url)
+            # ストリーミングレスポンスは読み込みながらクエリを実行するため、最後まで読み込む
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, f'{name}: {response.status_code}')
+        return len(queries)
+
+    def grows(self, name, values):
+        """
+        データ量に応じてクエリ数が増えているかどうかを判定する
+        """
+        if name in QUERY_BUDGET_BATCHED:
+            return len(set(values[:-1])) > 1 or values[-1] > values[0] + self.SIZES[-1] // 100
+        return len(set(values)) > 1
+
+    def test_every_url_is_covered(self):
+        from accounts.urls import urlpatterns as accounts_urls
+        from core.urls import urlpatterns as core_urls
+        from documents.urls import urlpatterns as documents_urls
+
+        names = {pattern.name for pattern in [*documents_urls, *core_urls, *accounts_urls]}
+        self.assertEqual(names - QUERY_BUDGET_EXCLUDED, set(QUERY_BUDGET_REQUESTS))
+
+    def test_query_counts_do_not_grow_with_data(self):
+        counts = {name: [] for name in QUERY_BUDGET_REQUESTS}
+        for size in self.SIZES:
+            self.grow(size)
+            for name in QUERY_BUDGET_REQUESTS:
+                counts[name].append(self.count_queries(name))
+
+        growing = {name: values for name, values in counts.items() if self.grows(name, values)}
+        self.assertEqual(growing, {}, 'データ量に応じてクエリ数が増えるビュー（件数: %s）' % (self.SIZES,))
+
+
+class BulkEditSectionTemplatesTest(TestCase):
+    """セクションテンプレートの一括編集APIのテスト"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        self.templates = [
+            SectionTemplate.objects.create(project=self.project, title=f'セクション{i}', order=i)
+            for i in range(1, 4)
+        ]
+        self.url = reverse('bulk_edit_section_templates', kwargs={'project_pk': self.project.pk})
+        self.client.force_login(self.user)
+
+    def post(self, payload):
+        return self.client.post(self.url, payload, content_type='application/json',
+                                HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+    def test_reorders_creates_and_deletes_in_one_request(self):
+        first, second, third = self.templates
+        response = self.post({
+            'update': [
+                {'id': first.id, 'version': 1, 'order': 2},
+                {'id': second.id, 'version': 1, 'order': 1, 'title': '概要'},
+            ],
+            'create': [{'title': '付録', 'order': 3}],
+            'delete': [{'id': third.id, 'version': 1}],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(self.project.section_templates.values_list('title', 'order', 'version')),
+            [('概要', 1, 2), ('セクション1', 2, 2), ('付録', 3, 1)],
+        )
+        self.assertEqual(len(response.json()['templates']), 3)
+
+    def test_stale_version_is_rejected_without_changes(self):
+        first, second, _ = self.templates
+        # 他のユーザーが先に更新した
+        self.post({'update': [{'id': first.id, 'version': 1, 'order': 5}]})
+
+        response = self.post({'update': [
+            {'id': second.id, 'version': 1, 'order': 1},
+            {'id': first.id, 'version': 1, 'order': 2},
+        ]})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['conflicts'], [{'id': first.id, 'version': 2}])
+        second.refresh_from_db()
+        self.assertEqual((second.order, second.version), (2, 1))
+
+    def test_other_users_project_is_not_found(self):
+        other = User.objects.create_user(username='other', password='testpassword')
+        self.client.force_login(other)
+
+        response = self.post({'update': [{'id': self.templates[0].id, 'version': 1, 'order': 9}]})
+
+        self.assertEqual(response.status_code, 404)
+
+
+class TemplateLibraryTest(TestCase):
+    """共有テンプレートライブラリのテスト"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+
+    def create_project(self):
+        self.client.post(reverse('project_create'), {'name': 'ライブラリ', 'template_type': 'test_plan'})
+        return Project.objects.get(name='ライブラリ')
+
+    def test_project_creation_references_library(self):
+        with CaptureQueriesContext(connection) as queries:
+            project = self.create_project()
+
+        self.assertTrue(project.uses_template_library)
+        self.assertFalse(project.section_templates.exists())
+        self.assertEqual(
+            [template.title for template in project.get_section_templates()],
+            [section['title'] for section in DEFAULT_TEMPLATES['test_plan']['sections']],
+        )
+        # セクション数分のINSERTは発生しない
+        self.assertLess(sum(1 for query in queries if query['sql'].startswith('INSERT')), 5)
+
+    def test_library_updates_reach_non_customized_projects(self):
+        project = self.create_project()
+        template = project.get_section_templates().first()
+        SectionTemplate.objects.filter(pk=template.pk).update(title='古いタイトル')
+
+        self.assertEqual(sync_template_library(), {'created': 0, 'updated': 1, 'deleted': 0})
+        self.assertEqual(project.get_section_templates().first().title, template.title)
+
+    def test_customizing_copies_templates_and_keeps_sections(self):
+        project = self.create_project()
+        library = list(project.get_section_templates())
+        document = Document.objects.create(title='Doc', project=project, created_by=self.user)
+        section = DocumentSection.objects.create(document=document, template=library[0], title='t', order=1)
+
+        response = self.client.post(
+            reverse('bulk_edit_section_templates', kwargs={'project_pk': project.pk}),
+            {'update': [{'id': library[1].id, 'version': library[1].version, 'order': 1}]},
+            content_type='application/json', HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        project.refresh_from_db()
+        self.assertFalse(project.uses_template_library)
+        self.assertEqual(project.section_templates.count(), len(library))
+        self.assertEqual(project.section_templates.get(pk=response.json()['replaced'][str(library[1].id)]).order, 1)
+        # ライブラリは変更されず、既存のセクションはコピー後のテンプレートを参照する
+        self.assertEqual(SectionTemplate.objects.get(pk=library[1].pk).order, library[1].order)
+        section.refresh_from_db()
+        self.assertEqual(section.template.project, project)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class KeysetPaginationTest(TestCase):
+    """キーセットページネーションのテスト"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.projects = Project.objects.bulk_create([
+            Project(name=f'Project {i}', owner=self.user) for i in range(5)
+        ])
+        # 同じ updated_at のプロジェクトも id で順序が決まる
+        Project.objects.filter(pk__in=[p.pk for p in self.projects[:3]]).update(updated_at=self.projects[0].updated_at)
+
+    def test_pages_cover_all_rows_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page = keyset_paginate(Project.objects.filter(owner=self.user), cursor, per_page=2)
+            seen.extend(project.pk for project in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        expected = Project.objects.filter(owner=self.user).order_by('-updated_at', '-id').values_list('pk', flat=True)
+        self.assertEqual(seen, list(expected))
+
+    def test_invalid_cursor_returns_first_page(self):
+        first = keyset_paginate(Project.objects.all(), per_page=2)
+        page = keyset_paginate(Project.objects.all(), 'not-a-cursor', per_page=2)
+        self.assertEqual([p.pk for p in page], [p.pk for p in first])
+
+    def test_counts_and_status_are_annotated(self):
+        project = self.projects[0]
+        document = Document.objects.create(title='Doc', project=project, created_by=self.user)
+        DocumentSection.objects.create(document=document, title='t', order=1)
+        DocumentSection.objects.create(document=document, title='部分', order=2, is_partial=True)
+        GenerationTask.objects.create(document=document, task_id='old', status='failed')
+        GenerationTask.objects.create(document=document, task_id='new', status='completed')
+
+        annotated = annotate_project_counts(Project.objects.all()).get(pk=project.pk)
+        self.assertEqual(annotated.document_count, 1)
+        self.assertEqual(annotated.last_generation_status, 'completed')
+        annotated = annotate_document_counts(Document.objects.all()).get(pk=document.pk)
+        self.assertEqual(annotated.section_count, 1)
+
+        response = self.client.get(reverse('project_detail', kwargs={'pk': project.pk}))
+        self.assertContains(response, '1 セクション')
+
+    def test_project_list_next_page(self):
+        with mock.patch('documents.views.ProjectListView.per_page', 2):
+            response = self.client.get(reverse('project_list'))
+            self.assertTrue(response.context['projects'].has_next)
+            response = self.client.get(reverse('project_list'), {'cursor': response.context['projects'].next_cursor})
+        self.assertEqual(len(response.context['projects']), 2)
+
+
+class SectionRenderingTest(TestCase):
+    """セクション内容のHTML変換のテスト"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        self.document = Document.objects.create(title='Doc', project=self.project, created_by=self.user)
+
+    def create_section(self, form_type, content):
+        template = SectionTemplate.objects.create(project=self.project, title=form_type, form_type=form_type)
+        return DocumentSection.objects.create(document=self.document, template=template, title=form_type,
+                                              content=content, order=1)
+
+    def test_markdown_is_rendered_and_sanitized(self):
+        html = render_content(
+            '# 見出し\n\n- **重要** <script>alert(1)</script>\n- [リンク](javascript:alert(1))\n\n'
+            '| 項目 | 値 |\n| --- | --- |\n| a | `<b>` |',
+            'markdown',
+        )
+        self.assertIn('<h1>見出し</h1>', html)
+        self.assertIn('<li><strong>重要</strong> &lt;script&gt;', html)
+        self.assertNotIn('<script>', html)
+        self.assertNotIn('href="javascript', html)
+        self.assertIn('<th>項目</th>', html)
+        self.assertIn('<td><code>&lt;b&gt;</code></td>', html)
+
+    def test_list_and_plain_text(self):
+        self.assertEqual(render_content('1. 一つ目\n2. 二つ目', 'list'), '<ul><li>一つ目</li><li>二つ目</li></ul>')
+        self.assertEqual(render_content('a < b\nc\n\nd', 'textarea'), '<p>a &lt; b<br>c</p>\n<p>d</p>')
+
+    def test_rendering_is_cached_by_content(self):
+        section = self.create_section('markdown', '**太字**')
+        with mock.patch('documents.rendering.render_content', wraps=render_content) as render:
+            render_sections([section])
+            render_sections([section])
+            self.assertEqual(render.call_count, 1)
+
+            # 内容が変わると再変換する
+            section.content = '*斜体*'
+            self.assertEqual(render_sections([section])[0].rendered_content, '<p><em>斜体</em></p>')
+            self.assertEqual(render.call_count, 2)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_document_detail_renders_html(self):
+        self.create_section('table', '| A | B |\n|---|---|\n| 1 | 2 |')
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('document_detail', kwargs={'pk': self.document.pk}))
+        self.assertContains(response, '<th>A</th>', html=False)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class ExportTest(TestCase):
+    """ドキュメントのエクスポートのテスト"""
+
+    def setUp(self):
+        cache.clear()
+        use_temporary_media_root(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        template = SectionTemplate.objects.create(project=self.project, title='表', form_type='table')
+        self.documents = [
+            Document.objects.create(title=f'Doc {i}', project=self.project, created_by=self.user) for i in range(2)
+        ]
+        for document in self.documents:
+            DocumentSection.objects.create(document=document, template=template, title='2番目',
+                                           content='| A | B |\n|---|---|\n| 1 | <2> |', order=2)
+            DocumentSection.objects.create(document=document, title='1番目', content='**内容**', order=1)
+            DocumentSection.objects.create(document=document, title='途中', content='...', order=3, is_partial=True)
+
+    def export(self, export_format):
+        response = self.client.get(reverse('export_document', kwargs={
+            'pk': self.documents[0].pk, 'export_format': export_format,
+        }))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_markdown_export(self):
+        response, content = self.export('md')
+        self.assertIn('attachment', response['Content-Disposition'])
+        self.assertEqual(
+            content.decode('utf-8'),
+            '# Doc 0\n\n## 1番目\n\n**内容**\n\n## 2番目\n\n| A | B |\n|---|---|\n| 1 | <2> |\n\n',
+        )
+
+    def test_html_export_is_standalone_and_escaped(self):
+        _, content = self.export('html')
+        html = content.decode('utf-8')
+        self.assertTrue(html.startswith('<!DOCTYPE html>'))
+        self.assertIn('<title>Doc 0</title>', html)
+        self.assertIn('<td>&lt;2&gt;</td>', html)
+        self.assertNotIn('途中', html)
+
+    def test_docx_export_is_valid_archive(self):
+        import zipfile
+        from io import BytesIO
+
+        _, content = self.export('docx')
+        with zipfile.ZipFile(BytesIO(content)) as archive:
+            self.assertIn('word/styles.xml', archive.namelist())
+            body = archive.read('word/document.xml').decode('utf-8')
+        self.assertIn('<w:tbl>', body)
+        self.assertIn('&lt;2&gt;', body)
+        self.assertLess(body.index('1番目'), body.index('2番目'))
+
+    def test_export_streams_incrementally_under_asgi(self):
+        url = reverse('export_document', kwargs={'pk': self.documents[0].pk, 'export_format': 'md'})
+
+        async def collect():
+            async_client = AsyncClient()
+            async_client.cookies = self.client.cookies
+            response = await async_client.get(url)
+            return response, [chunk async for chunk in response.streaming_content]
+
+        response, chunks = async_to_sync(collect)()
+        # 同期イテレータのように送信前にすべて読み込まれず、断片ごとに送信される
+        self.assertTrue(response.is_async)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), self.export('md')[1])
+
+    def test_project_export_job(self):
+        response = self.client.post(reverse('export_project', kwargs={'pk': self.project.pk}), {'format': 'md'})
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual(status['status'], 'completed')
+
+        response = self.client.get(status['download_url'])
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue(content.startswith('# Test Project\n\n## Doc 0'))
+        self.assertIn('## Doc 1', content)
+
+        # 他のユーザーはダウンロードできない
+        other = User.objects.create_user(username='other', password='testpassword')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status['download_url']).status_code, 404)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, SPECIFICATION_CHUNK_SIZE=40)
+class SpecificationUploadTest(FlushRequestLogMixin, TestCase):
+    """仕様書ファイルのアップロードとテキスト抽出のテスト"""
+
+    SPEC = '\n'.join(f'{i}. 機能{i}: ユーザーは設定画面から項目{i}を変更できる。' for i in range(20)) + '\n'
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_media_root(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+
+    def create(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('document_create', kwargs={'project_pk': self.project.pk}), {
+                'title': '仕様書付き', 'product_description': '概要', 'specification_file': upload,
+            })
+
+    def docx(self, paragraphs):
+        body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('word/document.xml', (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}<w:tbl><w:tr><w:tc><w:p><w:r><w:t>表</w:t><w:tab/><w:t>セル</w:t></w:r></w:p>'
+                '</w:tc></w:tr></w:tbl></w:body></w:document>'
+            ))
+        return buffer.getvalue()
+
+    def test_text_file_is_extracted_into_chunks(self):
+        self.create(SimpleUploadedFile('spec.md', self.SPEC.encode('cp932')))
+
+        document = Document.objects.get()
+        self.assertEqual(document.specification_status, 'completed')
+        self.assertEqual(document.specification_length, len(self.SPEC))
+        chunks = list(document.specification_chunks.values_list('content', flat=True))
+        self.assertGreater(len(chunks), 5)
+        self.assertTrue(all(len(chunk) <= 40 for chunk in chunks))
+        self.assertEqual(''.join(chunks), self.SPEC)
+
+        # 生成では入力された製品説明の後に仕様書のテキストを含める
+        SectionTemplate.objects.create(project=self.project, title='セクション', order=0)
+        task = GenerationTask.objects.create(document=document)
+        with mock.patch('core.utils.request_completion', return_value=('内容', 10)) as completion:
+            generate_document_sections_task(document.id, task.id, use_cache=False)
+        self.assertIn('概要\n\n0. 機能0', completion.call_args.args[0])
+        self.assertIn('機能19', completion.call_args.args[0])
+
+    @override_settings(SPECIFICATION_INLINE_MAX_LENGTH=100, SPECIFICATION_RETRIEVAL_TOP_K=1)
+    def test_long_specification_includes_relevant_chunks_per_section(self):
+        spec = ''.join(
+            f'{i}. 画面{i}: 表示項目{i}を一覧で確認できる。\n' for i in range(10)
+        ) + '料金プランは月額と年額から選択できる。\n' + '画面の表示項目を一覧で確認できる。\n' * 2 + 'ログインは二要素認証に対応する。\n'
+        self.create(SimpleUploadedFile('spec.md', spec.encode()))
+        document = Document.objects.get()
+        self.assertGreater(document.specification_length, 100)
+
+        SectionTemplate.objects.create(project=self.project, title='料金プラン', order=0)
+        SectionTemplate.objects.create(project=self.project, title='二要素認証', order=1)
+        task = GenerationTask.objects.create(document=document)
+        with mock.patch('core.utils.request_completion', return_value=('内容', 10)) as completion:
+            generate_document_sections_task(document.id, task.id, use_cache=False)
+
+        # 仕様書の全文ではなく、セクションごとに関連するチャンクのみを含める
+        prompts = [call.args[0] for call in completion.call_args_list]
+        self.assertEqual(len(prompts), 2)
+        self.assertIn('概要\n\n料金プランは月額と年額', prompts[0])
+        self.assertNotIn('二要素認証に対応', prompts[0])
+        self.assertIn('二要素認証に対応', prompts[1])
+        self.assertNotIn('月額と年額', prompts[1])
+        for prompt in prompts:
+            self.assertNotIn('画面0', prompt)
+
+    def test_docx_is_extracted_by_paragraph(self):
+        self.create(SimpleUploadedFile('spec.docx', self.docx(['第1章 概要', '第2章 機能'])))
+
+        document = Document.objects.get()
+        self.assertEqual(document.specification_status, 'completed')
+        self.assertEqual(
+            ''.join(document.specification_chunks.values_list('content', flat=True)),
+            '第1章 概要\n第2章 機能\n表\tセル\n'
+        )
+
+        # ファイルを削除すると抽出したテキストも削除する
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('document_update', kwargs={'pk': document.pk}), {
+                'title': '仕様書付き', 'product_description': '概要', 'specification_file-clear': 'on',
+            })
+        document.refresh_from_db()
+        self.assertEqual(document.specification_status, '')
+        self.assertFalse(document.specification_chunks.exists())
+
+    def test_unsupported_files_are_rejected(self):
+        response = self.create(SimpleUploadedFile('spec.exe', b'binary'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('specification_file', response.context['form'].errors)
+
+        with override_settings(SPECIFICATION_MAX_UPLOAD_SIZE=10):
+            response = self.create(SimpleUploadedFile('spec.txt', b'x' * 11))
+        self.assertIn('specification_file', response.context['form'].errors)
+        self.assertFalse(Document.objects.exists())
+
+
+# Task Tests
+# 本番と同じくレスポンスキャッシュを有効にする（テストごとに新しいキャッシュを作成する）
+LOCMEM_LLM_CACHE = {'BACKEND': 'core.llm_cache.LocMemLLMCache', 'OPTIONS': {'ttl': 3600}}
+
+
+@without_rate_limit()
+class GenerateDocumentSectionsTaskTest(FlushRequestLogMixin, TestCase):
+    """ドキュメント生成タスクのテスト"""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(
+            username='testuser',
+            email='test@example.com',
+            password='testpassword'
+        )
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        for i in range(3):
+            SectionTemplate.objects.create(project=self.project, title=f'セクション{i}', order=i)
+        self.document = Document.objects.create(
+            title='Test Document',
+            project=self.project,
+            created_by=self.user,
+            product_description='製品説明'
+        )
+        self.task = GenerationTask.objects.create(document=self.document)
+        cache.clear()
+
+    def fake_completion(self, prompt, max_tokens=None):
+        return prompt.split('セクション: ')[1].split('\n')[0], 10
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_fanout_generates_sections_with_chord(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion):
+            generate_document_sections_task.delay(self.document.id, self.task.id, fanout=True)
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'completed')
+        self.assertEqual(self.task.progress, 100)
+        self.assertEqual(self.task.completed_sections, 3)
+        self.assertEqual(
+            list(self.document.sections.values_list('content', flat=True)),
+            ['セクション0', 'セクション1', 'セクション2']
+        )
+
+    def test_section_subtask_aggregates_progress(self):
+        self.task.status = 'processing'
+        self.task.total_sections = 3
+        self.task.save()
+        GenerationProgress(self.task).update(force=True)
+        template = self.project.section_templates.first()
+
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion):
+            generate_section_task(self.document.id, self.task.id, template.id)
+            generate_section_task(self.document.id, self.task.id, template.id)
+
+        state = GenerationProgress.get_state(self.task.id)
+        self.assertEqual(state['completed_sections'], 2)
+        self.assertEqual(state['progress'], 66)
+
+    def test_regeneration_skips_unchanged_sections(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion) as completion:
+            generate_document_sections_task(self.document.id, self.task.id, use_cache=False)
+            self.assertEqual(completion.call_count, 3)
+
+            template = self.project.section_templates.get(title='セクション1')
+            template.ai_prompt = '変更されたプロンプト'
+            template.save()
+            generate_document_sections_task(self.document.id, self.task.id, use_cache=False)
+            self.assertEqual(completion.call_count, 4)
+
+            generate_document_sections_task(self.document.id, self.task.id, use_cache=False, force=True)
+            self.assertEqual(completion.call_count, 7)
+
+        self.assertEqual(self.document.sections.count(), 3)
+
+    @override_settings(LLM_CACHE=LOCMEM_LLM_CACHE)
+    def test_forced_regeneration_bypasses_response_cache(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion) as completion:
+            generate_document_sections_task(self.document.id, self.task.id)
+            self.assertEqual(completion.call_count, 3)
+
+            # キャッシュ済みのレスポンスを返さず、APIを再度呼び出す
+            generate_document_sections_task(self.document.id, self.task.id, force=True)
+            self.assertEqual(completion.call_count, 6)
+
+    def test_combined_strategy_generates_sections_in_one_request(self):
+        templates = list(self.project.section_templates.order_by('order'))
+
+        def combined_completion(prompt, max_tokens=None):
+            sections = {str(template.id): f'まとめて{template.title}' for template in templates}
+            return json.dumps({'sections': sections}, ensure_ascii=False), 30
+
+        with mock.patch('core.utils.request_completion', side_effect=combined_completion) as completion:
+            generate_document_sections_task(self.document.id, self.task.id, use_cache=False, strategy='combined')
+
+        self.assertEqual(completion.call_count, 1)
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, 'completed')
+        self.assertEqual(
+            list(self.document.sections.values_list('content', flat=True)),
+            ['まとめてセクション0', 'まとめてセクション1', 'まとめてセクション2']
+        )
+
+    def test_regeneration_removes_sections_of_deleted_templates(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion):
+            generate_document_sections_task(self.document.id, self.task.id, use_cache=False)
+            self.project.section_templates.get(title='セクション2').delete()
+            generate_document_sections_task(self.document.id, self.task.id, use_cache=False)
+
+        self.assertEqual(
+            list(self.document.sections.values_list('title', flat=True)),
+            ['セクション0', 'セクション1']
+        )
+
+
+@without_rate_limit(PRODUCT_DIGEST_ENABLED=True, PRODUCT_DIGEST_MIN_LENGTH=10)
+class ProductDigestTest(FlushRequestLogMixin, TestCase):
+    """製品説明の要約のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        for i in range(3):
+            SectionTemplate.objects.create(project=self.project, title=f'セクション{i}', order=i,
+                                           use_product_digest=i != 2)
+        self.document = Document.objects.create(title='Test Document', project=self.project, created_by=self.user,
+                                                product_description='長い製品説明' * 10)
+        self.task = GenerationTask.objects.create(document=self.document)
+
+    def fake_completion(self, prompt, max_tokens=None):
+        product = prompt.split('製品説明:\n')[1].split('\n')[0]
+        if '要約してください' in prompt:
+            return f'要約({len(product)})', 10
+        return product, 10
+
+    def generate(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion) as completion:
+            generate_document_sections_task(self.document.id, self.task.id, use_cache=False)
+        return completion.call_count
+
+    def test_sections_use_digest_unless_opted_out(self):
+        self.assertEqual(self.generate(), 4)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.product_digest, '要約(60)')
+        self.assertEqual(
+            list(self.document.sections.values_list('content', flat=True)),
+            ['要約(60)', '要約(60)', '長い製品説明' * 10]
+        )
+
+        # 要約は製品説明が変わるまで再利用する
+        self.assertEqual(self.generate(), 0)
+
+        Document.objects.filter(pk=self.document.pk).update(product_description='変更後の製品説明です')
+        self.assertEqual(self.generate(), 4)
+        self.document.refresh_from_db()
+        self.assertEqual(self.document.product_digest, '要約(10)')
+
+    def test_short_descriptions_are_not_summarized(self):
+        Document.objects.filter(pk=self.document.pk).update(product_description='短い説明')
+        self.assertEqual(self.generate(), 3)
+        self.assertEqual(set(self.document.sections.values_list('content', flat=True)), {'短い説明'})
+
+
+@without_rate_limit(LLM_CACHE={'BACKEND': ''}, CELERY_TASK_ALWAYS_EAGER=True)
+class GenerationBatchTest(FlushRequestLogMixin, TestCase):
+    """複数ドキュメントの一括生成のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        for i in range(3):
+            SectionTemplate.objects.create(project=self.project, title=f'セクション{i}', order=i)
+        self.documents = [
+            Document.objects.create(title=f'Doc {i}', project=self.project, created_by=self.user,
+                                    product_description=f'製品{i}')
+            for i in range(4)
+        ]
+
+    def fake_completion(self, prompt, max_tokens=None):
+        product = prompt.split('製品説明:\n')[1].split('\n')[0]
+        section = prompt.split('セクション: ')[1].split('\n')[0]
+        return f'{product} {section}', 10
+
+    def post(self, documents, **data):
+        return self.client.post(reverse('generate_batch', kwargs={'project_pk': self.project.pk}), {
+            'documents': [document.pk for document in documents], 'max_concurrency': 2, **data,
+        })
+
+    def test_generates_selected_documents(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion), \
+                mock.patch('documents.tasks.build_template_prompt', wraps=build_template_prompt) as template_prompt:
+            response = self.post(self.documents[:3])
+
+        batch = GenerationBatch.objects.get()
+        self.assertRedirects(response, reverse('generation_batch_status', kwargs={'pk': batch.pk}))
+        self.assertEqual(batch.status, 'completed')
+        self.assertEqual((batch.total_documents, batch.completed_documents, batch.failed_documents), (3, 3, 0))
+        self.assertEqual((batch.total_sections, batch.completed_sections), (9, 9))
+        # テンプレート部分のプロンプトはバッチ全体で1回ずつ作成する
+        self.assertEqual(template_prompt.call_count, 3)
+
+        self.assertEqual(
+            list(self.documents[1].sections.values_list('content', flat=True)),
+            ['製品1 セクション0', '製品1 セクション1', '製品1 セクション2'],
+        )
+        self.assertFalse(self.documents[3].sections.exists())
+        self.assertEqual(set(batch.tasks.values_list('status', flat=True)), {'completed'})
+
+        status = self.client.get(reverse('get_generation_batch_status', kwargs={'batch_id': batch.pk})).json()
+        self.assertEqual((status['status'], status['progress'], status['completed_documents']), ('completed', 100, 3))
+
+    def test_unchanged_sections_are_skipped(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion):
+            self.post(self.documents[:2])
+        Document.objects.filter(pk=self.documents[0].pk).update(product_description='変更後')
+
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion) as completion:
+            self.post(self.documents[:2])
+
+        self.assertEqual(completion.call_count, 3)
+        batch = GenerationBatch.objects.latest('id')
+        self.assertEqual((batch.completed_documents, batch.total_sections), (2, 3))
+
+    @override_settings(LLM_CACHE=LOCMEM_LLM_CACHE)
+    def test_forced_regeneration_bypasses_response_cache(self):
+        with mock.patch('core.utils.request_completion', side_effect=self.fake_completion) as completion:
+            self.post(self.documents[:2])
+            self.post(self.documents[:2], force='on')
+
+        self.assertEqual(completion.call_count, 12)
+
+    def test_concurrency_is_capped(self):
+        with override_settings(GENERATION_BATCH_MAX_CONCURRENCY=2):
+            response = self.post(self.documents, max_concurrency=5)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(GenerationBatch.objects.exists())
+
+        with mock.patch('documents.tasks.generate_completions', return_value=[]) as completions:
+            self.post([])
+            self.post(self.documents[:1])
+        self.assertEqual(completions.call_args.kwargs['max_concurrency'], 2)
+
+
+FAKE_BATCH_BACKEND = {'BACKEND': 'core.llm_backends.FakeLLMBackend', 'OPTIONS': {'tokens': 30}}
+
+
+@override_settings(LLM_BACKEND=FAKE_BATCH_BACKEND, LLM_CACHE={'BACKEND': ''}, CELERY_TASK_ALWAYS_EAGER=True)
+class DeferredGenerationBatchTest(FlushRequestLogMixin, TestCase):
+    """バッチAPIを使用する遅延モードの一括生成のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        use_temporary_media_root(self)
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.force_login(self.user)
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        for i in range(3):
+            SectionTemplate.objects.create(project=self.project, title=f'セクション{i}', order=i)
+        self.documents = [
+            Document.objects.create(title=f'Doc {i}', project=self.project, created_by=self.user,
+                                    product_description=f'製品{i}')
+            for i in range(2)
+        ]
+
+    def submit(self, **data):
+        self.client.post(reverse('generate_batch', kwargs={'project_pk': self.project.pk}), {
+            'documents': [document.pk for document in self.documents], 'max_concurrency': 2, 'deferred': 'on',
+            **data,
+        })
+        return GenerationBatch.objects.get()
+
+    def test_results_are_ingested_by_poller(self):
+        batch = self.submit()
+
+        # 送信時にはAPIを呼び出さず、結果も保存しない
+        self.assertEqual((batch.mode, batch.status), ('deferred', 'processing'))
+        self.assertTrue(batch.provider_batch_id)
+        self.assertEqual(get_llm_backend().calls, 0)
+        self.assertFalse(DocumentSection.objects.exists())
+        with default_storage.open(batch.request_file) as request_file:
+            self.assertEqual(len(request_file.readlines()), 6)
+
+        self.assertEqual(poll_generation_batches_task(), 1)
+
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'completed')
+        self.assertEqual((batch.completed_documents, batch.completed_sections), (2, 6))
+        self.assertEqual(DocumentSection.objects.filter(content__startswith='模擬レスポンス').count(), 6)
+        # Celeryのタスクとして実行した場合はタスクの終了時に保存される
+        get_request_log().flush()
+        self.assertEqual(OpenAIRequest.objects.count(), 6)
+        self.assertEqual(set(batch.tasks.values_list('status', flat=True)), {'completed'})
+        # 取り込み済みのバッチは再度取り込まない
+        self.assertEqual(poll_generation_batches_task(), 0)
+
+        # 次回は変更があったセクションのみ送信する
+        GenerationBatch.objects.all().delete()
+        Document.objects.filter(pk=self.documents[0].pk).update(product_description='変更後')
+        self.assertEqual(self.submit().total_sections, 3)
+
+    # 取り込みで呼び出し回数が増えるため、このテスト用のバックエンドを使用する
+    @override_settings(LLM_BACKEND=FAKE_BATCH_BACKEND, LLM_CACHE=LOCMEM_LLM_CACHE)
+    def test_forced_batch_results_are_not_cached(self):
+        batch = self.submit(force='on')
+        self.assertFalse(batch.use_cache)
+        self.assertEqual(batch.total_sections, 6)
+        poll_generation_batches_task()
+
+        self.assertEqual(get_llm_cache().stats(), {'hits': 0, 'misses': 0})
+        prompt = json.loads(default_storage.open(batch.request_file).readline())['body']['messages'][-1]['content']
+        self.assertIsNone(get_llm_cache().get(completion_cache_key(prompt)))
+
+    # 取り込みで呼び出し回数が増えるため、このテスト用のバックエンドを使用する
+    @override_settings(LLM_BACKEND=FAKE_BATCH_BACKEND)
+    def test_provider_is_queried_outside_transaction(self):
+        batch = self.submit()
+        backend = get_llm_backend()
+        # TestCase 自体のトランザクションより内側のブロックがないことを確認する
+        outer_blocks = len(connection.atomic_blocks)
+        depths = []
+
+        def record_depth(method):
+            def wrapper(*args, **kwargs):
+                depths.append(len(connection.atomic_blocks) - outer_blocks)
+                return method(*args, **kwargs)
+            return wrapper
+
+        request_log = get_request_log()
+        with mock.patch.object(backend, 'get_batch', record_depth(backend.get_batch)), \
+                mock.patch.object(backend, 'get_batch_results', record_depth(backend.get_batch_results)), \
+                mock.patch.object(request_log, 'record', record_depth(request_log.record)):
+            self.assertEqual(poll_generation_batches_task(), 1)
+
+        # プロバイダへの問い合わせ2回と、結果ごとのLLM呼び出しの記録がすべてトランザクションの外で行われる
+        self.assertEqual(depths, [0] * (2 + batch.tasks.count() * self.project.section_templates.count()))
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'completed')
+
+    @override_settings(LLM_BACKEND={**FAKE_BATCH_BACKEND, 'OPTIONS': {'batch_delay': 3600}})
+    def test_unfinished_batch_is_left_processing(self):
+        batch = self.submit()
+        self.assertEqual(poll_generation_batches_task(), 0)
+        batch.refresh_from_db()
+        self.assertEqual(batch.status, 'processing')
+
+    @override_settings(LLM_BACKEND={**FAKE_BATCH_BACKEND, 'OPTIONS': {'failure_rate': 1.0}})
+    def test_failed_requests_become_error_sections(self):
+        batch = self.submit()
+        poll_generation_batches_task()
+
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.failed_documents), ('completed', 2))
+        self.assertFalse(DocumentSection.objects.exclude(input_fingerprint='').exists())
+
+
+class SaveSectionsQueryCountTest(TestCase):
+    """セクション保存のクエリ数がセクション数に依存しないことを確認するベンチマーク"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+
+    def save_sections_queries(self, section_count):
+        project = Project.objects.create(name=f'Project {section_count}', owner=self.user)
+        templates = SectionTemplate.objects.bulk_create([
+            SectionTemplate(project=project, title=f'セクション{i}', order=i) for i in range(section_count)
+        ])
+        document = Document.objects.create(title='Document', project=project, created_by=self.user)
+        DocumentSection.objects.bulk_create([
+            DocumentSection(document=document, template=template, title=template.title, order=template.order)
+            for template in templates
+        ])
+        contents = {template.id: f'内容{template.id}' for template in templates}
+        fingerprints = {template.id: 'x' * 64 for template in templates}
+
+        with CaptureQueriesContext(connection) as context:
+            _save_sections(document, templates, contents, fingerprints)
+
+        self.assertEqual(document.sections.count(), section_count)
+        return [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+
+    def test_writes_per_document_are_constant(self):
+        small = self.save_sections_queries(5)
+        large = self.save_sections_queries(50)
+        self.assertEqual(len(small), len(large))
+        self.assertLessEqual(len(large), 2)
+
+
+class GenerationProgressTest(FlushRequestLogMixin, TestCase):
+    """キャッシュ上の進捗状況のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        project = Project.objects.create(name='Test Project', owner=self.user)
+        self.document = Document.objects.create(title='Test Document', project=project, created_by=self.user)
+        self.task = GenerationTask.objects.create(document=self.document, status='processing', total_sections=4)
+        self.client.login(username='testuser', password='testpassword')
+
+    def test_updates_are_throttled(self):
+        progress = GenerationProgress(self.task, min_interval=60)
+        progress.update(progress=10)
+        progress.update(progress=20)
+        self.assertEqual(GenerationProgress.get_state(self.task.id)['progress'], 10)
+        progress.flush()
+        self.assertEqual(GenerationProgress.get_state(self.task.id)['progress'], 20)
+
+    def test_status_api_reads_from_cache(self):
+        GenerationProgress(self.task).update(progress=50, completed_sections=2)
+        url = reverse('get_generation_status', args=[self.task.id])
+        self.client.get(url)  # セッションを読み込んでおく
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+
+        self.assertEqual(response.json()['progress'], 50)
+        self.assertFalse(any('documents_generationtask' in query['sql'] for query in context.captured_queries))
+        # データベースには途中の進捗状況は書き込まれない
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.progress, 0)
+
+    def test_status_api_falls_back_to_database(self):
+        response = self.client.get(reverse('get_generation_status', args=[self.task.id]))
+        self.assertEqual(response.json()['status'], 'processing')
+
+    def test_status_api_checks_owner(self):
+        GenerationProgress(self.task).update(progress=50)
+        User.objects.create_user(username='other', password='testpassword')
+        self.client.login(username='other', password='testpassword')
+        response = self.client.get(reverse('get_generation_status', args=[self.task.id]))
+        self.assertEqual(response.status_code, 404)
+
+    def collect_events(self, url):
+        async def collect():
+            async_client = AsyncClient()
+            async_client.cookies = self.client.cookies
+            response = await async_client.get(url)
+            if not response.streaming:
+                return response, response.content.decode()
+            chunks = [chunk async for chunk in response.streaming_content]
+            return response, b''.join(chunks).decode()
+
+        return async_to_sync(collect)()
+
+    @override_settings(GENERATION_EVENTS_POLL_INTERVAL=0)
+    def test_event_stream_pushes_section_and_completion_events(self):
+        progress = GenerationProgress(self.task, section_ids=[1, 2])
+        progress.state['sections'] = {1: 100, 2: 10}
+        progress.update(progress=60, completed_sections=1)
+
+        with mock.patch.object(GenerationProgress, 'get_state', side_effect=[
+            dict(progress.state, sections={1: 100, 2: 10}),
+            dict(progress.state, status='completed', progress=100, completed_sections=2, sections={1: 100, 2: 100}),
+        ]):
+            response, body = self.collect_events(reverse('generation_events', args=[self.task.id]))
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(body.count('event: section_started'), 2)
+        self.assertEqual(body.count('event: section_finished'), 2)
+        self.assertIn('event: completed', body)
+        self.assertIn(reverse('document_detail', args=[self.document.id]), body)
+
+    def test_event_stream_checks_owner(self):
+        User.objects.create_user(username='other', password='testpassword')
+        self.client.login(username='other', password='testpassword')
+        response, _ = self.collect_events(reverse('generation_events', args=[self.task.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+@without_rate_limit()
+class StreamingGenerationTest(FlushRequestLogMixin, TestCase):
+    """ストリーミング生成のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        get_llm_cache().clear()
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.project = Project.objects.create(name='Test Project', owner=self.user)
+        SectionTemplate.objects.create(project=self.project, title='セクション', order=1)
+        self.document = Document.objects.create(title='Test Document', project=self.project, created_by=self.user)
+        self.task = GenerationTask.objects.create(document=self.document)
+
+    def fake_stream(self, **kwargs):
+        self.assertTrue(kwargs['stream'])
+        return iter([
+            SimpleNamespace(choices=[SimpleNamespace(delta={'content': part})])
+            for part in ('テスト', '計画', '書')
+        ])
+
+    @override_settings(GENERATION_PARTIAL_SAVE_INTERVAL=0)
+    def test_streamed_content_is_saved(self):
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=self.fake_stream):
+            generate_document_sections_task(self.document.id, self.task.id, stream=True)
+
+        section = self.document.sections.get()
+        self.assertEqual(section.content, 'テスト計画書')
+        self.assertFalse(section.is_partial)
+        self.assertEqual(GenerationProgress.get_state(self.task.id)['status'], 'completed')
+
+    @override_settings(GENERATION_PARTIAL_SAVE_INTERVAL=0)
+    def test_partial_content_survives_failure(self):
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=self.fake_stream), \
+                mock.patch('documents.tasks._save_sections', side_effect=RuntimeError('worker lost')):
+            with self.assertRaises(RuntimeError):
+                generate_document_sections_task(self.document.id, self.task.id, stream=True)
+
+        section = self.document.sections.get()
+        self.assertTrue(section.is_partial)
+        self.assertEqual(section.content, 'テスト計画書')
+
+    @override_settings(GENERATION_PARTIAL_SAVE_INTERVAL=0, GENERATION_PROGRESS_INTERVAL=0)
+    def test_retry_discards_partial_content(self):
+        def interrupted_stream(**kwargs):
+            yield SimpleNamespace(choices=[SimpleNamespace(delta={'content': '途中まで'})])
+            raise openai.error.RateLimitError('429')
+
+        published = []
+        update = GenerationProgress.update
+
+        def record_partial(store, *args, **kwargs):
+            published.append(dict(store.state.get('partial', {})))
+            return update(store, *args, **kwargs)
+
+        streams = iter([interrupted_stream, self.fake_stream])
+        with mock.patch.object(openai.ChatCompletion, 'create', side_effect=lambda **kwargs: next(streams)(**kwargs)), \
+                mock.patch.object(GenerationProgress, 'update', record_partial), \
+                mock.patch('core.utils.time.sleep'):
+            generate_document_sections_task(self.document.id, self.task.id, stream=True)
+
+        template_id = self.project.section_templates.get().id
+        self.assertEqual(self.document.sections.get().content, 'テスト計画書')
+        # 再試行では途中までの内容を破棄し、最初から受信し直した内容のみを配信する
+        partials = [state[template_id] for state in published if template_id in state]
+        self.assertEqual(partials[:5], ['途中まで', '', 'テスト', 'テスト計画', 'テスト計画書'])
+
+    @override_settings(GENERATION_EVENTS_POLL_INTERVAL=0)
+    def test_event_stream_resets_partial_content_after_retry(self):
+        state = GenerationProgress(self.task, section_ids=[1]).state
+        states = [
+            dict(state, sections={1: 10}, partial={1: '途中'}, partial_attempts={}),
+            dict(state, sections={1: 10}, partial={1: '最初'}, partial_attempts={1: 1}),
+            dict(state, status='completed', sections={1: 100}, partial={1: '最初から'}, partial_attempts={1: 1}),
+        ]
+        self.client.force_login(self.user)
+
+        async def collect():
+            async_client = AsyncClient()
+            async_client.cookies = self.client.cookies
+            response = await async_client.get(reverse('generation_events', args=[self.task.id]))
+            return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        with mock.patch.object(GenerationProgress, 'get_state', side_effect=states):
+            body = async_to_sync(collect)()
+
+        events = [
+            (event.split('\n')[0].removeprefix('event: '), json.loads(event.split('data: ')[1]))
+            for event in body.split('\n\n') if event.startswith('event: section_')
+        ]
+        self.assertEqual([(name, data.get('content')) for name, data in events if name != 'section_started'], [
+            ('section_delta', '途中'), ('section_reset', None), ('section_delta', '最初'),
+            ('section_finished', None), ('section_delta', 'から'),
+        ])
+
+
+class BenchmarkPipelineCommandTest(TestCase):
+    """生成パイプラインのベンチマークコマンドのテスト"""
+
+    def test_writes_machine_readable_report(self):
+        existing = OpenAIRequest.objects.create(prompt='計測前', response='応答', tokens_used=1)
+        with tempfile.NamedTemporaryFile(suffix='.json') as output:
+            call_command('benchmark_pipeline', sections=[2], users=[1], documents_per_user=2, latency=0,
+                         poll_interval=0, output=output.name, stdout=StringIO())
+            report = json.load(open(output.name, encoding='utf-8'))
+
+        result = report['results'][0]
+        self.assertEqual((result['sections'], result['users'], result['documents'], result['errors']), (2, 1, 2, 0))
+        self.assertGreater(result['writes_per_document'], 0)
+        self.assertGreaterEqual(result['latency_p95'], result['latency_p50'])
+        # 計測用のデータは削除される
+        self.assertFalse(Document.objects.exists())
+        # 計測中の記録のみを削除し、他の記録は残す
+        self.assertEqual(list(OpenAIRequest.objects.all()), [existing])
+        self.assertEqual(OpenAIRequest.objects.get().prompt, '計測前')
+
+    @override_settings(LLM_REQUEST_LOG={'BACKEND': 'core.request_log.ImmediateRequestLog'})
+    def test_uses_configured_request_log(self):
+        request_log = get_request_log()
+        with mock.patch.object(request_log, 'write', wraps=request_log.write) as write:
+            call_command('benchmark_pipeline', sections=[2], users=[1], documents_per_user=1, latency=0,
+                         poll_interval=0, stdout=StringIO())
+
+        # 設定されたログで1件ずつ保存し、計測後に削除する
+        self.assertEqual(write.call_count, 2)
+        self.assertFalse(OpenAIRequest.objects.exists())
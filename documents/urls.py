@@ -3,8 +3,10 @@ from .views import (
     ProjectListView, ProjectDetailView, ProjectCreateView, ProjectUpdateView, ProjectDeleteView,
     SectionTemplateCreateView, SectionTemplateUpdateView, SectionTemplateDeleteView,
     DocumentCreateView, DocumentDetailView, DocumentUpdateView, DocumentDeleteView,
-    DocumentSectionUpdateView, generate_document_sections, document_generation_status, get_generation_status,
-    add_section_template, update_section_template_order
+    DocumentSectionUpdateView, generate_document_sections, document_generation_status, get_generation_status, generation_events,
+    add_section_template, bulk_edit_section_templates,
+    customize_section_templates, generate_batch, generation_batch_status, get_generation_batch_status,
+    export_document, export_project, export_status, export_download
 )
 
 urlpatterns = [
@@ -20,7 +22,8 @@ urlpatterns = [
     path('templates/<int:pk>/update/', SectionTemplateUpdateView.as_view(), name='section_template_update'),
     path('templates/<int:pk>/delete/', SectionTemplateDeleteView.as_view(), name='section_template_delete'),
     path('projects/<int:project_pk>/templates/add/', add_section_template, name='add_section_template'),
-    path('templates/update-order/', update_section_template_order, name='update_section_template_order'),
+    path('projects/<int:project_pk>/templates/bulk/', bulk_edit_section_templates, name='bulk_edit_section_templates'),
+    path('projects/<int:project_pk>/templates/customize/', customize_section_templates, name='customize_section_templates'),
     
     # ドキュメント関連のURL
     path('projects/<int:project_pk>/documents/create/', DocumentCreateView.as_view(), name='document_create'),
@@ -30,6 +33,16 @@ urlpatterns = [
     path('documents/<int:pk>/generate/', generate_document_sections, name='generate_document_sections'),
     path('documents/<int:pk>/generation-status/<int:task_id>/', document_generation_status, name='document_generation_status'),
     path('api/generation-status/<int:task_id>/', get_generation_status, name='get_generation_status'),
+    path('api/generation-events/<int:task_id>/', generation_events, name='generation_events'),
+    path('projects/<int:project_pk>/generate/', generate_batch, name='generate_batch'),
+    path('generation-batches/<int:pk>/', generation_batch_status, name='generation_batch_status'),
+    path('api/generation-batches/<int:batch_id>/', get_generation_batch_status, name='get_generation_batch_status'),
+
+    # エクスポート関連のURL
+    path('documents/<int:pk>/export/<str:export_format>/', export_document, name='export_document'),
+    path('projects/<int:pk>/export/', export_project, name='export_project'),
+    path('api/exports/<str:job_id>/', export_status, name='export_status'),
+    path('exports/<str:job_id>/download/', export_download, name='export_download'),
     
     # ドキュメントセクション関連のURL
     path('sections/<int:pk>/update/', DocumentSectionUpdateView.as_view(), name='document_section_update'),
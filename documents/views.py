@@ -3,13 +3,30 @@ from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.urls import reverse_lazy, reverse
-from django.http import JsonResponse
+from django.http import Http404, FileResponse, JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max
+from django.forms.models import model_to_dict
+from django.utils import timezone
+from django.utils.http import content_disposition_header
 from django.contrib import messages
-from .models import Project, SectionTemplate, Document, DocumentSection, GenerationTask
-from .forms import ProjectForm, SectionTemplateForm, DocumentForm, DocumentSectionForm
+from django.contrib.auth.views import redirect_to_login
+from asgiref.sync import sync_to_async
+from .models import Project, SectionTemplate, Document, DocumentSection, GenerationTask, GenerationBatch
+from .forms import ProjectForm, SectionTemplateForm, DocumentForm, DocumentSectionForm, GenerationBatchForm
 from .default_templates import DEFAULT_TEMPLATES
+from .progress import GenerationProgress, BatchProgress
+from .export import EXPORT_FORMATS, export_documents, get_export_state, set_export_state
+from .rendering import render_sections
+from .pagination import keyset_paginate, annotate_project_counts, annotate_document_counts, add_status_labels
+from .template_library import materialize_templates
+from core.streaming import streaming_response
 from core.utils import generate_test_document
+import asyncio
 import json
+import uuid
 
 
 class ProjectListView(LoginRequiredMixin, ListView):
@@ -19,9 +36,19 @@ class ProjectListView(LoginRequiredMixin, ListView):
     model = Project
     template_name = 'documents/project_list.html'
     context_object_name = 'projects'
+    per_page = 20
 
     def get_queryset(self):
-        return Project.objects.filter(owner=self.request.user)
+        # ドキュメント数と最新の生成ステータスは一覧の1クエリで取得する
+        return annotate_project_counts(Project.objects.filter(owner=self.request.user))
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # プロジェクト数に関わらず一定の時間で表示できるよう、キーセットで1ページ分のみ取得する
+        context['projects'] = add_status_labels(
+            keyset_paginate(self.object_list, self.request.GET.get('cursor'), self.per_page)
+        )
+        return context
 
 
 class ProjectDetailView(LoginRequiredMixin, DetailView):
@@ -31,14 +58,20 @@ class ProjectDetailView(LoginRequiredMixin, DetailView):
     model = Project
     template_name = 'documents/project_detail.html'
     context_object_name = 'project'
+    per_page = 20
 
     def get_queryset(self):
         return Project.objects.filter(owner=self.request.user)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['section_templates'] = self.object.section_templates.all()
-        context['documents'] = self.object.documents.all()
+        # テンプレートはドラッグで並べ替えるため、すべて表示する
+        context['section_templates'] = self.object.get_section_templates()
+        context['documents'] = add_status_labels(keyset_paginate(
+            annotate_document_counts(self.object.documents.all()),
+            self.request.GET.get('cursor'),
+            self.per_page,
+        ))
         return context
 
 
@@ -53,22 +86,14 @@ class ProjectCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         form.instance.owner = self.request.user
-        response = super().form_valid(form)
-        
-        # デフォルトのセクションテンプレートを追加
+
+        # デフォルトのセクションテンプレートは共有ライブラリを参照する（テンプレートはコピーしない）
         template_type = form.instance.template_type
-        if template_type != 'custom' and template_type in DEFAULT_TEMPLATES:
+        form.instance.uses_template_library = template_type != 'custom' and template_type in DEFAULT_TEMPLATES
+        response = super().form_valid(form)
+
+        if form.instance.uses_template_library:
             template_data = DEFAULT_TEMPLATES[template_type]
-            for section_data in template_data['sections']:
-                SectionTemplate.objects.create(
-                    project=self.object,
-                    title=section_data['title'],
-                    description=section_data['description'],
-                    form_type=section_data['form_type'],
-                    content_guidelines=section_data['content_guidelines'],
-                    ai_prompt=section_data['ai_prompt'],
-                    order=section_data['order']
-                )
             messages.success(self.request, f"{template_data['name']}のデフォルトセクションを追加しました。")
         
         return response
@@ -111,6 +136,8 @@ class SectionTemplateCreateView(LoginRequiredMixin, CreateView):
 
     def form_valid(self, form):
         project = get_object_or_404(Project, pk=self.kwargs['project_pk'], owner=self.request.user)
+        # 共有ライブラリを参照している場合はプロジェクト専用のテンプレートにコピーしてから追加する
+        materialize_templates(project)
         form.instance.project = project
         return super().form_valid(form)
 
@@ -132,7 +159,11 @@ class SectionTemplateUpdateView(LoginRequiredMixin, UpdateView):
     template_name = 'documents/section_template_form.html'
 
     def get_queryset(self):
-        return SectionTemplate.objects.filter(project__owner=self.request.user)
+        return SectionTemplate.objects.filter(project__owner=self.request.user).select_related('project')
+
+    def form_valid(self, form):
+        form.instance.version += 1
+        return super().form_valid(form)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -149,9 +180,10 @@ class SectionTemplateDeleteView(LoginRequiredMixin, DeleteView):
     """
     model = SectionTemplate
     template_name = 'documents/section_template_confirm_delete.html'
+    context_object_name = 'template'
 
     def get_queryset(self):
-        return SectionTemplate.objects.filter(project__owner=self.request.user)
+        return SectionTemplate.objects.filter(project__owner=self.request.user).select_related('project')
 
     def get_success_url(self):
         return reverse('project_detail', kwargs={'pk': self.object.project.pk})
@@ -164,9 +196,10 @@ def add_section_template(request, project_pk):
     """
     if request.method == 'POST' and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         project = get_object_or_404(Project, pk=project_pk, owner=request.user)
+        replaced = materialize_templates(project)
         
         # 最大の順序を取得
-        max_order = project.section_templates.aggregate(models.Max('order'))['order__max'] or 0
+        max_order = project.section_templates.aggregate(Max('order'))['order__max'] or 0
         
         # 新しいセクションテンプレートを作成
         template = SectionTemplate.objects.create(
@@ -183,28 +216,138 @@ def add_section_template(request, project_pk):
             'success': True,
             'template_id': template.id,
             'template_title': template.title,
-            'template_order': template.order
+            'template_order': template.order,
+            # 共有ライブラリのテンプレートがコピーされた場合は既存のテンプレートのIDも変わる
+            'replaced': bool(replaced)
         })
     
     return JsonResponse({'success': False, 'error': '不正なリクエストです。'})
 
 
+# 一括編集で変更できるフィールド
+BULK_EDITABLE_FIELDS = SectionTemplateForm._meta.fields
+
+
+def _template_data(template):
+    return {
+        'id': template.id,
+        'title': template.title,
+        'order': template.order,
+        'version': template.version,
+    }
+
+
 @login_required
-def update_section_template_order(request):
+def bulk_edit_section_templates(request, project_pk):
+    """
+    セクションテンプレートを一括で作成・更新・削除するAJAXビュー
+
+    リクエスト本文（JSON）:
+        create: [{title, description, form_type, content_guidelines, ai_prompt, order}]
+        update: [{id, version, 変更するフィールド}]
+        delete: [{id, version}]
+
+    所有者の確認は1回のみ行い、変更は1つのトランザクション内で一括して保存する。
+    更新・削除するテンプレートの version が現在の値と異なる場合（他のユーザーが先に
+    変更した場合）は何も変更せずに 409 を返す。
+    共有ライブラリを参照しているプロジェクトでは、ライブラリのテンプレートをコピーしてから
+    変更し、コピー前後のテンプレートIDを replaced として返す。
+    """
+    if request.method != 'POST' or request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return JsonResponse({'success': False, 'error': '不正なリクエストです。'})
+
+    try:
+        payload = json.loads(request.body)
+        creates = payload.get('create', [])
+        updates = payload.get('update', [])
+        deletes = payload.get('delete', [])
+        expected_versions = {int(row['id']): int(row['version']) for row in [*updates, *deletes]}
+        if not all(isinstance(row, dict) for row in creates):
+            raise TypeError
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'error': '不正なリクエストです。'}, status=400)
+
+    project = get_object_or_404(Project, pk=project_pk, owner=request.user)
+
+    with transaction.atomic():
+        # ライブラリのテンプレートIDはコピーしたテンプレートのIDに読み替える
+        replaced = {old_id: copy.id for old_id, copy in materialize_templates(project).items()}
+        expected_versions = {replaced.get(template_id, template_id): version
+                             for template_id, version in expected_versions.items()}
+        templates = project.section_templates.select_for_update().in_bulk(list(expected_versions))
+
+        # 他のユーザーが先に変更・削除したテンプレート
+        conflicts = [
+            {'id': template_id, 'version': templates[template_id].version if template_id in templates else None}
+            for template_id, version in expected_versions.items()
+            if template_id not in templates or templates[template_id].version != version
+        ]
+        if conflicts:
+            transaction.set_rollback(True)
+            return JsonResponse({
+                'success': False,
+                'error': '他のユーザーがテンプレートを変更しました。再読み込みしてください。',
+                'conflicts': conflicts,
+            }, status=409)
+
+        errors = {}
+        now = timezone.now()
+        changed_fields = {'version', 'updated_at'}
+        updated = []
+        for row in updates:
+            template = templates[replaced.get(int(row['id']), int(row['id']))]
+            changes = {field: row[field] for field in BULK_EDITABLE_FIELDS if field in row}
+            form = SectionTemplateForm({**model_to_dict(template, fields=BULK_EDITABLE_FIELDS), **changes},
+                                       instance=template)
+            if not form.is_valid():
+                errors[str(template.id)] = form.errors
+                continue
+            changed_fields.update(changes)
+            template.version += 1
+            template.updated_at = now
+            updated.append(template)
+
+        created = []
+        for i, row in enumerate(creates):
+            data = {'title': '新しいセクション', 'form_type': 'textarea', 'use_product_digest': True, 'order': 0}
+            data.update({field: row[field] for field in BULK_EDITABLE_FIELDS if field in row})
+            form = SectionTemplateForm(data)
+            if not form.is_valid():
+                errors[f'create-{i}'] = form.errors
+                continue
+            template = form.save(commit=False)
+            template.project = project
+            created.append(template)
+
+        if errors:
+            transaction.set_rollback(True)
+            return JsonResponse({'success': False, 'error': '入力内容に誤りがあります。', 'errors': errors}, status=400)
+
+        deleted_ids = [replaced.get(int(row['id']), int(row['id'])) for row in deletes]
+        if deleted_ids:
+            project.section_templates.filter(pk__in=deleted_ids).delete()
+        if updated:
+            SectionTemplate.objects.bulk_update(updated, sorted(changed_fields))
+        if created:
+            created = SectionTemplate.objects.bulk_create(created)
+
+    return JsonResponse({
+        'success': True,
+        'templates': [_template_data(template) for template in [*updated, *created]],
+        'deleted': deleted_ids,
+        'replaced': replaced,
+    })
+
+
+@login_required
+def customize_section_templates(request, project_pk):
     """
-    セクションテンプレートの順序を更新するAJAXビュー
+    共有ライブラリのテンプレートをプロジェクト専用のテンプレートとしてコピーするビュー
     """
-    if request.method == 'POST' and request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        template_ids = request.POST.getlist('template_ids[]')
-        
-        for i, template_id in enumerate(template_ids):
-            template = get_object_or_404(SectionTemplate, pk=template_id, project__owner=request.user)
-            template.order = i + 1
-            template.save()
-        
-        return JsonResponse({'success': True})
-    
-    return JsonResponse({'success': False, 'error': '不正なリクエストです。'})
+    project = get_object_or_404(Project, pk=project_pk, owner=request.user)
+    if request.method == 'POST' and materialize_templates(project):
+        messages.success(request, 'テンプレートをカスタマイズできるようになりました。')
+    return redirect('project_detail', pk=project.pk)
 
 
 class DocumentCreateView(LoginRequiredMixin, CreateView):
@@ -219,7 +362,9 @@ class DocumentCreateView(LoginRequiredMixin, CreateView):
         project = get_object_or_404(Project, pk=self.kwargs['project_pk'], owner=self.request.user)
         form.instance.project = project
         form.instance.created_by = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+        schedule_specification_extraction(form)
+        return response
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -239,11 +384,17 @@ class DocumentDetailView(LoginRequiredMixin, DetailView):
     context_object_name = 'document'
 
     def get_queryset(self):
-        return Document.objects.filter(project__owner=self.request.user)
+        return Document.objects.filter(project__owner=self.request.user).select_related('project')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['sections'] = self.object.sections.all()
+        sections = list(self.object.sections.select_related('template'))
+        # 途中の内容のセクションは、生成が完了したセクションがない場合（中断時）のみ表示する
+        completed_template_ids = {section.template_id for section in sections if not section.is_partial}
+        context['sections'] = render_sections([
+            section for section in sections
+            if not section.is_partial or section.template_id not in completed_template_ids
+        ])
         return context
 
 
@@ -256,17 +407,48 @@ class DocumentUpdateView(LoginRequiredMixin, UpdateView):
     template_name = 'documents/document_form.html'
 
     def get_queryset(self):
-        return Document.objects.filter(project__owner=self.request.user)
+        return Document.objects.filter(project__owner=self.request.user).select_related('project')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['project'] = self.object.project
         return context
 
+    def form_valid(self, form):
+        previous_file = form.initial.get('specification_file')
+        response = super().form_valid(form)
+        schedule_specification_extraction(form, previous_file)
+        return response
+
     def get_success_url(self):
         return reverse('document_detail', kwargs={'pk': self.object.pk})
 
 
+def schedule_specification_extraction(form, previous_file=None):
+    """
+    仕様書ファイルが変更された場合に、テキストの抽出をバックグラウンドで開始する
+
+    アップロードされたファイルはアップロードハンドラが一時ファイルに書き出し、ストレージにも
+    少しずつコピーされるため、Webワーカーがファイル全体をメモリに読み込むことはない。
+    ファイルが削除された場合は抽出済みのテキストも削除する。
+    """
+    if 'specification_file' not in form.changed_data:
+        return
+    from .tasks import extract_specification_task
+
+    document = form.instance
+    if previous_file and previous_file.name != document.specification_file.name:
+        previous_file.storage.delete(previous_file.name)
+
+    documents = Document.objects.filter(pk=document.pk)
+    if document.specification_file:
+        documents.update(specification_status='pending', specification_error='', specification_length=0)
+        transaction.on_commit(lambda: extract_specification_task.delay(document.pk))
+    else:
+        document.specification_chunks.all().delete()
+        documents.update(specification_status='', specification_error='', specification_length=0)
+
+
 class DocumentDeleteView(LoginRequiredMixin, DeleteView):
     """
     ドキュメント削除ビュー
@@ -275,7 +457,7 @@ class DocumentDeleteView(LoginRequiredMixin, DeleteView):
     template_name = 'documents/document_confirm_delete.html'
 
     def get_queryset(self):
-        return Document.objects.filter(project__owner=self.request.user)
+        return Document.objects.filter(project__owner=self.request.user).select_related('project')
 
     def get_success_url(self):
         return reverse('project_detail', kwargs={'pk': self.object.project.pk})
@@ -298,7 +480,9 @@ def generate_document_sections(request, pk):
         
         # Celeryタスクを開始
         from .tasks import generate_document_sections_task
-        celery_task = generate_document_sections_task.delay(document.id, task.id)
+        # force が指定された場合は入力が変わっていないセクションも再生成する
+        force = request.POST.get('force') == 'on'
+        celery_task = generate_document_sections_task.delay(document.id, task.id, force=force)
         
         # タスクIDを保存
         task.task_id = celery_task.id
@@ -319,7 +503,7 @@ def document_generation_status(request, pk, task_id):
     task = get_object_or_404(GenerationTask, id=task_id, document=document)
     
     # セクションテンプレート情報をJSON形式で渡す
-    section_templates = document.project.section_templates.all().order_by('order')
+    section_templates = document.project.get_section_templates().order_by('order')
     section_templates_json = json.dumps([
         {
             'id': template.id,
@@ -335,28 +519,244 @@ def document_generation_status(request, pk, task_id):
     })
 
 
-@login_required
-def get_generation_status(request, task_id):
+def _task_state(task):
     """
-    生成タスクの進捗状況を取得するAPIビュー
+    GenerationTask から進捗状況の辞書を作成する（キャッシュにない場合のフォールバック）
     """
-    task = get_object_or_404(GenerationTask, id=task_id, document__project__owner=request.user)
-    
-    data = {
+    return {
         'status': task.status,
         'progress': task.progress,
         'total_sections': task.total_sections,
         'completed_sections': task.completed_sections,
-        'error_message': task.error_message
+        'error_message': task.error_message,
+        'document_id': task.document_id,
+        'sections': {},
+    }
+
+
+@login_required
+def get_generation_status(request, task_id):
+    """
+    生成タスクの進捗状況を取得するAPIビュー
+
+    進捗状況はキャッシュから読み込み、キャッシュにない場合のみデータベースを参照する。
+    EventSourceを使用できないブラウザ向けのフォールバックとしても使用される。
+    """
+    state = GenerationProgress.get_state(task_id)
+
+    if state is None or state['owner_id'] != request.user.id:
+        task = get_object_or_404(GenerationTask, id=task_id, document__project__owner=request.user)
+        state = _task_state(task)
+
+    data = {
+        'status': state['status'],
+        'progress': state['progress'],
+        'total_sections': state['total_sections'],
+        'completed_sections': state['completed_sections'],
+        'error_message': state['error_message']
     }
     
     # タスクが完了している場合はドキュメント詳細ページのURLを含める
-    if task.status == 'completed':
-        data['redirect_url'] = reverse('document_detail', kwargs={'pk': task.document.id})
+    if state['status'] == 'completed':
+        data['redirect_url'] = reverse('document_detail', kwargs={'pk': state['document_id']})
     
     return JsonResponse(data)
 
 
+@login_required
+def generate_batch(request, project_pk):
+    """
+    プロジェクト内の複数のドキュメントを一括生成するビュー
+
+    XMLHttpRequest の場合はバッチIDと進捗状況APIのURLをJSONで返す。
+    """
+    project = get_object_or_404(Project, pk=project_pk, owner=request.user)
+    max_concurrency = getattr(settings, 'GENERATION_BATCH_MAX_CONCURRENCY', 8)
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+    form = GenerationBatchForm(request.POST or None, project=project, max_concurrency=max_concurrency)
+    if request.method == 'POST':
+        if not form.is_valid():
+            if is_ajax:
+                return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+            return render(request, 'documents/generate_batch.html', {'project': project, 'form': form})
+
+        documents = form.cleaned_data['documents']
+        with transaction.atomic():
+            batch = GenerationBatch.objects.create(
+                project=project,
+                created_by=request.user,
+                mode='deferred' if form.cleaned_data['deferred'] else 'immediate',
+                max_concurrency=form.cleaned_data['max_concurrency'],
+                total_documents=len(documents),
+            )
+            GenerationTask.objects.bulk_create([
+                GenerationTask(document=document, batch=batch, status='pending') for document in documents
+            ])
+
+        from .tasks import generate_batch_task, submit_deferred_batch_task
+        # 遅延モードではバッチAPIに送信するだけで、ワーカーは結果を待たない
+        task_function = submit_deferred_batch_task if batch.mode == 'deferred' else generate_batch_task
+        celery_task = task_function.delay(batch.id, force=form.cleaned_data['force'])
+        GenerationBatch.objects.filter(pk=batch.pk).update(task_id=celery_task.id)
+
+        if is_ajax:
+            return JsonResponse({
+                'success': True,
+                'batch_id': batch.id,
+                'status_url': reverse('get_generation_batch_status', kwargs={'batch_id': batch.id}),
+            })
+        return redirect('generation_batch_status', pk=batch.pk)
+
+    return render(request, 'documents/generate_batch.html', {'project': project, 'form': form})
+
+
+# 一括生成の進捗状況APIで返すフィールド
+BATCH_STATE_FIELDS = (
+    'status', 'progress', 'total_documents', 'completed_documents', 'failed_documents',
+    'total_sections', 'completed_sections', 'error_message',
+)
+
+
+def _batch_state(batch):
+    """
+    GenerationBatch から進捗状況の辞書を作成する（キャッシュにない場合のフォールバック）
+    """
+    return {field: getattr(batch, field) for field in BATCH_STATE_FIELDS}
+
+
+@login_required
+def generation_batch_status(request, pk):
+    """
+    一括生成の進捗状況を表示するビュー
+    """
+    batch = get_object_or_404(GenerationBatch.objects.select_related('project'), pk=pk,
+                              project__owner=request.user)
+    return render(request, 'documents/generation_batch_status.html', {
+        'batch': batch,
+        'tasks': batch.tasks.select_related('document').order_by('id'),
+    })
+
+
+@login_required
+def get_generation_batch_status(request, batch_id):
+    """
+    一括生成の進捗状況を取得するAPIビュー
+
+    進捗状況はキャッシュから読み込み、キャッシュにない場合のみデータベースを参照する。
+    """
+    state = BatchProgress.get_state(batch_id)
+
+    if state is None or state['owner_id'] != request.user.id:
+        batch = get_object_or_404(GenerationBatch, id=batch_id, project__owner=request.user)
+        state = _batch_state(batch)
+
+    return JsonResponse({field: state[field] for field in BATCH_STATE_FIELDS})
+
+
+def _sse(event, data):
+    """
+    Server-Sent Events の1イベント分の文字列を作成する
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _get_authenticated_user(request):
+    user = request.user
+    return user if user.is_authenticated else None
+
+
+async def _generation_event_stream(task_id):
+    """
+    進捗状況をキャッシュから読み込み、変化があった場合にのみイベントを送信する
+    """
+    poll_interval = getattr(settings, 'GENERATION_EVENTS_POLL_INTERVAL', 0.25)
+    fallback_interval = max(poll_interval, 1.0)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'GENERATION_EVENTS_TIMEOUT', 600)
+
+    last_summary = None
+    sections = {}
+    partial_lengths = {}
+    partial_attempts = {}
+
+    # 接続が切れた場合の再接続間隔（ミリ秒）
+    yield 'retry: 2000\n\n'
+
+    while True:
+        state = await sync_to_async(GenerationProgress.get_state)(task_id)
+        interval = poll_interval
+        if state is None:
+            # キャッシュにない場合はデータベースを参照する（間隔を空ける）
+            task = await sync_to_async(GenerationTask.objects.get)(id=task_id)
+            state = _task_state(task)
+            interval = fallback_interval
+
+        for template_id, progress in state['sections'].items():
+            previous = sections.get(template_id, 0)
+            if previous == 0 and progress > 0:
+                yield _sse('section_started', {'template_id': template_id})
+            if previous < 100 <= progress:
+                yield _sse('section_finished', {'template_id': template_id})
+            sections[template_id] = progress
+
+        # ストリーミング生成中の内容は前回送信した以降の差分のみを送る
+        # 再試行で受信済みの内容が破棄された場合は、表示中の内容を消去させてから送り直す
+        for template_id, attempt in state.get('partial_attempts', {}).items():
+            if partial_attempts.get(template_id, 0) != attempt:
+                yield _sse('section_reset', {'template_id': template_id})
+                partial_attempts[template_id] = attempt
+                partial_lengths[template_id] = 0
+        for template_id, content in state.get('partial', {}).items():
+            sent = partial_lengths.get(template_id, 0)
+            if len(content) > sent:
+                yield _sse('section_delta', {'template_id': template_id, 'content': content[sent:]})
+                partial_lengths[template_id] = len(content)
+
+        summary = {
+            'status': state['status'],
+            'progress': state['progress'],
+            'total_sections': state['total_sections'],
+            'completed_sections': state['completed_sections'],
+        }
+        if summary != last_summary:
+            yield _sse('progress', summary)
+            last_summary = summary
+
+        if state['status'] == 'completed':
+            yield _sse('completed', {
+                'redirect_url': reverse('document_detail', kwargs={'pk': state['document_id']})
+            })
+            return
+        if state['status'] == 'failed':
+            yield _sse('failed', {'error_message': state['error_message']})
+            return
+
+        if loop.time() >= deadline:
+            # クライアントは retry の間隔で再接続する
+            return
+        await asyncio.sleep(interval)
+
+
+async def generation_events(request, task_id):
+    """
+    生成タスクの進捗状況を Server-Sent Events で配信するビュー
+
+    ASGI（doqment/asgi.py）経由で提供する。認証と所有者の確認は接続時に一度だけ行い、
+    以降はキャッシュ上の進捗状況の変化をプッシュする。
+    """
+    user = await sync_to_async(_get_authenticated_user)(request)
+    if user is None:
+        return redirect_to_login(request.get_full_path())
+
+    await sync_to_async(get_object_or_404)(GenerationTask, id=task_id, document__project__owner=user)
+
+    response = StreamingHttpResponse(_generation_event_stream(task_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class DocumentSectionUpdateView(LoginRequiredMixin, UpdateView):
     """
     ドキュメントセクション更新ビュー
@@ -366,7 +766,7 @@ class DocumentSectionUpdateView(LoginRequiredMixin, UpdateView):
     template_name = 'documents/document_section_form.html'
 
     def get_queryset(self):
-        return DocumentSection.objects.filter(document__project__owner=self.request.user)
+        return DocumentSection.objects.filter(document__project__owner=self.request.user).select_related('document')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -375,3 +775,87 @@ class DocumentSectionUpdateView(LoginRequiredMixin, UpdateView):
 
     def get_success_url(self):
         return reverse('document_detail', kwargs={'pk': self.object.document.pk})
+
+
+def _export_filename(name, export_format):
+    return f"{name}.{EXPORT_FORMATS[export_format]['extension']}"
+
+
+@login_required
+def export_document(request, pk, export_format):
+    """
+    ドキュメントを Markdown / HTML / DOCX としてダウンロードするビュー
+
+    セクションは1件ずつ変換しながら送信するため、ドキュメントの大きさに関わらずメモリ使用量は一定。
+    ASGIでは非同期イテレータとして送信する（同期イテレータはすべて読み込んでから送信されるため）。
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise Http404
+    document = get_object_or_404(Document, pk=pk, project__owner=request.user)
+
+    response = streaming_response(
+        request,
+        export_documents(Document.objects.filter(pk=document.pk), export_format),
+        content_type=EXPORT_FORMATS[export_format]['content_type'],
+    )
+    response['Content-Disposition'] = content_disposition_header(
+        True, _export_filename(document.title, export_format)
+    )
+    return response
+
+
+@login_required
+def export_project(request, pk):
+    """
+    プロジェクトのすべてのドキュメントのエクスポートをバックグラウンドで開始するAPIビュー
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POSTメソッドのみ許可されています。'}, status=405)
+
+    project = get_object_or_404(Project, pk=pk, owner=request.user)
+    export_format = request.POST.get('format', 'md')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'success': False, 'error': '対応していない形式です。'}, status=400)
+
+    job_id = uuid.uuid4().hex
+    set_export_state(job_id, status='pending', owner_id=request.user.id,
+                     filename=_export_filename(project.name, export_format))
+
+    from .tasks import export_project_task
+    export_project_task.delay(job_id, project.id, export_format)
+
+    return JsonResponse({
+        'success': True,
+        'job_id': job_id,
+        'status_url': reverse('export_status', kwargs={'job_id': job_id}),
+    })
+
+
+def _get_export_state(request, job_id):
+    state = get_export_state(job_id)
+    if state is None or state['owner_id'] != request.user.id:
+        raise Http404
+    return state
+
+
+@login_required
+def export_status(request, job_id):
+    """
+    エクスポートジョブの状態を取得するAPIビュー（完了時はダウンロードURLを含める）
+    """
+    state = _get_export_state(request, job_id)
+    data = {'status': state['status'], 'error_message': state.get('error_message', '')}
+    if state['status'] == 'completed':
+        data['download_url'] = reverse('export_download', kwargs={'job_id': job_id})
+    return JsonResponse(data)
+
+
+@login_required
+def export_download(request, job_id):
+    """
+    エクスポートしたファイルをダウンロードするビュー
+    """
+    state = _get_export_state(request, job_id)
+    if state['status'] != 'completed' or not default_storage.exists(state['path']):
+        raise Http404
+    return FileResponse(default_storage.open(state['path'], 'rb'), as_attachment=True, filename=state['filename'])
@@ -3,6 +3,9 @@ ASGI config for doqment project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The generation progress stream (Server-Sent Events) is an async view and must be
+served through this module, e.g. ``uvicorn doqment.asgi:application``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -97,6 +97,25 @@ DATABASES = {
 }
 
 
+# Cache
+# CACHE_URL（例: redis://localhost:6379/1）が設定されている場合はRedisを使用する。
+# 生成の進捗状況はWebとCeleryワーカーで共有されるため、本番環境ではRedisを設定すること。
+
+if os.environ.get('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -138,6 +157,10 @@ STATICFILES_DIRS = [
 ]
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# エクスポートしたファイルなどの保存先
+MEDIA_URL = '/media/'
+MEDIA_ROOT = os.environ.get('MEDIA_ROOT', os.path.join(BASE_DIR, 'media'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -156,6 +179,49 @@ LOGOUT_REDIRECT_URL = 'home'
 
 # OpenAI API configuration
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
+# セクション生成時に同時に送信するリクエストの最大数
+OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', '4'))
+
+# LLMバックエンド
+# core.llm_backends.FakeLLMBackend を指定するとネットワークを使用せずに応答を返す（負荷試験用）
+LLM_BACKEND = {
+    'BACKEND': os.environ.get('LLM_BACKEND', 'core.llm_backends.OpenAIBackend'),
+    'OPTIONS': {},
+}
+if LLM_BACKEND['BACKEND'] == 'core.llm_backends.FakeLLMBackend':
+    LLM_BACKEND['OPTIONS'] = {
+        'latency': float(os.environ.get('LLM_FAKE_LATENCY', '0.5')),
+        'distribution': os.environ.get('LLM_FAKE_DISTRIBUTION', 'constant'),
+        'jitter': float(os.environ.get('LLM_FAKE_JITTER', '0')),
+        'failure_rate': float(os.environ.get('LLM_FAKE_FAILURE_RATE', '0')),
+        'batch_delay': float(os.environ.get('LLM_FAKE_BATCH_DELAY', '0')),
+    }
+
+# LLM呼び出しのレート制限（全ワーカーで共有）
+# REDIS_URL が未設定の場合はプロセスごとの制限になる
+LLM_RATE_LIMIT = {
+    'REQUESTS_PER_MINUTE': int(os.environ.get('LLM_REQUESTS_PER_MINUTE', '500')),
+    'TOKENS_PER_MINUTE': int(os.environ.get('LLM_TOKENS_PER_MINUTE', '40000')),
+    'REDIS_URL': os.environ.get('LLM_RATE_LIMIT_REDIS_URL', os.environ.get('CACHE_URL', '')),
+}
+# 429やタイムアウト時に同時実行数を下げ、成功時に上げる（AIMD）
+LLM_CONCURRENCY = {
+    'INITIAL': OPENAI_MAX_CONCURRENCY,
+    'MIN': 1,
+    'MAX': int(os.environ.get('LLM_MAX_CONCURRENCY', '16')),
+}
+# 429やタイムアウト時の最大再試行回数
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+
+# LLMレスポンスキャッシュ
+# BACKEND: core.llm_cache.LocMemLLMCache / DjangoLLMCache / DatabaseLLMCache（空の場合は無効）
+LLM_CACHE = {
+    'BACKEND': os.environ.get('LLM_CACHE_BACKEND', 'core.llm_cache.LocMemLLMCache'),
+    'OPTIONS': {
+        'ttl': int(os.environ.get('LLM_CACHE_TTL', str(60 * 60 * 24 * 7))),
+        'max_entries': int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '1000')),
+    },
+}
 
 # Celery settings
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
@@ -164,3 +230,99 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Trueの場合、タスクをワーカーに送らずその場で実行する（開発・テスト用）
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER', 'False') == 'True'
+# 遅延モードの一括生成のバッチジョブを確認する間隔（秒）
+GENERATION_BATCH_POLL_INTERVAL = float(os.environ.get('GENERATION_BATCH_POLL_INTERVAL', '60'))
+CELERY_BEAT_SCHEDULE = {
+    'poll-generation-batches': {
+        'task': 'documents.tasks.poll_generation_batches_task',
+        'schedule': GENERATION_BATCH_POLL_INTERVAL,
+    },
+    'flush-llm-request-log': {
+        'task': 'core.tasks.flush_request_log_task',
+        'schedule': 60,
+    },
+    'archive-openai-requests': {
+        'task': 'core.tasks.archive_openai_requests_task',
+        'schedule': 60 * 60 * 24,
+    },
+}
+
+# LLM呼び出しの記録（OpenAIRequest）の保存方法
+# BACKEND: core.request_log.RedisRequestLog（Redisのリストにためる）/ BufferedRequestLog（プロセス内にためてまとめて保存）/
+#          ImmediateRequestLog（呼び出しごとに保存）
+# max_batch 件たまるか flush_interval 秒経過した場合と、リクエスト・タスク・プロセスの終了時に bulk_create で保存する
+# Redis（LLM_REQUEST_LOG_REDIS_URL または CACHE_URL）が設定されている場合は RedisRequestLog を既定とし、
+# プロセスが異常終了しても記録は失われない。BufferedRequestLog ではプロセスが強制終了（SIGKILL・OOM Killer など）
+# された場合、最後に保存してからの記録（最大で max_batch - 1 件、flush_interval 秒分）が失われる。
+LLM_REQUEST_LOG_REDIS_URL = os.environ.get('LLM_REQUEST_LOG_REDIS_URL', os.environ.get('CACHE_URL', ''))
+LLM_REQUEST_LOG = {
+    'BACKEND': os.environ.get(
+        'LLM_REQUEST_LOG_BACKEND',
+        'core.request_log.RedisRequestLog' if LLM_REQUEST_LOG_REDIS_URL else 'core.request_log.BufferedRequestLog',
+    ),
+    'OPTIONS': {
+        'max_batch': int(os.environ.get('LLM_REQUEST_LOG_MAX_BATCH', '50')),
+        'flush_interval': float(os.environ.get('LLM_REQUEST_LOG_FLUSH_INTERVAL', '5')),
+    },
+}
+if LLM_REQUEST_LOG['BACKEND'] == 'core.request_log.RedisRequestLog':
+    LLM_REQUEST_LOG['OPTIONS']['url'] = LLM_REQUEST_LOG_REDIS_URL
+
+# OpenAIRequest の保持日数（超えた記録はファイルストレージの archives/ にアーカイブして削除する。0 の場合は削除しない）
+OPENAI_REQUEST_RETENTION_DAYS = int(os.environ.get('OPENAI_REQUEST_RETENTION_DAYS', '90'))
+
+# ドキュメント生成をセクションごとのサブタスクに分割して複数のワーカーで実行する
+GENERATION_FANOUT = os.environ.get('GENERATION_FANOUT', 'False') == 'True'
+
+# 複数ドキュメントの一括生成で同時に送信するAPIリクエストの最大数（バッチごとの上限）
+GENERATION_BATCH_MAX_CONCURRENCY = int(os.environ.get('GENERATION_BATCH_MAX_CONCURRENCY', '8'))
+
+# ストリーミングで生成し、受信途中の内容を配信する（fanout 時は無効）
+GENERATION_STREAMING = os.environ.get('GENERATION_STREAMING', 'False') == 'True'
+# 受信途中の内容をセクションに保存する最小間隔（秒）
+GENERATION_PARTIAL_SAVE_INTERVAL = float(os.environ.get('GENERATION_PARTIAL_SAVE_INTERVAL', '2.0'))
+
+# 長い製品説明をドキュメントごとに1回要約し、セクションのプロンプトで全文の代わりに使用する
+# （SectionTemplate.use_product_digest が False のセクションは全文を使用する）
+PRODUCT_DIGEST_ENABLED = os.environ.get('PRODUCT_DIGEST_ENABLED', 'False') == 'True'
+# 要約する製品説明の最小文字数と、要約の最大出力トークン数
+PRODUCT_DIGEST_MIN_LENGTH = int(os.environ.get('PRODUCT_DIGEST_MIN_LENGTH', '2000'))
+PRODUCT_DIGEST_MAX_TOKENS = int(os.environ.get('PRODUCT_DIGEST_MAX_TOKENS', '800'))
+
+# 長い製品説明をチャンクに分割し、セクションのプロンプトにはテンプレートに関連する上位のチャンクのみを含める
+# （要約を使用するセクションには適用しない）
+PRODUCT_RETRIEVAL_ENABLED = os.environ.get('PRODUCT_RETRIEVAL_ENABLED', 'False') == 'True'
+PRODUCT_RETRIEVAL_MIN_LENGTH = int(os.environ.get('PRODUCT_RETRIEVAL_MIN_LENGTH', '3000'))
+PRODUCT_RETRIEVAL_TOP_K = int(os.environ.get('PRODUCT_RETRIEVAL_TOP_K', '4'))
+PRODUCT_RETRIEVAL_CHUNK_SIZE = int(os.environ.get('PRODUCT_RETRIEVAL_CHUNK_SIZE', '500'))
+
+# セクションの生成方法: 'per_section'（セクションごとにリクエスト）または
+# 'combined'（複数のセクションを1回のリクエストでまとめて生成する。fanout・ストリーミング時は無効）
+GENERATION_STRATEGY = os.environ.get('GENERATION_STRATEGY', 'per_section')
+# まとめて生成する場合の1リクエストあたりの最大セクション数と最大出力トークン数
+GENERATION_COMBINED_MAX_SECTIONS = int(os.environ.get('GENERATION_COMBINED_MAX_SECTIONS', '10'))
+GENERATION_COMBINED_MAX_OUTPUT_TOKENS = int(os.environ.get('GENERATION_COMBINED_MAX_OUTPUT_TOKENS', '4000'))
+# モデルのコンテキストウィンドウ（トークン数）
+LLM_CONTEXT_WINDOW = int(os.environ.get('LLM_CONTEXT_WINDOW', '8192'))
+
+# 生成の進捗状況をキャッシュに書き込む最小間隔（秒）と保持期間（秒）
+GENERATION_PROGRESS_INTERVAL = float(os.environ.get('GENERATION_PROGRESS_INTERVAL', '0.5'))
+GENERATION_PROGRESS_TIMEOUT = 60 * 60
+
+# 進捗状況の Server-Sent Events 配信: キャッシュの確認間隔（秒）と1接続あたりの最大時間（秒）
+GENERATION_EVENTS_POLL_INTERVAL = float(os.environ.get('GENERATION_EVENTS_POLL_INTERVAL', '0.25'))
+GENERATION_EVENTS_TIMEOUT = 10 * 60
+
+# プロジェクトのエクスポートジョブの状態をキャッシュに保持する期間（秒）
+EXPORT_JOB_TIMEOUT = int(os.environ.get('EXPORT_JOB_TIMEOUT', str(60 * 60 * 24)))
+
+# 仕様書ファイルのアップロード: 最大サイズ（バイト）と、抽出したテキストを保存するチャンクの文字数
+# FILE_UPLOAD_MAX_MEMORY_SIZE（既定 2.5MB）を超えるファイルは一時ファイルに書き出される
+SPECIFICATION_MAX_UPLOAD_SIZE = int(os.environ.get('SPECIFICATION_MAX_UPLOAD_SIZE', str(50 * 1024 * 1024)))
+SPECIFICATION_CHUNK_SIZE = int(os.environ.get('SPECIFICATION_CHUNK_SIZE', '4000'))
+# この文字数を超える仕様書は全文をプロンプトに含めず、セクションごとに関連するチャンクを
+# SPECIFICATION_RETRIEVAL_TOP_K 件ずつ含める（全文を読み込まないため、メモリ使用量も抑えられる）
+SPECIFICATION_INLINE_MAX_LENGTH = int(os.environ.get('SPECIFICATION_INLINE_MAX_LENGTH', '20000'))
+SPECIFICATION_RETRIEVAL_TOP_K = int(os.environ.get('SPECIFICATION_RETRIEVAL_TOP_K', '2'))
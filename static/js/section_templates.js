@@ -56,9 +56,12 @@ document.addEventListener('DOMContentLoaded', function() {
             })
             .then(response => response.json())
             .then(data => {
-                if (data.success) {
+                if (data.success && data.replaced) {
+                    // 共有ライブラリのテンプレートがプロジェクト専用にコピーされた場合はIDが変わるため再読み込みする
+                    window.location.reload();
+                } else if (data.success) {
                     // 新しいテンプレートをDOMに追加
-                    const newTemplate = createTemplateElement(data.template_id, data.template_title);
+                    const newTemplate = createTemplateElement(data.template_id, data.template_title, data.template_order);
                     templatesContainer.appendChild(newTemplate);
                     
                     // モーダルを閉じる
@@ -83,11 +86,13 @@ document.addEventListener('DOMContentLoaded', function() {
     /**
      * テンプレート要素を作成する
      */
-    function createTemplateElement(id, title) {
+    function createTemplateElement(id, title, order) {
         const template = document.createElement('div');
         template.className = 'bg-white p-4 rounded-lg shadow-sm mb-4 cursor-move';
         template.dataset.id = id;
-        
+        template.dataset.order = order;
+        template.dataset.version = 1;
+
         template.innerHTML = `
             <div class="flex justify-between items-center">
                 <h3 class="font-medium text-gray-900">${title}</h3>
@@ -118,26 +123,57 @@ document.addEventListener('DOMContentLoaded', function() {
     
     /**
      * テンプレートの順序を更新する
+     *
+     * 順序が変わったテンプレートのみを一括編集APIに送信する。
+     * 他のユーザーが先に変更していた場合（409）は再読み込みを促す。
      */
     function updateTemplateOrder() {
-        const templateIds = Array.from(templatesContainer.children).map(el => el.dataset.id);
-        
-        const formData = new FormData();
-        formData.append('csrfmiddlewaretoken', csrfToken);
-        templateIds.forEach(id => {
-            formData.append('template_ids[]', id);
+        const changes = [];
+        Array.from(templatesContainer.children).forEach((el, index) => {
+            if (!el.dataset.id) {
+                return;
+            }
+            const order = index + 1;
+            if (parseInt(el.dataset.order, 10) !== order) {
+                changes.push({
+                    id: parseInt(el.dataset.id, 10),
+                    version: parseInt(el.dataset.version, 10),
+                    order: order
+                });
+            }
         });
-        
-        fetch('/templates/update-order/', {
+
+        if (changes.length === 0) {
+            return;
+        }
+
+        fetch(`/projects/${projectId}/templates/bulk/`, {
             method: 'POST',
-            body: formData,
+            body: JSON.stringify({update: changes}),
             headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': csrfToken,
                 'X-Requested-With': 'XMLHttpRequest'
             }
         })
-        .then(response => response.json())
-        .then(data => {
-            if (!data.success) {
+        .then(response => response.json().then(data => ({status: response.status, data: data})))
+        .then(({status, data}) => {
+            if (data.success && Object.keys(data.replaced).length > 0) {
+                // 共有ライブラリのテンプレートがプロジェクト専用にコピーされた場合はIDが変わるため再読み込みする
+                window.location.reload();
+            } else if (data.success) {
+                // 保存後の順序とバージョンを反映
+                data.templates.forEach(template => {
+                    const el = templatesContainer.querySelector(`[data-id="${template.id}"]`);
+                    if (el) {
+                        el.dataset.order = template.order;
+                        el.dataset.version = template.version;
+                    }
+                });
+            } else if (status === 409) {
+                alert(data.error);
+                window.location.reload();
+            } else {
                 alert('順序の更新に失敗しました: ' + data.error);
             }
         })